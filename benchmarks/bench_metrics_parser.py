@@ -0,0 +1,99 @@
+"""
+Microbenchmark of the backend `/metrics` parsing used by the metrics poller.
+
+Compares, on recorded vLLM and llama.cpp payloads (`benchmarks/data/`):
+- `prometheus_client`: decode the body and walk `text_string_to_metric_families`
+  until the load gauges are found (the previous implementation),
+- `scanner`: `core/metrics_scraper.parse_metrics` on the complete body,
+- `scanner (chunked)`: the same scanner fed in 16 KiB chunks as the streaming
+  scraper sees them, stopping once every wanted metric has been read.
+
+Usage:
+    python benchmarks/bench_metrics_parser.py [--iterations 2000]
+"""
+
+import argparse
+import os
+import sys
+import time
+from typing import Callable, Dict, List
+
+from prometheus_client.parser import text_string_to_metric_families
+
+# constants.py requires BACKENDS to be set; the benchmark never talks to them.
+os.environ.setdefault("BACKENDS", "http://bench")
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from inference_engine_proxy_server.backends.llamacpp import LLAMACPP_METRICS  # noqa: E402
+from inference_engine_proxy_server.backends.vllm import VLLM_METRICS  # noqa: E402
+from inference_engine_proxy_server.core.metrics_scraper import (  # noqa: E402
+    parse_metrics,
+    parse_metrics_chunks,
+)
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), "data")
+CHUNK_SIZE = 16 * 1024
+
+# (payload file, wanted map, gauge families the previous implementation looked for)
+PAYLOADS = {
+    "vllm": ("vllm_metrics.txt", VLLM_METRICS,
+             ("vllm:num_requests_running", "vllm:num_requests_waiting")),
+    "llamacpp": ("llamacpp_metrics.txt", LLAMACPP_METRICS,
+                 ("llamacpp:requests_processing", "llamacpp:requests_deferred")),
+}
+
+
+def prometheus_client_parse(payload: bytes, families: tuple) -> Dict[str, float]:
+    processing_name, deferred_name = families
+    values: Dict[str, float] = {}
+    for family in text_string_to_metric_families(payload.decode()):
+        if family.name == processing_name:
+            values["requests_processing"] = family.samples[0].value
+        if family.name == deferred_name:
+            values["requests_deferred"] = family.samples[0].value
+        if len(values) == 2:
+            break
+    return values
+
+
+def bench(fn: Callable[[], object], iterations: int) -> float:
+    """Returns the mean time per call in microseconds."""
+    fn()  # warm-up
+    start = time.perf_counter()
+    for _ in range(iterations):
+        fn()
+    return (time.perf_counter() - start) / iterations * 1e6
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=2000)
+    args = parser.parse_args()
+
+    for engine, (filename, wanted, families) in PAYLOADS.items():
+        with open(os.path.join(DATA_DIR, filename), "rb") as f:
+            payload = f.read()
+        chunks: List[bytes] = [payload[i:i + CHUNK_SIZE] for i in range(0, len(payload), CHUNK_SIZE)]
+
+        expected = prometheus_client_parse(payload, families)
+        snapshot = parse_metrics(payload, wanted)
+        assert snapshot.requests_processing == expected["requests_processing"], engine
+        assert snapshot.requests_deferred == expected["requests_deferred"], engine
+        assert parse_metrics_chunks(chunks, wanted) == snapshot, engine
+
+        lines = payload.count(b"\n")
+        print(f"\n=== {engine}: {len(payload)} bytes, {lines} lines ===")
+        print(f"snapshot: {snapshot}")
+        baseline = bench(lambda: prometheus_client_parse(payload, families), args.iterations)
+        results = [
+            ("prometheus_client", baseline),
+            ("scanner", bench(lambda: parse_metrics(payload, wanted), args.iterations)),
+            ("scanner (chunked)", bench(lambda: parse_metrics_chunks(chunks, wanted), args.iterations)),
+        ]
+        print(f"{'parser':<20}{'us/scrape':>12}{'speedup':>10}")
+        for name, micros in results:
+            print(f"{name:<20}{micros:>12.1f}{baseline / micros:>9.1f}x")
+
+
+if __name__ == "__main__":
+    main()
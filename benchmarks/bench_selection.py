@@ -0,0 +1,89 @@
+"""
+Microbenchmark of the backend selection path (`core/functions._select_backend`).
+
+Fills the backend state table (`core/backend_state.py`) with N ready backends with
+random loads and measures, per request:
+- `index`: `least_requests`, which takes the head of the load index,
+- `scan`: the same strategy when the request needs a subset of the backends
+  (a `model` served by half of them), which falls back to scanning that subset,
+- `p2c`: a strategy without an index, which draws two backends at random,
+- `acquire+release`: counting a request in flight and done again, which moves the
+  backend in the load index twice.
+
+Usage:
+    python benchmarks/bench_selection.py [--backends 10 100 1000] [--iterations 20000]
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+from typing import Callable, List
+
+# constants.py requires BACKENDS to be set; the benchmark never talks to them.
+os.environ.setdefault("BACKENDS", "http://bench")
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from inference_engine_proxy_server.core import backend_state, functions, inflight, models, strategies  # noqa: E402
+from inference_engine_proxy_server.core.constants import BACKENDS  # noqa: E402
+
+
+def populate(count: int, seed: int = 0) -> List[str]:
+    """Replaces the configured backends with `count` ready ones; every other one also serves model "b"."""
+    rng = random.Random(seed)
+    for backend_url in list(backend_state._STATES):
+        backend_state.remove_state(backend_url)
+    urls = [f"http://bench-{i}:8080" for i in range(count)]
+    BACKENDS[:] = urls
+    for i, backend_url in enumerate(urls):
+        state = backend_state.ensure_state(backend_url)
+        served = [{"id": "a"}, {"id": "b"}] if i % 2 else [{"id": "a"}]
+        state.set_static({"provider": "vllm", "model_name": "a", "models": served})
+        state.set_dynamic({
+            "timestamp": time.time() + 3600,   # stays fresh for the whole run
+            "requests_processing": rng.randint(0, 2),
+            "inflight_at_poll": 0,
+            "ready": True,
+        })
+    models.rebuild_model_index()
+    return urls
+
+
+def use_strategy(name: str) -> None:
+    strategies._strategy = strategies.create_strategy(name)
+    backend_state.refresh_all()
+
+
+def bench(fn: Callable[[], object], iterations: int) -> float:
+    """Returns the mean time per call in microseconds."""
+    fn()  # warm-up
+    start = time.perf_counter()
+    for _ in range(iterations):
+        fn()
+    return (time.perf_counter() - start) / iterations * 1e6
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backends", type=int, nargs="+", default=[10, 100, 1000])
+    parser.add_argument("--iterations", type=int, default=20000)
+    args = parser.parse_args()
+
+    print(f"{'backends':>8}{'index':>12}{'scan':>12}{'p2c':>12}{'acquire+release':>18}   (us/request)")
+    for count in args.backends:
+        urls = populate(count)
+        use_strategy("least_requests")
+        head = backend_state.get_load_index().peek()
+        assert backend_state.get_state(functions._select_backend(None, None, None, None).backend_url).key == head.key
+        index = bench(lambda: functions._select_backend(None, None, None, None), args.iterations)
+        scan = bench(lambda: functions._select_backend(None, None, "b", None), args.iterations)
+        middle = urls[count // 2]
+        cycle = bench(lambda: (inflight.acquire(middle), inflight.release(middle)), args.iterations)
+        use_strategy("p2c")
+        p2c = bench(lambda: functions._select_backend(None, None, None, None), args.iterations)
+        print(f"{count:>8}{index:>12.2f}{scan:>12.2f}{p2c:>12.2f}{cycle:>18.2f}")
+
+
+if __name__ == "__main__":
+    main()
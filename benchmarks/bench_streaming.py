@@ -0,0 +1,128 @@
+"""
+Proxy CPU cost of SSE streaming, with and without chunk coalescing.
+
+Starts `mock_engine.py` and the proxy as separate uvicorn processes, streams
+`--streams` concurrent chat completions of `--tokens` tokens through the proxy and
+reports the CPU time the proxy process spent per 1k streamed tokens (from /proc,
+so Linux only), once with STREAM_COALESCE_ENABLED=false (plain passthrough) and
+once with coalescing on.
+
+Usage:
+    python benchmarks/bench_streaming.py [--streams 64] [--tokens 512] [--tokens-per-second 400]
+"""
+
+import argparse
+import asyncio
+import os
+import socket
+import subprocess
+import sys
+import time
+from typing import Dict, List
+
+import httpx
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+CLOCK_TICKS = os.sysconf("SC_CLK_TCK")
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def cpu_seconds(pid: int) -> float:
+    """User + system CPU time of a process."""
+    with open(f"/proc/{pid}/stat") as f:
+        fields = f.read().rsplit(")", 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / CLOCK_TICKS
+
+
+def start_server(app: str, app_dir: str, port: int, env: Dict[str, str]) -> subprocess.Popen:
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", app, "--app-dir", app_dir, "--port", str(port), "--log-level", "warning"],
+        env={**os.environ, **env},
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+
+
+async def wait_ready(url: str, timeout: float = 30.0) -> None:
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as client:
+        while time.monotonic() < deadline:
+            try:
+                r = await client.get(url)
+                if r.status_code == 200 and r.json().get("status", "ok") == "ok":
+                    return
+            except httpx.HTTPError:
+                pass
+            await asyncio.sleep(0.2)
+    raise RuntimeError(f"{url} did not become ready")
+
+
+async def stream_once(client: httpx.AsyncClient, tokens: int) -> int:
+    received = 0
+    payload = {"model": "mock", "stream": True, "max_tokens": tokens, "messages": [{"role": "user", "content": "hi"}]}
+    async with client.stream("POST", "/v1/chat/completions", json=payload) as r:
+        async for chunk in r.aiter_bytes():
+            received += chunk.count(b"data: {")
+    return received
+
+
+async def run_mode(coalesce: bool, engine_url: str, args) -> Dict[str, float]:
+    port = free_port()
+    proxy = start_server(
+        "inference_engine_proxy_server.server:app", os.path.join(ROOT, "src"), port,
+        {
+            "BACKENDS": engine_url,
+            "MAX_ALLOWED_REQUEST_QUEUE": str(args.streams * 4),
+            "STREAM_COALESCE_ENABLED": "true" if coalesce else "false",
+        },
+    )
+    try:
+        base_url = f"http://127.0.0.1:{port}"
+        await wait_ready(f"{base_url}/health")
+        limits = httpx.Limits(max_connections=args.streams, max_keepalive_connections=args.streams)
+        async with httpx.AsyncClient(base_url=base_url, timeout=120, limits=limits) as client:
+            await stream_once(client, 16)  # warm-up
+            cpu_before = cpu_seconds(proxy.pid)
+            start = time.monotonic()
+            counts: List[int] = await asyncio.gather(*[stream_once(client, args.tokens) for _ in range(args.streams)])
+            elapsed = time.monotonic() - start
+            cpu = cpu_seconds(proxy.pid) - cpu_before
+        tokens = sum(counts)
+        return {"tokens": tokens, "elapsed": elapsed, "cpu": cpu, "cpu_ms_per_1k": cpu * 1000 / tokens * 1000}
+    finally:
+        proxy.terminate()
+        proxy.wait()
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--streams", type=int, default=64, help="concurrent streams")
+    parser.add_argument("--tokens", type=int, default=512, help="tokens per stream")
+    parser.add_argument("--tokens-per-second", type=float, default=400, help="generation speed per stream")
+    args = parser.parse_args()
+
+    engine_port = free_port()
+    engine = start_server("mock_engine:app", os.path.dirname(os.path.abspath(__file__)), engine_port, {
+        "MOCK_TOKENS": str(args.tokens),
+        "MOCK_TOKENS_PER_SECOND": str(args.tokens_per_second),
+    })
+    try:
+        engine_url = f"http://127.0.0.1:{engine_port}"
+        await wait_ready(f"{engine_url}/health")
+        print(f"{args.streams} streams x {args.tokens} tokens at {args.tokens_per_second:g} tokens/s per stream")
+        print(f"{'mode':<14}{'tokens':>9}{'wall s':>9}{'proxy cpu s':>13}{'cpu ms / 1k tok':>17}")
+        for name, coalesce in (("passthrough", False), ("coalesced", True)):
+            r = await run_mode(coalesce, engine_url, args)
+            print(f"{name:<14}{r['tokens']:>9}{r['elapsed']:>9.2f}{r['cpu']:>13.2f}{r['cpu_ms_per_1k']:>17.1f}")
+    finally:
+        engine.terminate()
+        engine.wait()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
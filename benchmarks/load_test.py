@@ -0,0 +1,288 @@
+"""
+End-to-end load test of the proxy against in-process mock engines.
+
+Runs `--engines` `MockEngine`s (see `mock_engine.py`) on a background thread of this process,
+then drives them with a closed-loop async load generator (`--concurrency` clients sending
+chat completions for `--duration` seconds), first directly and then through the real
+`server:app` in its own uvicorn process. Per scenario it reports throughput, latency and
+TTFT percentiles, the latency the proxy adds over the direct run (same percentile, proxied
+minus direct), error counts by kind, and the proxy's CPU time and RSS (from /proc, so Linux only).
+
+Scenarios (`--scenario`, default all):
+    steady         no faults
+    kill-midstream engine 0 dies a third into the run, breaking its streams mid-response
+    slow-metrics   engine 0's /metrics takes `--metrics-delay` seconds to answer
+
+The proxy is restarted and every engine revived before each scenario.
+
+Usage:
+    python benchmarks/load_test.py [--engines 3] [--concurrency 64] [--duration 20] [--tokens 128]
+                                   [--tokens-per-second 200] [--chunk-tokens 1] [--ttft 0.05]
+                                   [--no-stream] [--scenario steady]
+"""
+
+import argparse
+import asyncio
+import os
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+import httpx
+import uvicorn
+
+from bench_streaming import ROOT, cpu_seconds, free_port, start_server
+from mock_engine import EngineSettings, MockEngine
+
+SCENARIOS = ("steady", "kill-midstream", "slow-metrics")
+
+
+@dataclass
+class Result:
+    latency: float
+    ttft: Optional[float]
+    tokens: int
+    error: Optional[str] = None   # None, an HTTP status, "truncated" or an exception name
+
+
+@dataclass
+class Report:
+    results: List[Result]
+    elapsed: float
+    cpu: float = 0.0
+    rss_mb: float = 0.0
+    peak_rss_mb: float = 0.0
+    errors: Dict[str, int] = field(default_factory=dict)
+
+    def ok(self) -> List[Result]:
+        return [r for r in self.results if r.error is None]
+
+
+def percentile(values: List[float], q: float) -> float:
+    if not values:
+        return float("nan")
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def rss_mb(pid: int) -> tuple:
+    """(current, peak) resident set size of a process in MiB."""
+    sizes = {}
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            if line.startswith(("VmRSS:", "VmHWM:")):
+                key, value = line.split(":", 1)
+                sizes[key] = int(value.split()[0]) / 1024
+    return sizes.get("VmRSS", 0.0), sizes.get("VmHWM", 0.0)
+
+
+# -------------------- mock engines --------------------
+
+class EngineCluster:
+    """Mock engines served by uvicorn on one background thread with its own event loop."""
+
+    def __init__(self, settings: List[EngineSettings]) -> None:
+        self.engines = [MockEngine(s) for s in settings]
+        self.ports = [free_port() for _ in self.engines]
+        self.urls = [f"http://127.0.0.1:{port}" for port in self.ports]
+        self._servers = [
+            uvicorn.Server(uvicorn.Config(engine.app, host="127.0.0.1", port=port, log_level="critical",
+                                          lifespan="off"))
+            for engine, port in zip(self.engines, self.ports)
+        ]
+        self._thread = threading.Thread(target=self._run, name="mock-engines", daemon=True)
+
+    def _run(self) -> None:
+        async def serve_all():
+            await asyncio.gather(*(server.serve() for server in self._servers))
+        asyncio.run(serve_all())
+
+    def start(self, timeout: float = 10.0) -> None:
+        self._thread.start()
+        deadline = time.monotonic() + timeout
+        while not all(server.started for server in self._servers):
+            if time.monotonic() > deadline:
+                raise RuntimeError("mock engines did not start")
+            time.sleep(0.05)
+
+    def stop(self) -> None:
+        for server in self._servers:
+            server.should_exit = True
+        self._thread.join(timeout=10)
+
+    def reset(self, metrics_delay: float = 0.0) -> None:
+        for engine in self.engines:
+            engine.revive()
+            engine.settings.metrics_delay_seconds = metrics_delay if engine is self.engines[0] else 0.0
+
+
+# -------------------- load generator --------------------
+
+async def send_one(client: httpx.AsyncClient, url: str, args) -> Result:
+    payload = {
+        "model": "mock",
+        "stream": args.stream,
+        "max_tokens": args.tokens,
+        "messages": [{"role": "user", "content": "benchmark " * args.prompt_words}],
+    }
+    start = time.monotonic()
+    ttft = None
+    tokens = 0
+    done = not args.stream
+    try:
+        async with client.stream("POST", url, json=payload) as r:
+            if r.status_code != 200:
+                await r.aread()
+                return Result(time.monotonic() - start, None, 0, str(r.status_code))
+            tail = b""
+            async for chunk in r.aiter_bytes():
+                if ttft is None:
+                    ttft = time.monotonic() - start
+                tokens += chunk.count(b"tok")
+                tail = (tail + chunk)[-64:]
+            if args.stream:
+                done = b"data: [DONE]" in tail
+    except httpx.HTTPError as e:
+        return Result(time.monotonic() - start, ttft, tokens, type(e).__name__)
+    latency = time.monotonic() - start
+    if not done:
+        return Result(latency, ttft, tokens, "truncated")
+    return Result(latency, ttft, tokens)
+
+
+async def generate_load(urls: List[str], args, fault=None) -> Report:
+    """
+    `args.concurrency` clients each send requests back to back until `args.duration` elapses.
+    `fault`, if given, is a coroutine function run alongside them to inject failures.
+    """
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    results: List[Result] = []
+    start = time.monotonic()
+    deadline = start + args.duration
+
+    async def client_loop(index: int) -> None:
+        n = index
+        while time.monotonic() < deadline:
+            results.append(await send_one(client, urls[n % len(urls)], args))
+            n += 1
+
+    async with httpx.AsyncClient(timeout=120, limits=limits) as client:
+        tasks = [asyncio.create_task(client_loop(i)) for i in range(args.concurrency)]
+        if fault is not None:
+            tasks.append(asyncio.create_task(fault()))
+        await asyncio.gather(*tasks)
+    report = Report(results, time.monotonic() - start)
+    for r in results:
+        if r.error is not None:
+            report.errors[r.error] = report.errors.get(r.error, 0) + 1
+    return report
+
+
+# -------------------- proxy --------------------
+
+async def wait_backends_ready(base_url: str, count: int, timeout: float = 30.0) -> None:
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as client:
+        while time.monotonic() < deadline:
+            try:
+                r = await client.get(f"{base_url}/health")
+                if len(r.json().get("available_backends", [])) >= count:
+                    return
+            except (httpx.HTTPError, ValueError):
+                pass
+            await asyncio.sleep(0.2)
+    raise RuntimeError(f"{base_url} did not see {count} ready backends")
+
+
+async def run_scenario(name: str, cluster: EngineCluster, args) -> Report:
+    cluster.reset(metrics_delay=args.metrics_delay if name == "slow-metrics" else 0.0)
+    port = free_port()
+    proxy = start_server(
+        "inference_engine_proxy_server.server:app", os.path.join(ROOT, "src"), port,
+        {
+            "BACKENDS": ",".join(cluster.urls),
+            "MAX_ALLOWED_REQUEST_QUEUE": str(args.concurrency * 2),
+            "STREAM_COALESCE_ENABLED": "true",
+        },
+    )
+    try:
+        base_url = f"http://127.0.0.1:{port}"
+        # A /metrics slower than POLL_DEADLINE_SECONDS takes engine 0 out of rotation
+        await wait_backends_ready(base_url, len(cluster.urls) - (name == "slow-metrics"))
+
+        async def kill_engine() -> None:
+            await asyncio.sleep(args.duration / 3)
+            cluster.engines[0].kill()
+
+        cpu_before = cpu_seconds(proxy.pid)
+        report = await generate_load([f"{base_url}/v1/chat/completions"], args,
+                                     fault=kill_engine if name == "kill-midstream" else None)
+        report.cpu = cpu_seconds(proxy.pid) - cpu_before
+        report.rss_mb, report.peak_rss_mb = rss_mb(proxy.pid)
+        return report
+    finally:
+        proxy.terminate()
+        proxy.wait()
+
+
+def print_report(name: str, report: Report, direct: Optional[Report]) -> None:
+    ok = report.ok()
+    latency = [r.latency for r in ok]
+    ttft = [r.ttft for r in ok if r.ttft is not None]
+    tokens = sum(r.tokens for r in report.results)
+    print(f"\n[{name}] {len(report.results)} requests in {report.elapsed:.1f}s, "
+          f"{len(report.results) - len(ok)} failed {report.errors or ''}")
+    print(f"  throughput   {len(ok) / report.elapsed:9.1f} req/s {tokens / report.elapsed:11.0f} tokens/s")
+    print(f"  latency      p50 {percentile(latency, 0.5) * 1000:8.1f} ms   p99 {percentile(latency, 0.99) * 1000:8.1f} ms")
+    print(f"  TTFT         p50 {percentile(ttft, 0.5) * 1000:8.1f} ms   p99 {percentile(ttft, 0.99) * 1000:8.1f} ms")
+    if direct is not None:
+        direct_latency = [r.latency for r in direct.ok()]
+        direct_ttft = [r.ttft for r in direct.ok() if r.ttft is not None]
+        for label, values, base in (("added lat.", latency, direct_latency), ("added TTFT", ttft, direct_ttft)):
+            p50 = (percentile(values, 0.5) - percentile(base, 0.5)) * 1000
+            p99 = (percentile(values, 0.99) - percentile(base, 0.99)) * 1000
+            print(f"  {label:<12} p50 {p50:8.2f} ms   p99 {p99:8.2f} ms")
+    if report.cpu:
+        print(f"  proxy        cpu {report.cpu:.2f} s ({report.cpu / report.elapsed * 100:.0f}% of a core, "
+              f"{report.cpu * 1000 / max(1, len(report.results)):.2f} ms/request), "
+              f"rss {report.rss_mb:.0f} MiB (peak {report.peak_rss_mb:.0f} MiB)")
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--engines", type=int, default=3, help="number of mock engines")
+    parser.add_argument("--provider", choices=("llamacpp", "vllm"), default="llamacpp")
+    parser.add_argument("--concurrency", type=int, default=64, help="concurrent clients")
+    parser.add_argument("--duration", type=float, default=20, help="seconds per run")
+    parser.add_argument("--tokens", type=int, default=128, help="tokens per response")
+    parser.add_argument("--tokens-per-second", type=float, default=200, help="generation speed per request")
+    parser.add_argument("--ttft", type=float, default=0.05, help="engine delay before the first token (s)")
+    parser.add_argument("--chunk-tokens", type=int, default=1, help="tokens per SSE event")
+    parser.add_argument("--prompt-words", type=int, default=50, help="words in each prompt")
+    parser.add_argument("--no-stream", dest="stream", action="store_false", help="non-streaming requests")
+    parser.add_argument("--metrics-delay", type=float, default=5.0, help="/metrics delay in slow-metrics (s)")
+    parser.add_argument("--scenario", choices=SCENARIOS + ("all",), default="all")
+    args = parser.parse_args()
+
+    settings = [
+        EngineSettings(provider=args.provider, tokens=args.tokens, tokens_per_second=args.tokens_per_second,
+                       ttft_seconds=args.ttft, chunk_tokens=args.chunk_tokens)
+        for _ in range(args.engines)
+    ]
+    cluster = EngineCluster(settings)
+    cluster.start()
+    try:
+        print(f"{args.engines} {args.provider} engines, {args.concurrency} clients x {args.duration:g}s, "
+              f"{args.tokens} tokens at {args.tokens_per_second:g} tokens/s, "
+              f"{'streaming' if args.stream else 'non-streaming'}")
+        direct = await generate_load([f"{url}/v1/chat/completions" for url in cluster.urls], args)
+        print_report("direct", direct, None)
+        for name in (SCENARIOS if args.scenario == "all" else (args.scenario,)):
+            print_report(name, await run_scenario(name, cluster, args), direct)
+    finally:
+        cluster.stop()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,192 @@
+"""
+Minimal OpenAI-compatible inference engine for benchmarks.
+
+Emulates enough of a llama.cpp `llama-server` (or vLLM with MOCK_PROVIDER=vllm) for the
+proxy to route to it: `/v1/models`, `/health`, `/metrics`, `/props` and streaming / non-streaming
+`chat/completions` and `completions` that emit tokens at a fixed rate.
+
+Settings (environment variables):
+    MOCK_MODEL                 model id served (default: mock)
+    MOCK_PROVIDER              llamacpp | vllm (default: llamacpp)
+    MOCK_TOKENS                tokens per response unless max_tokens is smaller (default: 256)
+    MOCK_TOKENS_PER_SECOND     generation speed per request (default: 200)
+    MOCK_TTFT_SECONDS          delay before the first token (default: 0.05)
+    MOCK_CHUNK_TOKENS          tokens per SSE event (default: 1)
+    MOCK_METRICS_DELAY_SECONDS delay before /metrics answers (default: 0)
+    MOCK_CONTEXT_WINDOW        max_model_len / n_ctx reported (default: 8192)
+
+Usage:
+    python -m uvicorn mock_engine:app --app-dir benchmarks --port 9001
+
+`MockEngine` builds the same app from an `EngineSettings` so a benchmark can run several
+engines in one process and inject failures at runtime (`kill()` / `revive()`, or changing
+`settings` while it runs).
+"""
+
+import asyncio
+import json
+import os
+import time
+from dataclasses import dataclass
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+
+
+@dataclass
+class EngineSettings:
+    model: str = "mock"
+    provider: str = "llamacpp"
+    tokens: int = 256
+    tokens_per_second: float = 200
+    ttft_seconds: float = 0.05
+    chunk_tokens: int = 1
+    metrics_delay_seconds: float = 0.0
+    context_window: int = 8192
+
+    @classmethod
+    def from_env(cls) -> "EngineSettings":
+        return cls(
+            model=os.getenv("MOCK_MODEL", "mock"),
+            provider=os.getenv("MOCK_PROVIDER", "llamacpp"),
+            tokens=int(os.getenv("MOCK_TOKENS", "256")),
+            tokens_per_second=float(os.getenv("MOCK_TOKENS_PER_SECOND", "200")),
+            ttft_seconds=float(os.getenv("MOCK_TTFT_SECONDS", "0.05")),
+            chunk_tokens=int(os.getenv("MOCK_CHUNK_TOKENS", "1")),
+            metrics_delay_seconds=float(os.getenv("MOCK_METRICS_DELAY_SECONDS", "0")),
+            context_window=int(os.getenv("MOCK_CONTEXT_WINDOW", "8192")),
+        )
+
+
+class EngineKilled(Exception):
+    """Raised inside running streams of a killed engine, so their connections break mid-response."""
+
+
+class MockEngine:
+    def __init__(self, settings: EngineSettings) -> None:
+        self.settings = settings
+        self.alive = True
+        self.processing = 0
+        self.prompt_tokens = 0
+        self.generation_tokens = 0
+        self.app = self._create_app()
+
+    def kill(self) -> None:
+        """Breaks every running stream at its next token; new requests and /health get 503."""
+        self.alive = False
+
+    def revive(self) -> None:
+        self.alive = True
+
+    def _metrics_text(self) -> str:
+        s = self.settings
+        if s.provider == "vllm":
+            labels = f'{{model_name="{s.model}"}}'
+            return (
+                f"vllm:num_requests_running{labels} {self.processing}\n"
+                f"vllm:num_requests_waiting{labels} 0\n"
+                f"vllm:kv_cache_usage_perc{labels} 0.0\n"
+                f"vllm:prompt_tokens_total{labels} {self.prompt_tokens}\n"
+                f"vllm:generation_tokens_total{labels} {self.generation_tokens}\n"
+            )
+        return (
+            f"llamacpp:prompt_tokens_seconds 1000\n"
+            f"llamacpp:predicted_tokens_seconds {s.tokens_per_second}\n"
+            f"llamacpp:requests_processing {self.processing}\n"
+            f"llamacpp:requests_deferred 0\n"
+        )
+
+    async def generate(self, n_tokens: int):
+        """Yields (index, text) per SSE event of `chunk_tokens` tokens."""
+        s = self.settings
+        self.processing += 1
+        try:
+            await asyncio.sleep(s.ttft_seconds)
+            start = time.monotonic()
+            for i in range(0, n_tokens, s.chunk_tokens):
+                # Pace by absolute time so the rate holds even when the event loop is busy
+                delay = start + i / s.tokens_per_second - time.monotonic()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                if not self.alive:
+                    raise EngineKilled(f"{s.model} killed")
+                count = min(s.chunk_tokens, n_tokens - i)
+                self.generation_tokens += count
+                yield i, "".join(f"tok{i + k} " for k in range(count))
+        finally:
+            self.processing -= 1
+
+    def _chunk(self, index: int, text: str, chat: bool) -> bytes:
+        if chat:
+            choice = {"index": 0, "delta": {"content": text}, "finish_reason": None}
+            obj = "chat.completion.chunk"
+        else:
+            choice = {"index": 0, "text": text, "finish_reason": None}
+            obj = "text_completion"
+        payload = {"id": "mock", "object": obj, "created": 0, "model": self.settings.model, "choices": [choice]}
+        return b"data: " + json.dumps(payload, separators=(",", ":")).encode() + b"\n\n"
+
+    async def _completion(self, request: Request, chat: bool):
+        if not self.alive:
+            return PlainTextResponse("engine down", status_code=503)
+        body = await request.json()
+        s = self.settings
+        n_tokens = min(s.tokens, int(body.get("max_tokens") or s.tokens))
+        self.prompt_tokens += len(json.dumps(body.get("messages") or body.get("prompt") or "")) // 4
+
+        if body.get("stream"):
+            async def events():
+                async for index, text in self.generate(n_tokens):
+                    yield self._chunk(index, text, chat)
+                yield b"data: [DONE]\n\n"
+            return StreamingResponse(events(), media_type="text/event-stream")
+
+        text = "".join([t async for _, t in self.generate(n_tokens)])
+        choice = {"index": 0, "message": {"role": "assistant", "content": text}} if chat else {"index": 0, "text": text}
+        choice["finish_reason"] = "length"
+        return JSONResponse({
+            "id": "mock", "object": "chat.completion" if chat else "text_completion", "created": 0, "model": s.model,
+            "choices": [choice],
+            "usage": {"prompt_tokens": 0, "completion_tokens": n_tokens, "total_tokens": n_tokens},
+        })
+
+    def _create_app(self) -> FastAPI:
+        app = FastAPI()
+
+        @app.get("/v1/models")
+        async def models():
+            s = self.settings
+            entry = {"id": s.model, "object": "model", "owned_by": s.provider}
+            if s.provider == "vllm":
+                entry["max_model_len"] = s.context_window
+            return {"object": "list", "data": [entry]}
+
+        @app.get("/health")
+        async def health():
+            if not self.alive:
+                return JSONResponse({"status": "error"}, status_code=503)
+            return {"status": "ok"}
+
+        @app.get("/props")
+        async def props():
+            return {"default_generation_settings": {"n_ctx": self.settings.context_window}}
+
+        @app.get("/metrics")
+        async def metrics():
+            if self.settings.metrics_delay_seconds > 0:
+                await asyncio.sleep(self.settings.metrics_delay_seconds)
+            return PlainTextResponse(self._metrics_text())
+
+        @app.post("/v1/chat/completions")
+        async def chat_completions(request: Request):
+            return await self._completion(request, chat=True)
+
+        @app.post("/v1/completions")
+        async def completions(request: Request):
+            return await self._completion(request, chat=False)
+
+        return app
+
+
+engine = MockEngine(EngineSettings.from_env())
+app = engine.app
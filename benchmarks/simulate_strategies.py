@@ -0,0 +1,206 @@
+"""
+Deterministic simulation of the load-balancing strategies in `core/strategies.py`.
+
+Replays seeded synthetic arrival traces against a pool of heterogeneous backends
+(big and small GPUs) and reports the queueing delay each strategy produces.
+Every backend serves up to `slots` requests at once and queues the rest; queueing
+delay is the time a request waits in that queue before a slot starts on it.
+token_aware sees each request's prompt / generation tokens (proportional to its
+service time) and each backend's token throughput, as the proxy does from /metrics.
+stream_latency sees each request's first token and, when it finishes, the rest of
+its tokens as SSE events, as the proxy does from the streams it forwards.
+
+Usage:
+    python benchmarks/simulate_strategies.py [--requests 20000] [--seed 42] [--load 0.85]
+"""
+
+import argparse
+import heapq
+import os
+import random
+import sys
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Deque, Dict, List, Tuple
+
+# constants.py requires BACKENDS to be set; the simulation never talks to them.
+os.environ.setdefault("BACKENDS", "http://sim")
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from inference_engine_proxy_server.core import backend_state, stream_stats  # noqa: E402
+from inference_engine_proxy_server.core.constants import _INFLIGHT_TOKENS  # noqa: E402
+from inference_engine_proxy_server.core.strategies import (  # noqa: E402
+    LeastRequestsStrategy,
+    LoadBalancingStrategy,
+    PeakEwmaStrategy,
+    PowerOfTwoChoicesStrategy,
+    StreamLatencyStrategy,
+    TokenAwareStrategy,
+    WeightedLeastConnectionsStrategy,
+)
+from inference_engine_proxy_server.core.token_estimator import TokenEstimate  # noqa: E402
+
+
+@dataclass
+class SimBackend:
+    url: str
+    slots: int
+    speed: float  # relative generation speed, 1.0 = reference GPU
+    running: int = 0
+    queue: Deque[Tuple[int, float]] = field(default_factory=deque)  # (request id, arrival time)
+
+    @property
+    def outstanding(self) -> int:
+        return self.running + len(self.queue)
+
+
+# Two large and two small GPUs: the small ones have half the slots at 40% speed.
+POOL = [
+    ("http://gpu-large-1", 8, 1.0),
+    ("http://gpu-large-2", 8, 1.0),
+    ("http://gpu-small-1", 4, 0.4),
+    ("http://gpu-small-2", 4, 0.4),
+]
+MEAN_SERVICE_SECONDS = 2.0  # on the reference GPU
+PREFILL_FRACTION = 0.1      # part of the service time before the first token
+# Per-slot throughput on the reference GPU; a request's tokens follow from its service time
+PROMPT_TOKENS_PER_SECOND = 2000.0
+GENERATION_TOKENS_PER_SECOND = 50.0
+
+
+def request_tokens(service: float) -> TokenEstimate:
+    return TokenEstimate(int(service * PREFILL_FRACTION * PROMPT_TOKENS_PER_SECOND),
+                         int(service * (1 - PREFILL_FRACTION) * GENERATION_TOKENS_PER_SECOND))
+
+
+def add_tokens(url: str, tokens: TokenEstimate, sign: int) -> None:
+    entry = _INFLIGHT_TOKENS.setdefault(url, [0, 0, 0])
+    entry[0] += sign * tokens.prompt_tokens
+    entry[1] += sign * tokens.max_tokens
+    entry[2] += sign
+
+
+def make_trace(kind: str, n: int, rate: float, rng: random.Random) -> List[Tuple[float, float]]:
+    """Returns [(arrival_time, service_seconds_on_reference_gpu)]."""
+    trace = []
+    t = 0.0
+    for i in range(n):
+        if kind == "steady":
+            t += rng.expovariate(rate)
+        else:  # bursty: 10x rate for 1/10 of the periods, quieter otherwise, same average
+            period = int(t // 5)
+            burst = period % 10 == 0
+            t += rng.expovariate(rate * (5.5 if burst else 0.55))
+        service = rng.lognormvariate(0, 0.6) * MEAN_SERVICE_SECONDS / 1.197  # mean ~= MEAN_SERVICE_SECONDS
+        trace.append((t, service))
+    return trace
+
+
+def simulate(strategy: LoadBalancingStrategy, trace: List[Tuple[float, float]], clock: List[float]) -> List[float]:
+    backends = {url: SimBackend(url, slots, speed) for url, slots, speed in POOL}
+    services: Dict[int, Tuple[str, float]] = {}
+    delays: List[float] = []
+    # events: (time, order, kind, request id); kind 0 = finish, 1 = first token, 2 = arrival
+    events: List[Tuple[float, int, int, int]] = []
+    order = 0
+    starts: Dict[int, float] = {}
+    recorders: Dict[int, stream_stats.StreamRecorder] = {}
+    _INFLIGHT_TOKENS.clear()
+    for b in backends.values():
+        stream_stats.forget(b.url)
+        state = backend_state.ensure_state(b.url)
+        state.prompt_tokens_per_second = b.slots * b.speed * PROMPT_TOKENS_PER_SECOND
+        state.generation_tokens_per_second = b.slots * b.speed * GENERATION_TOKENS_PER_SECOND
+
+    def start(backend: SimBackend, rid: int, arrival: float, now: float) -> None:
+        nonlocal order
+        backend.running += 1
+        delays.append(now - arrival)
+        starts[rid] = arrival
+        duration = services[rid][1] / backend.speed
+        order += 1
+        heapq.heappush(events, (now + duration * PREFILL_FRACTION, order, 1, rid))
+        order += 1
+        heapq.heappush(events, (now + duration, order, 0, rid))
+
+    for rid, (arrival, _) in enumerate(trace):
+        order += 1
+        heapq.heappush(events, (arrival, order, 2, rid))
+
+    while events:
+        now, _, kind, rid = heapq.heappop(events)
+        clock[0] = now
+        if kind == 2:
+            candidates = [(b.url, float(b.outstanding)) for b in backends.values()]
+            tokens = request_tokens(trace[rid][1])
+            url = strategy.select(candidates, tokens)
+            backend = backends[url]
+            services[rid] = (url, trace[rid][1])
+            add_tokens(url, tokens, 1)
+            if backend.running < backend.slots:
+                start(backend, rid, now, now)
+            else:
+                backend.queue.append((rid, now))
+        elif kind == 1:
+            url = services[rid][0]
+            strategy.observe_ttft(url, now - starts[rid])
+            recorders[rid] = stream_stats.open_stream(url, starts[rid])
+            recorders[rid].feed(b"data: {}\n\n", now)
+        else:
+            backend = backends[services[rid][0]]
+            generated = request_tokens(services[rid][1]).max_tokens
+            recorders.pop(rid).feed(b"data: {}\n\n" * max(1, generated - 1), now)
+            backend.running -= 1
+            add_tokens(backend.url, request_tokens(services[rid][1]), -1)
+            if backend.queue:
+                next_rid, arrival = backend.queue.popleft()
+                start(backend, next_rid, arrival, now)
+    return delays
+
+
+def percentile(sorted_values: List[float], p: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(p / 100.0 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=20000)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--load", type=float, default=0.85, help="offered load as a fraction of pool capacity")
+    args = parser.parse_args()
+
+    capacity = sum(slots * speed for _, slots, speed in POOL) / MEAN_SERVICE_SECONDS  # requests / second
+    rate = capacity * args.load
+    weights = {url: slots * speed for url, slots, speed in POOL}
+
+    print(f"pool capacity ~{capacity:.1f} req/s, offered {rate:.1f} req/s, {args.requests} requests, seed {args.seed}")
+    print(f"{'trace':<8} {'strategy':<28} {'p50 (s)':>9} {'p99 (s)':>9} {'mean (s)':>9}")
+    for kind in ("steady", "bursty"):
+        trace = make_trace(kind, args.requests, rate, random.Random(args.seed))
+        for name in ("least_requests", "p2c", "weighted_least_connections", "peak_ewma", "token_aware",
+                     "stream_latency"):
+            clock = [0.0]
+            strategy: LoadBalancingStrategy
+            if name == "least_requests":
+                strategy = LeastRequestsStrategy()
+            elif name == "p2c":
+                strategy = PowerOfTwoChoicesStrategy()
+            elif name == "weighted_least_connections":
+                strategy = WeightedLeastConnectionsStrategy(weights=weights)
+            elif name == "token_aware":
+                strategy = TokenAwareStrategy()
+            elif name == "stream_latency":
+                strategy = StreamLatencyStrategy(clock=lambda: clock[0])
+            else:
+                strategy = PeakEwmaStrategy(clock=lambda: clock[0])
+            random.seed(args.seed)  # strategies use the module-level RNG for tie-breaks
+            delays = sorted(simulate(strategy, trace, clock))
+            mean = sum(delays) / len(delays)
+            print(f"{kind:<8} {name:<28} {percentile(delays, 50):>9.3f} {percentile(delays, 99):>9.3f} {mean:>9.3f}")
+
+
+if __name__ == "__main__":
+    main()
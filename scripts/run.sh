@@ -1 +1 @@
-uvicorn src.inference_engine_proxy_server.server:app --host 0.0.0.0 --port 8888
\ No newline at end of file
+uvicorn src.inference_engine_proxy_server.server:app --host 0.0.0.0 --port 8888 --workers "${PROXY_WORKERS:-1}"
\ No newline at end of file
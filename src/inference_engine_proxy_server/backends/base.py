@@ -1,43 +1,219 @@
 from abc import ABC, abstractmethod
 import logging
+import time
 from fastapi import Request, Response
-from fastapi.responses import StreamingResponse
-from typing import Tuple, AsyncGenerator
+from typing import Tuple, AsyncGenerator, AsyncIterator, Optional
 import httpx
 
 from ..core.constants import EXCLUDE_HEADERS
-from ..core.http_client import get_client
+from ..core.http_client import get_backend_client, pool_trace
+from ..core import circuit_breaker, inflight, stream_stats, telemetry
+from ..core.strategies import get_strategy
+from ..core.metrics_scraper import MetricsSnapshot
+from ..core.streaming import ProxyStreamingResponse, coalesce_chunks
+from ..core.request_body import RequestBody
+from ..core.token_estimator import TokenEstimate
 
 logger = logging.getLogger(__name__)
 
+
+class BackendUnavailableError(Exception):
+    """
+    Raised by `forward_request(allow_failover=True)` when a backend fails before any
+    response byte was sent to the client, so the request can be replayed elsewhere.
+    `response` is what the client should get if no other backend is left.
+    """
+
+    def __init__(self, backend_url: str, reason: str, response: Response) -> None:
+        super().__init__(f"{backend_url}: {reason}")
+        self.backend_url = backend_url
+        self.reason = reason
+        self.response = response
+
+
+class _BackendStream:
+    """
+    Body iterator of a streamed backend response. However the stream ends (finished, failed,
+    or closed by the client, also before it started), the upstream response is closed, the
+    in-flight counts are released and the outcome is reported to the circuit breaker, once.
+    """
+
+    __slots__ = ("backend_url", "response", "chunks", "body", "tokens", "metrics", "start_time",
+                 "stall_seconds", "first_chunk", "observe_first", "ttft", "received", "resumed",
+                 "returned", "max_gap", "recorder", "closed")
+
+    def __init__(self, backend_url: str, response: httpx.Response, chunks: AsyncIterator[bytes],
+                 coalesce: Optional[Tuple[int, float]], tokens: Optional[TokenEstimate], metrics, start_time: float,
+                 first_chunk: Optional[bytes], first_chunk_at: Optional[float], stall_seconds: float) -> None:
+        self.backend_url = backend_url
+        self.response = response
+        self.chunks = chunks
+        self.tokens = tokens
+        self.metrics = metrics
+        self.start_time = start_time
+        self.stall_seconds = stall_seconds
+        self.first_chunk = first_chunk or None
+        self.observe_first = first_chunk is None and response.status_code < 400
+        self.ttft = first_chunk_at - start_time if first_chunk_at is not None else None
+        self.received = len(first_chunk or b"")
+        # Longest wait for the backend between two chunks, not counting time spent writing to the client
+        self.resumed = first_chunk_at
+        self.returned = False
+        self.max_gap = 0.0
+        # Generation speed of the backend, from the arrival times of the SSE events
+        self.recorder = stream_stats.open_stream(backend_url, start_time) if response.status_code < 400 else None
+        if self.recorder is not None and first_chunk:
+            self.recorder.feed(first_chunk, first_chunk_at)
+        self.body = chunks
+        if coalesce is not None:
+            # Events are timed as they arrive from upstream, not as the merged writes leave
+            upstream = stream_stats.timed(self.recorder, chunks) if self.recorder is not None else chunks
+            self.body = coalesce_chunks(upstream, *coalesce)
+            self.recorder = None
+        self.closed = False
+
+    def __aiter__(self) -> "_BackendStream":
+        return self
+
+    async def __anext__(self) -> bytes:
+        if self.closed:
+            raise StopAsyncIteration
+        if self.first_chunk is not None:
+            chunk, self.first_chunk = self.first_chunk, None
+            self.returned = True
+            return chunk
+        if self.returned:
+            self.resumed = time.monotonic()
+        try:
+            chunk = await self.body.__anext__()
+        except StopAsyncIteration:
+            await self._close(finished=True)
+            raise
+        except (httpx.StreamClosed, httpx.ReadError):
+            logger.warning("Stream interrupted, likely by client disconnection.")
+            await self._close(failed=True)
+            raise StopAsyncIteration
+        except httpx.HTTPError:
+            await self._close(failed=True)
+            raise
+        except BaseException:
+            await self._close()
+            raise
+        now = time.monotonic()
+        if self.resumed is not None:
+            self.max_gap = max(self.max_gap, now - self.resumed)
+        if self.observe_first:
+            self.observe_first = False
+            self.ttft = now - self.start_time
+            get_strategy().observe_ttft(self.backend_url, self.ttft)
+        if self.recorder is not None:
+            self.recorder.feed(chunk, now)
+        self.received += len(chunk)
+        self.returned = True
+        return chunk
+
+    async def aclose(self) -> None:
+        await self._close()
+
+    async def _close(self, finished: bool = False, failed: bool = False) -> None:
+        if self.closed:
+            return
+        self.closed = True
+        status_code = self.response.status_code
+        if failed or status_code >= 500 or self.max_gap > self.stall_seconds:
+            ok = False
+        else:
+            ok = True if finished else None   # None: the client went away first
+        circuit_breaker.record(self.backend_url, self.start_time, ok, self.ttft if status_code < 400 else None)
+        try:
+            # 確保串流結束時（無論正常或異常，包含客戶端斷線），連線都被關閉
+            if self.body is not self.chunks:
+                await self.body.aclose()
+            await self.response.aclose()
+        finally:
+            inflight.release(self.backend_url, self.tokens)
+            self.metrics.stream_duration.observe(time.monotonic() - self.start_time)
+            self.metrics.response_bytes.observe(self.received)
+            logger.info("Backend response stream closed.")
+
+
 class BaseBackend(ABC):
     def __init__(self, backend_url) -> None:
         super().__init__()
         self.backend_url = backend_url
+        # Result of the last fetch_health(), used by the refresher to tell dead nodes from busy ones
+        self.healthy = True
     
     @abstractmethod
     async def fetch_health(self) -> bool:
         pass
     
     @abstractmethod
-    async def fetch_metrics(self) -> Tuple[float, bool]:
+    async def fetch_metrics(self) -> Tuple[MetricsSnapshot, bool]:
         pass
+
+    async def fetch_context_window(self, models: list) -> Optional[int]:
+        """Context window of the served model in tokens (`models` are its /v1/models entries), or None if unknown."""
+        return None
     
     def _filter_headers(self, headers: dict):
         return {k: v for k, v in headers.items() if k.lower() not in EXCLUDE_HEADERS}
 
-    async def forward_request(self, req: Request, path: str) -> Response:
+    async def forward_request(self, req: Request, path: str, allow_failover: bool = False,
+                              body: Optional[RequestBody] = None,
+                              tokens: Optional[TokenEstimate] = None) -> Response:
         """
         實現非同步請求轉發，並能智慧判斷使用流式或非流式回應。
         此版本修正了非同步上下文管理器的生命週期問題。
+
+        If `allow_failover` is True, failures that happen before the first response byte
+        reaches the client (connect errors, read timeouts, `RETRY_ON_STATUS` responses,
+        a stream dying before its first chunk) raise `BackendUnavailableError` instead of
+        being returned, so the caller can replay the request on another backend.
+
+        `body` is the buffered request body; without it the body is streamed from `req`
+        as it arrives, and can then only fail over while none of it has been sent.
+
+        `tokens` is the request's token estimate, counted as in flight on this backend
+        until the response is finished (see the token_aware strategy).
+
+        How the request ended (connect errors, 5xx, broken or stalled streams, time to the
+        first chunk) is reported to the circuit breaker of this backend.
         """
-        from ..core.constants import BACKEND_TIMEOUT_SECONDS
+        from ..core.constants import (
+            CIRCUIT_STALL_SECONDS, RETRY_ON_STATUS,
+            STREAM_COALESCE_ENABLED, STREAM_COALESCE_MAX_BYTES, STREAM_COALESCE_MAX_DELAY_MS,
+        )
 
         url = f"{self.backend_url}/{path}"
         headers = self._filter_headers(dict(req.headers))
         headers.pop("host", None)
-        request_body = await req.body()
-        client = get_client()
+        client = get_backend_client(self.backend_url)
+        metrics = telemetry.backend_metrics(self.backend_url)
+
+        body_started = False
+        sent_bytes = 0
+        if body is not None:
+            content = body.content()
+            sent_bytes = body.size
+            if not isinstance(content, bytes):
+                headers["content-length"] = str(body.size)
+        else:
+            # 未緩衝的 body 邊收邊送到後端
+            async def stream_body():
+                nonlocal body_started, sent_bytes
+                body_started = True
+                async for chunk in req.stream():
+                    sent_bytes += len(chunk)
+                    yield chunk
+
+            content = stream_body()
+            if "content-length" in req.headers:
+                headers["content-length"] = req.headers["content-length"]
+
+        # 在送出前就計入 in-flight，讓下一次 metrics 輪詢前的後續請求也能看到這份負載
+        inflight.acquire(self.backend_url, tokens)
+        start_time = circuit_breaker.begin(self.backend_url)
 
         # 步驟 1: 手動建立請求並發送，但不使用 `async with`
         try:
@@ -46,43 +222,107 @@ class BaseBackend(ABC):
                 url=url,
                 headers=headers,
                 params=req.query_params,
-                content=request_body,
-                timeout=BACKEND_TIMEOUT_SECONDS,
+                content=content,
+                extensions={"trace": pool_trace(self.backend_url)},
             )
             response = await client.send(req_for_httpx, stream=True)
-        except httpx.ConnectError as e:
-            logger.error("Cannot connect to backend service at %s: %s", self.backend_url, e)
-            return Response("Backend service is unavailable.", status_code=503)
+        except (httpx.ConnectError, httpx.TimeoutException) as e:
+            logger.error("Backend service at %s failed before responding: %s", self.backend_url, e)
+            inflight.release(self.backend_url, tokens)
+            metrics.count_request("error")
+            circuit_breaker.record(self.backend_url, start_time, False)
+            fallback = Response("Backend service is unavailable.", status_code=503)
+            if allow_failover and not body_started:
+                raise BackendUnavailableError(self.backend_url, repr(e), fallback) from e
+            return fallback
+        except BaseException:
+            # e.g. the client disconnected while its body was being streamed upstream
+            inflight.release(self.backend_url, tokens)
+            circuit_breaker.record(self.backend_url, start_time, None)
+            raise
+        metrics.ttfb.observe(time.monotonic() - start_time)
+        metrics.count_request(response.status_code)
+        metrics.request_bytes.observe(sent_bytes)
+        # A streamed body has been sent and cannot be replayed on another backend
+        allow_failover = allow_failover and not body_started
+
+        # 引擎回報過載或閘道錯誤時，交由呼叫端改送其他後端
+        if allow_failover and response.status_code in RETRY_ON_STATUS:
+            try:
+                body = await response.aread()
+            except httpx.HTTPError:
+                body = b""
+            finally:
+                await response.aclose()
+                inflight.release(self.backend_url, tokens)
+                circuit_breaker.record(self.backend_url, start_time, response.status_code < 500)
+            logger.warning("Backend %s answered %s, failing over.", self.backend_url, response.status_code)
+            raise BackendUnavailableError(
+                self.backend_url,
+                f"HTTP {response.status_code}",
+                Response(content=body, status_code=response.status_code,
+                         headers=self._filter_headers(dict(response.headers))),
+            )
 
         # 步驟 2: 檢查回應類型
         content_type = response.headers.get("content-type", "")
 
         # 對於非流式回應，讀取完畢後手動關閉連線
         if "text/event-stream" not in content_type.lower():
+            # 非流式回應在生成完畢後才送出標頭，以標頭到達時間作為首字延遲
+            if response.status_code < 400:
+                get_strategy().observe_ttft(self.backend_url, time.monotonic() - start_time)
+            ok = None
             try:
                 body = await response.aread()
+                ok = response.status_code < 500
+                metrics.response_bytes.observe(len(body))
                 return Response(
                     content=body,
                     status_code=response.status_code,
                     headers=self._filter_headers(dict(response.headers)),
                 )
+            except httpx.HTTPError:
+                ok = False
+                raise
             finally:
                 await response.aclose()
-        
-        # 步驟 3: 對於流式回應，建立一個生成器來管理連線生命週期
-        async def streaming_generator(res: httpx.Response):
+                inflight.release(self.backend_url, tokens)
+                circuit_breaker.record(self.backend_url, start_time, ok)
+
+        # 步驟 3: 對於流式回應，由 `_BackendStream` 管理連線生命週期
+        # 未壓縮的串流直接轉發原始位元組，略過 httpx 的解碼與分塊處理
+        chunks = response.aiter_bytes() if response.headers.get("content-encoding") else response.aiter_raw()
+        first_chunk = None
+        first_chunk_at = None
+        if allow_failover:
+            # 先取得第一個 chunk 再回應客戶端，在此之前的失敗仍可安全地改送其他後端
             try:
-                async for chunk in res.aiter_bytes():
-                    yield chunk
-            except (httpx.StreamClosed, httpx.ReadError):
-                logger.warning("Stream interrupted, likely by client disconnection.")
-            finally:
-                # 確保在生成器結束時（無論正常或異常），連線都被關閉
-                await res.aclose()
-                logger.info("Backend response stream closed.")
+                first_chunk = await chunks.__anext__()
+            except StopAsyncIteration:
+                first_chunk = b""
+            except httpx.HTTPError as e:
+                await response.aclose()
+                inflight.release(self.backend_url, tokens)
+                circuit_breaker.record(self.backend_url, start_time, False)
+                logger.warning("Stream from %s failed before the first byte: %s", self.backend_url, e)
+                raise BackendUnavailableError(
+                    self.backend_url, repr(e), Response("Backend service is unavailable.", status_code=503)
+                ) from e
+            except BaseException:
+                # e.g. the client disconnected while the first chunk was awaited
+                inflight.release(self.backend_url, tokens)
+                circuit_breaker.record(self.backend_url, start_time, None)
+                await response.aclose()
+                raise
+            first_chunk_at = time.monotonic()
+            if response.status_code < 400:
+                get_strategy().observe_ttft(self.backend_url, first_chunk_at - start_time)
 
-        return StreamingResponse(
-            streaming_generator(response),
+        coalesce = (STREAM_COALESCE_MAX_BYTES, STREAM_COALESCE_MAX_DELAY_MS / 1000) if STREAM_COALESCE_ENABLED else None
+        return ProxyStreamingResponse(
+            _BackendStream(self.backend_url, response, chunks, coalesce, tokens, metrics, start_time,
+                           first_chunk, first_chunk_at, CIRCUIT_STALL_SECONDS),
             status_code=response.status_code,
             headers=self._filter_headers(dict(response.headers)),
         )
\ No newline at end of file
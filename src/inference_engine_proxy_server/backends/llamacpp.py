@@ -1,14 +1,28 @@
+import asyncio
 import httpx
 import time
 import logging
-from prometheus_client.parser import text_string_to_metric_families
 from typing import Tuple, Optional
 from .base import BaseBackend
-from ..core.constants import MAX_ALLOWED_DEFERRED, MAX_ALLOWED_REQUEST_QUEUE
+from ..core.constants import MAX_ALLOWED_DEFERRED, MAX_ALLOWED_REQUEST_QUEUE, MAX_KV_CACHE_USAGE
+from ..core.metrics_scraper import MetricsSnapshot, scrape_metrics
 
 # Add a logger for this module
 logger = logging.getLogger("backend_llamacpp")
 
+# Metric name -> MetricsSnapshot field (see docs/llamacpp_metrics.md)
+LLAMACPP_METRICS = {
+    "llamacpp:requests_processing": "requests_processing",
+    "llamacpp_requests_processing": "requests_processing",
+    "llamacpp:requests_deferred": "requests_deferred",
+    "llamacpp_requests_deferred": "requests_deferred",
+    "llamacpp:prompt_tokens_seconds": "prompt_tokens_per_second",
+    "llamacpp:predicted_tokens_seconds": "generation_tokens_per_second",
+    "llamacpp:kv_cache_usage_ratio": "kv_cache_usage",   # only exposed by some llama.cpp versions
+}
+# Fields the scanner does not wait for before it stops (listed before the request counters when exposed)
+LLAMACPP_OPTIONAL_METRICS = ("kv_cache_usage",)
+
 class LlamacppBackend(BaseBackend):
     def __init__(self, backend_url) -> None:
         super().__init__(backend_url)
@@ -25,48 +39,58 @@ class LlamacppBackend(BaseBackend):
             data = r.json()
             # Assuming the health endpoint returns a JSON with a "status" field
             if data.get("status") == "ok":
+                self.healthy = True
                 return True
         except Exception as e:
             logger.warning("Health check failed for %s: %s", self.backend_url, e)
+        self.healthy = False
         return False
     
-    async def fetch_metrics(self) -> Tuple[float, bool]:
+    async def fetch_context_window(self, models: list) -> Optional[int]:
+        """
+        Reads `n_ctx` from /props. It is the context of one slot, i.e. what a single request can use
+        when the server runs with several parallel slots.
+        """
+        from ..core.http_client import get_client
+        client = get_client()
+        r = await client.get(f"{self.backend_url}/props")
+        r.raise_for_status()
+        n_ctx = r.json().get("default_generation_settings", {}).get("n_ctx")
+        return n_ctx if isinstance(n_ctx, int) and n_ctx > 0 else None
+
+    async def fetch_metrics(self) -> Tuple[MetricsSnapshot, bool]:
         """
         Fetches and parses metrics from /metrics endpoint.
         This method no longer handles caching; it just performs the fetch.
         It determines readiness based on metrics and a final health check.
         """
-        reqs_processing: Optional[float] = None
-        reqs_deferred: Optional[float] = None
+        snapshot = MetricsSnapshot()
 
+        # /health 與 /metrics 同時發送，每輪只需一次往返時間
+        health_task = asyncio.ensure_future(self.fetch_health())
         try:
             from ..core.http_client import get_client
             client = get_client()
-            r = await client.get(f"{self.backend_url}/metrics", timeout=5.0)
-            
-            if r.status_code == 200:
-                for family in text_string_to_metric_families(r.text):
-                    if family.name in ("llamacpp:requests_processing", "llamacpp_requests_processing"):
-                        reqs_processing = family.samples[0].value
-                    if family.name in ("llamacpp:requests_deferred", "llamacpp_requests_deferred"):
-                        reqs_deferred = family.samples[0].value
-                    if reqs_processing is not None and reqs_deferred is not None:
-                        break
+            snapshot = await scrape_metrics(client, f"{self.backend_url}/metrics", LLAMACPP_METRICS, timeout=5.0,
+                                            optional=LLAMACPP_OPTIONAL_METRICS)
         except Exception as e:
             logger.warning("Metrics fetch failed for %s: %s. Will rely on health check.", self.backend_url, e)
 
         # Fallback to health check to determine basic readiness
-        ready = await self.fetch_health()
+        ready = await health_task
         
         # If metrics were successfully fetched, use them to refine readiness
-        if reqs_processing is not None and reqs_deferred is not None:
-            if reqs_processing >= MAX_ALLOWED_REQUEST_QUEUE:
+        if snapshot.requests_processing is not None and snapshot.requests_deferred is not None:
+            if snapshot.requests_processing >= MAX_ALLOWED_REQUEST_QUEUE:
                 ready = False
-            if reqs_deferred >= MAX_ALLOWED_DEFERRED:
+            if snapshot.requests_deferred >= MAX_ALLOWED_DEFERRED:
                 ready = False
+        if snapshot.kv_cache_usage is not None and snapshot.kv_cache_usage > MAX_KV_CACHE_USAGE:
+            ready = False
         
         # If metrics couldn't be fetched, we consider queue length unknown (0 for decision making).
         # If ready is False from health check, queue length doesn't matter.
-        final_reqs_processing = reqs_processing if reqs_processing is not None else 0.0
+        if snapshot.requests_processing is None:
+            snapshot.requests_processing = 0.0
 
-        return final_reqs_processing, ready
\ No newline at end of file
+        return snapshot, ready
\ No newline at end of file
@@ -1,18 +1,35 @@
+import asyncio
 import httpx
 import time
 import logging
-from prometheus_client.parser import text_string_to_metric_families
 from typing import Tuple, Optional
 from .base import BaseBackend
-from ..core.constants import MAX_ALLOWED_DEFERRED, MAX_ALLOWED_REQUEST_QUEUE
+from ..core.constants import MAX_ALLOWED_DEFERRED, MAX_ALLOWED_REQUEST_QUEUE, MAX_KV_CACHE_USAGE
+from ..core.metrics_scraper import MetricsSnapshot, scrape_metrics
 
 # Add a logger for this module
 logger = logging.getLogger("backend_vllm")
 
+# Metric name -> MetricsSnapshot field. vLLM has no throughput gauge, so token
+# counters are scraped and turned into rates between two polls.
+VLLM_METRICS = {
+    "vllm:num_requests_running": "requests_processing",
+    "vllm_num_requests_running": "requests_processing",
+    "vllm:num_requests_waiting": "requests_deferred",
+    "vllm_num_requests_waiting": "requests_deferred",
+    # Alternative names of one field: the scanner takes the first one found, never their sum
+    "vllm:kv_cache_usage_perc": "kv_cache_usage",       # vLLM >= 0.10
+    "vllm:gpu_cache_usage_perc": "kv_cache_usage",      # older releases
+    "vllm:prompt_tokens_total": "prompt_tokens_total",
+    "vllm:generation_tokens_total": "generation_tokens_total",
+}
+
 
 class VllmBackend(BaseBackend):
     def __init__(self, backend_url) -> None:
         super().__init__(backend_url)
+        # (monotonic time, prompt_tokens_total, generation_tokens_total) of the previous poll
+        self._last_counters: Optional[Tuple[float, float, float]] = None
     
     
     async def fetch_health(self) -> bool:
@@ -24,48 +41,69 @@ class VllmBackend(BaseBackend):
             client = get_client()
             r = await client.get(f"{self.backend_url}/health", timeout=1.0)
             r.raise_for_status() # Raise an exception for 4xx/5xx status codes
+            self.healthy = True
             return True
         except Exception as e:
             logger.warning("Health check failed for %s: %s", self.backend_url, e)
+        self.healthy = False
         return False
     
-    async def fetch_metrics(self) -> Tuple[float, bool]:
+    def _update_throughput(self, snapshot: MetricsSnapshot) -> None:
+        """Derives tokens/s from the token counters of this and the previous poll."""
+        if snapshot.prompt_tokens_total is None or snapshot.generation_tokens_total is None:
+            return
+        now = time.monotonic()
+        last = self._last_counters
+        self._last_counters = (now, snapshot.prompt_tokens_total, snapshot.generation_tokens_total)
+        if last is None or now <= last[0]:
+            return
+        elapsed = now - last[0]
+        # Counters reset when the engine restarts; skip that interval
+        if snapshot.prompt_tokens_total >= last[1] and snapshot.generation_tokens_total >= last[2]:
+            snapshot.prompt_tokens_per_second = (snapshot.prompt_tokens_total - last[1]) / elapsed
+            snapshot.generation_tokens_per_second = (snapshot.generation_tokens_total - last[2]) / elapsed
+
+    async def fetch_context_window(self, models: list) -> Optional[int]:
+        """`max_model_len` from the /v1/models entries; LoRA adapters share the base model's."""
+        for entry in models:
+            max_len = entry.get("max_model_len")
+            if isinstance(max_len, int) and max_len > 0:
+                return max_len
+        return None
+
+    async def fetch_metrics(self) -> Tuple[MetricsSnapshot, bool]:
         """
         Fetches and parses metrics from /metrics endpoint.
         This method no longer handles caching; it just performs the fetch.
         It determines readiness based on metrics and a final health check.
         """
-        reqs_processing: Optional[float] = None
-        reqs_deferred: Optional[float] = None
+        snapshot = MetricsSnapshot()
 
+        # /health 與 /metrics 同時發送，每輪只需一次往返時間
+        health_task = asyncio.ensure_future(self.fetch_health())
         try:
             from ..core.http_client import get_client
             client = get_client()
-            r = await client.get(f"{self.backend_url}/metrics", timeout=5.0)
-            
-            if r.status_code == 200:
-                for family in text_string_to_metric_families(r.text):
-                    if family.name in ("vllm:num_requests_running", "vllm_num_requests_running"):
-                        reqs_processing = family.samples[0].value
-                    if family.name in ("vllm:num_requests_waiting", "vllm_num_requests_waiting"):
-                        reqs_deferred = family.samples[0].value
-                    if reqs_processing is not None and reqs_deferred is not None:
-                        break
+            snapshot = await scrape_metrics(client, f"{self.backend_url}/metrics", VLLM_METRICS, timeout=5.0)
+            self._update_throughput(snapshot)
         except Exception as e:
             logger.warning("Metrics fetch failed for %s: %s. Will rely on health check.", self.backend_url, e)
 
         # Fallback to health check to determine basic readiness
-        ready = await self.fetch_health()
+        ready = await health_task
         
         # If metrics were successfully fetched, use them to refine readiness
-        if reqs_processing is not None and reqs_deferred is not None:
-            if reqs_processing >= MAX_ALLOWED_REQUEST_QUEUE:
+        if snapshot.requests_processing is not None and snapshot.requests_deferred is not None:
+            if snapshot.requests_processing >= MAX_ALLOWED_REQUEST_QUEUE:
                 ready = False
-            if reqs_deferred >= MAX_ALLOWED_DEFERRED:
+            if snapshot.requests_deferred >= MAX_ALLOWED_DEFERRED:
                 ready = False
+        if snapshot.kv_cache_usage is not None and snapshot.kv_cache_usage > MAX_KV_CACHE_USAGE:
+            ready = False
         
         # If metrics couldn't be fetched, we consider queue length unknown (0 for decision making).
         # If ready is False from health check, queue length doesn't matter.
-        final_reqs_processing = reqs_processing if reqs_processing is not None else 0.0
+        if snapshot.requests_processing is None:
+            snapshot.requests_processing = 0.0
 
-        return final_reqs_processing, ready
\ No newline at end of file
+        return snapshot, ready
\ No newline at end of file
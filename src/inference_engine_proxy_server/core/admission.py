@@ -0,0 +1,247 @@
+"""
+Admission control:
+當所有後端都已滿載時，請求不再立即回傳 503，而是進入代理內部一個有上限的等待佇列。
+等待者依優先權（相同優先權時依到達順序 FIFO）排序，當後端完成請求或快取刷新時被喚醒重新嘗試選擇後端。
+超過 `ADMISSION_QUEUE_MAX_WAIT_SECONDS` 或佇列已滿時才回傳 503。
+
+優先權類別 (priority classes): 互動式對話與離線批次工作共用後端時，批次流量會把互動請求的首字延遲推到數秒。
+每個請求依 `PRIORITY_CLASS_HEADER` 標頭或 `PRIORITY_CLASS_ROUTES` 的路徑歸入一個類別，類別決定:
+- 在等待佇列中的優先權 (`PRIORITY_CLASS_PRIORITIES`，加上請求本身的優先權)，互動請求排在批次請求之前；
+- 可使用的後端負載上限 (`PRIORITY_CLASS_WATERMARKS` × `MAX_ALLOWED_REQUEST_QUEUE`)，批次請求只會送往
+  負載低於較低水位的後端，為其他類別保留空位。已在後端執行的請求不會被中斷。
+"""
+
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from typing import Awaitable, Callable, Dict, List, Optional, TypeVar
+
+from .constants import (
+    ADMISSION_API_KEY_PRIORITIES,
+    ADMISSION_PRIORITY_HEADER,
+    ADMISSION_QUEUE_MAX_DEPTH,
+    ADMISSION_QUEUE_MAX_WAIT_SECONDS,
+    MAX_ALLOWED_REQUEST_QUEUE,
+    PRIORITY_CLASS_HEADER,
+    PRIORITY_CLASS_PRIORITIES,
+    PRIORITY_CLASS_ROUTES,
+    PRIORITY_CLASS_WATERMARKS,
+    PRIORITY_DEFAULT_CLASS,
+)
+from . import telemetry
+
+logger = logging.getLogger("admission")
+
+T = TypeVar("T")
+
+
+class _Waiter:
+    __slots__ = ("sort_key", "future", "removed", "notified")
+
+    def __init__(self, priority: int, seq: int) -> None:
+        # heapq is a min-heap: higher priority first, then arrival order
+        self.sort_key = (-priority, seq)
+        self.future: Optional[asyncio.Future] = None
+        self.removed = False
+        # Set when a wake-up arrives while the waiter is busy retrying, so it is not lost
+        self.notified = False
+
+    def __lt__(self, other: "_Waiter") -> bool:
+        return self.sort_key < other.sort_key
+
+
+class AdmissionQueue:
+    """
+    Bounded wait queue in front of backend selection.
+    Only the head waiter is woken on a capacity change. Whether it gets a backend or not,
+    it then offers the turn to the next waiter in priority order, so a single freed slot never
+    causes a thundering herd, and a head that cannot use it (a class load limit, a prompt
+    too long for the free backends) does not hold up waiters that can.
+    """
+
+    def __init__(self, max_depth: int = ADMISSION_QUEUE_MAX_DEPTH,
+                 max_wait_seconds: float = ADMISSION_QUEUE_MAX_WAIT_SECONDS) -> None:
+        self.max_depth = max_depth
+        self.max_wait_seconds = max_wait_seconds
+        self._heap: List[_Waiter] = []
+        self._depth = 0
+        self._seq = itertools.count()
+
+    @property
+    def depth(self) -> int:
+        return self._depth
+
+    def _head(self) -> Optional[_Waiter]:
+        while self._heap and self._heap[0].removed:
+            heapq.heappop(self._heap)
+        return self._heap[0] if self._heap else None
+
+    def _next(self, waiter: _Waiter) -> Optional[_Waiter]:
+        """The waiter queued right after `waiter`, in priority order."""
+        following = None
+        for other in self._heap:
+            if not other.removed and other.sort_key > waiter.sort_key and (
+                    following is None or other.sort_key < following.sort_key):
+                following = other
+        return following
+
+    @staticmethod
+    def _wake(waiter: Optional[_Waiter]) -> None:
+        if waiter is None:
+            return
+        if waiter.future is not None and not waiter.future.done():
+            waiter.future.set_result(None)
+        else:
+            waiter.notified = True
+
+    def notify(self) -> None:
+        """Signals that capacity may be available; wakes the waiter at the head of the queue."""
+        self._wake(self._head())
+
+    def _remove(self, waiter: _Waiter) -> None:
+        if not waiter.removed:
+            waiter.removed = True
+            self._depth -= 1
+            telemetry.ADMISSION_QUEUE_DEPTH.dec()
+
+    async def admit(self, try_acquire: Callable[[], Awaitable[Optional[T]]], priority: int = 0) -> Optional[T]:
+        """
+        Returns the result of `try_acquire()` once it is not None, waiting in the queue if needed.
+        Returns None if the queue is full or the maximum wait time is exceeded.
+        """
+        # Fast path: only bypass the queue when nobody is waiting, to keep FIFO fairness
+        if self._head() is None:
+            result = await try_acquire()
+            if result is not None:
+                return result
+
+        if self._depth >= self.max_depth:
+            telemetry.ADMISSION_REQUESTS.labels(outcome="rejected").inc()
+            return None
+
+        loop = asyncio.get_running_loop()
+        waiter = _Waiter(priority, next(self._seq))
+        heapq.heappush(self._heap, waiter)
+        self._depth += 1
+        telemetry.ADMISSION_QUEUE_DEPTH.inc()
+        start = time.monotonic()
+        deadline = start + self.max_wait_seconds
+        outcome = "timeout"
+        woken = False
+
+        try:
+            while True:
+                # Try right away if we are at the head (e.g. capacity appeared while we enqueued)
+                if woken or self._head() is waiter:
+                    result = await try_acquire()
+                    if result is not None:
+                        outcome = "admitted"
+                        return result
+                    if woken:
+                        # Offer the capacity we could not use to the next waiter
+                        self._wake(self._next(waiter))
+                    woken = False
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return None
+                if waiter.notified:
+                    waiter.notified = False
+                    woken = True
+                    continue
+                waiter.future = loop.create_future()
+                try:
+                    await asyncio.wait_for(waiter.future, remaining)
+                except asyncio.TimeoutError:
+                    return None
+                woken = True
+        except asyncio.CancelledError:
+            outcome = "cancelled"
+            raise
+        finally:
+            holds_turn = outcome == "admitted" or woken or waiter.notified or self._head() is waiter
+            following = self._next(waiter) if holds_turn else None
+            self._remove(waiter)
+            telemetry.ADMISSION_WAIT_SECONDS.labels(outcome=outcome).observe(time.monotonic() - start)
+            telemetry.ADMISSION_REQUESTS.labels(outcome=outcome).inc()
+            # Pass the turn on: the next waiter may fit as well (admitted), or must not be
+            # blocked behind a waiter that gave up (timeout / cancelled).
+            self._wake(following)
+
+
+def get_request_priority(headers) -> int:
+    """
+    Priority of a request from the configured priority header or, failing that, its API key.
+    Higher values are served first; the default is 0.
+    """
+    if ADMISSION_PRIORITY_HEADER:
+        value = headers.get(ADMISSION_PRIORITY_HEADER)
+        if value is not None:
+            try:
+                return int(value)
+            except ValueError:
+                pass
+    if ADMISSION_API_KEY_PRIORITIES:
+        auth = headers.get("authorization", "")
+        if auth.lower().startswith("bearer "):
+            return ADMISSION_API_KEY_PRIORITIES.get(auth[7:].strip(), 0)
+    return 0
+
+
+# Every configured class name; other names in the class header count as the default class
+_CLASSES = {PRIORITY_DEFAULT_CLASS, *PRIORITY_CLASS_ROUTES.values(), *PRIORITY_CLASS_PRIORITIES, *PRIORITY_CLASS_WATERMARKS}
+# Longest prefix first, so "v1/chat/completions" is matched before "v1"
+_ROUTES = sorted(PRIORITY_CLASS_ROUTES.items(), key=lambda item: len(item[0]), reverse=True)
+
+
+def get_priority_class(path: str, headers) -> str:
+    """The priority class of a request: its class header, else its route, else the default class."""
+    if PRIORITY_CLASS_HEADER:
+        value = headers.get(PRIORITY_CLASS_HEADER)
+        if value is not None:
+            value = value.strip()
+            return value if value in _CLASSES else PRIORITY_DEFAULT_CLASS
+    path = path.strip("/")
+    for prefix, name in _ROUTES:
+        if path == prefix or path.startswith(prefix + "/"):
+            return name
+    return PRIORITY_DEFAULT_CLASS
+
+
+def get_class_priority(priority_class: str) -> int:
+    return PRIORITY_CLASS_PRIORITIES.get(priority_class, 0)
+
+
+def get_class_max_load(priority_class: str) -> float:
+    """The load below which a backend may take a request of `priority_class`."""
+    return MAX_ALLOWED_REQUEST_QUEUE * min(1.0, PRIORITY_CLASS_WATERMARKS.get(priority_class, 1.0))
+
+
+def get_priority_classes() -> Dict[str, Dict[str, float]]:
+    """The configured classes with their queue priority and backend load limit, for /health."""
+    return {name: {"priority": get_class_priority(name), "max_load": get_class_max_load(name)}
+            for name in sorted(_CLASSES)}
+
+
+# One queue per requested model (None: requests without model routing), so requests
+# waiting for a saturated model never hold up requests for another model.
+_queues: Dict[Optional[str], AdmissionQueue] = {}
+
+
+def get_admission_queue(model: Optional[str] = None) -> AdmissionQueue:
+    queue = _queues.get(model)
+    if queue is None:
+        queue = _queues[model] = AdmissionQueue()
+    return queue
+
+
+def get_queue_depth() -> int:
+    """Requests waiting across all admission queues."""
+    return sum(queue.depth for queue in _queues.values())
+
+
+def notify_capacity() -> None:
+    """Called when a backend finishes a request or the metrics cache is refreshed."""
+    for queue in _queues.values():
+        queue.notify()
@@ -0,0 +1,148 @@
+"""
+KV-cache / prefix-affinity routing:
+llama.cpp slots 與 vLLM prefix caching 只有在共享相同 system prompt 或對話前綴的請求落在同一個後端時才有效。
+這裡把請求的前 `PREFIX_AFFINITY_CHARS` 個字元雜湊後，以一致性雜湊 (consistent hashing) 對應到後端；
+並採用 bounded-load 變體，讓熱門前綴不會把單一節點壓垮。
+"""
+
+import bisect
+import hashlib
+import math
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from .constants import (
+    BACKENDS,
+    PREFIX_AFFINITY_CHARS,
+    PREFIX_AFFINITY_LOAD_FACTOR,
+    PREFIX_AFFINITY_VNODES,
+)
+from .request_parsing import load_json_body
+
+# Paths whose bodies carry a prompt worth pinning to a backend
+AFFINITY_PATH_SUFFIXES = ("chat/completions", "completions", "completion")
+
+
+def _hash(data: bytes) -> int:
+    return int.from_bytes(hashlib.blake2b(data, digest_size=8).digest(), "big")
+
+
+def _content_text(content: Any) -> str:
+    """Text of a chat message content, which is either a string or a list of typed parts."""
+    if isinstance(content, str):
+        return content
+    if isinstance(content, list):
+        return "".join(part.get("text", "") for part in content if isinstance(part, dict))
+    return ""
+
+
+def extract_prefix(payload: Dict[str, Any], max_chars: int = PREFIX_AFFINITY_CHARS) -> str:
+    """
+    Returns the leading `max_chars` characters of the conversation or prompt.
+    Chat messages are taken up to and including the first user message, so every
+    later turn of the same conversation yields the same prefix.
+    """
+    messages = payload.get("messages")
+    if isinstance(messages, list):
+        parts: List[str] = []
+        size = 0
+        for message in messages:
+            if not isinstance(message, dict):
+                continue
+            text = f"{message.get('role', '')}:{_content_text(message.get('content'))}\n"
+            parts.append(text)
+            size += len(text)
+            if size >= max_chars or message.get("role") == "user":
+                break
+        return "".join(parts)[:max_chars]
+
+    prompt = payload.get("prompt")
+    if isinstance(prompt, list) and prompt and isinstance(prompt[0], str):
+        prompt = prompt[0]
+    if isinstance(prompt, str):
+        return prompt[:max_chars]
+    return ""
+
+
+def get_affinity_key(path: str, body: bytes) -> Optional[int]:
+    """Hashes the prompt prefix of a completion request, or None if the request has none."""
+    if not path.rstrip("/").endswith(AFFINITY_PATH_SUFFIXES):
+        return None
+    payload = load_json_body(body)
+    if payload is None:
+        return None
+    prefix = extract_prefix(payload)
+    if not prefix:
+        return None
+    return _hash(prefix.encode("utf-8", errors="ignore"))
+
+
+class ConsistentHashRing:
+    """Hash ring with `vnodes` virtual points per backend; lookups are O(log n)."""
+
+    def __init__(self, backends: Sequence[str], vnodes: int = PREFIX_AFFINITY_VNODES) -> None:
+        points: List[Tuple[int, str]] = []
+        for url in backends:
+            for i in range(vnodes):
+                points.append((_hash(f"{url}#{i}".encode()), url))
+        points.sort()
+        self._hashes = [h for h, _ in points]
+        self._urls = [url for _, url in points]
+        self.backends = list(backends)
+
+    def walk(self, key: int):
+        """Yields each backend once, clockwise from the point owning `key`."""
+        if not self._hashes:
+            return
+        seen = set()
+        start = bisect.bisect(self._hashes, key)
+        total = len(self._hashes)
+        for offset in range(total):
+            url = self._urls[(start + offset) % total]
+            if url not in seen:
+                seen.add(url)
+                yield url
+                if len(seen) == len(self.backends):
+                    return
+
+
+# One ring per backend pool (all BACKENDS, or the backends serving one model)
+_rings: Dict[Tuple[str, ...], ConsistentHashRing] = {}
+
+
+def get_ring(pool: Optional[Sequence[str]] = None) -> ConsistentHashRing:
+    key = tuple(BACKENDS if pool is None else pool)
+    ring = _rings.get(key)
+    if ring is None:
+        if len(_rings) >= 64:
+            _rings.clear()  # pools changed (e.g. models reloaded); drop the stale rings
+        ring = _rings[key] = ConsistentHashRing(key)
+    return ring
+
+
+def reset_rings() -> None:
+    """Drops the cached rings after the backend list changed."""
+    _rings.clear()
+
+
+def select_by_affinity(key: int, candidates: Sequence[Tuple[str, float]],
+                       pool: Optional[Sequence[str]] = None) -> Optional[str]:
+    """
+    Picks the backend owning `key` on the ring, walking clockwise past nodes whose load
+    exceeds `PREFIX_AFFINITY_LOAD_FACTOR` times the average (bounded-load consistent hashing).
+    Returns None when the owning node is not a ready candidate or every node is over the
+    bound, so the caller can fall back to the least-loaded backend.
+    `pool` restricts the ring to the backends serving the requested model.
+    """
+    if not candidates:
+        return None
+    loads: Dict[str, float] = dict(candidates)
+    # +1 accounts for the request being placed
+    bound = math.ceil(PREFIX_AFFINITY_LOAD_FACTOR * (sum(loads.values()) + 1) / len(loads))
+
+    for index, url in enumerate(get_ring(pool).walk(key)):
+        if index == 0 and url not in loads:
+            return None  # preferred node is not ready
+        load = loads.get(url)
+        if load is not None and load + 1 <= bound:
+            return url
+    return None
@@ -0,0 +1,268 @@
+"""
+後端狀態表:
+每個後端一筆預先配置的 `__slots__` 紀錄 (`BackendState`)，取代原本 `_METRICS_CACHE` 的巢狀 dict。
+refresher 與多 worker 同步寫入、路由與 `/health` 讀取的都是同一筆紀錄；紀錄也持有該後端長期存在的
+`LlamacppBackend` / `VllmBackend` 物件，輪詢與轉發共用，挑選後端時不再為每個請求建立新物件。
+
+可路由的後端（就緒、未 drain、未被 circuit breaker 剔除）另外依負載排在一個 indexed min-heap (`LoadIndex`)：
+輪詢結果、in-flight 數或狀態改變時以 O(log n) 調整位置。支援索引的策略（least_requests、
+weighted_least_connections）直接取堆頂（與堆頂負載相同的後端間隨機挑選），不必掃描所有後端，也不配置任何物件；
+其他策略、前綴親和性、多模型的子集合，或堆頂不符合請求條件（已失敗、放不下、資料過期）時才逐一掃描。
+"""
+
+import math
+import random
+from collections import Counter
+from typing import Any, Dict, List, Optional
+
+from .constants import METRICS_CACHE_TTL_SECONDS, _DRAINING_BACKENDS
+from .shared_state import DYNAMIC_FIELDS
+from .strategies import get_strategy
+from . import circuit_breaker, inflight
+
+# Values of the dynamic fields before a backend's first poll
+_DYNAMIC_DEFAULTS: Dict[str, Any] = {"timestamp": 0.0, "requests_processing": math.inf, "inflight_at_poll": 0,
+                                     "ready": False}
+_NO_STATIC: Dict[str, Any] = {}
+
+
+class BackendState:
+    """Everything known about one backend: static info, the last poll and its place in the load index."""
+
+    __slots__ = ("url", "static", "backend", "active", "fresh_until", "heap_pos", "key", "candidate") + DYNAMIC_FIELDS
+
+    def __init__(self, backend_url: str) -> None:
+        self.url = backend_url
+        # provider, model_name, models, context_window (see cache_refresher._fetch_static_info)
+        self.static: Dict[str, Any] = {}
+        # Long-lived LlamacppBackend / VllmBackend, created once the provider is known
+        self.backend = None
+        # False once the backend was removed from BACKENDS, while its last requests finish
+        self.active = True
+        # time.time() after which the polled values are too old to route on
+        self.fresh_until = 0.0
+        self.heap_pos = -1
+        self.key = math.inf
+        # The last (url, load) handed to a strategy, reused while the load does not change
+        self.candidate = (backend_url, -1.0)
+        for name in DYNAMIC_FIELDS:
+            setattr(self, name, _DYNAMIC_DEFAULTS.get(name))
+
+    def set_static(self, static: Dict[str, Any]) -> None:
+        _context_windows[self.static.get("context_window")] -= 1
+        _context_windows[static.get("context_window")] += 1
+        self.static = static
+        self.ensure_backend(static.get("provider"))
+
+    def ensure_backend(self, provider: Optional[str]):
+        """The backend object for `provider`, replaced if the backend was restarted as another engine."""
+        from ..backends.llamacpp import LlamacppBackend
+        from ..backends.vllm import VllmBackend
+
+        cls = {"llamacpp": LlamacppBackend, "vllm": VllmBackend}.get(provider)
+        if cls is None:
+            return None
+        if type(self.backend) is not cls:
+            self.backend = cls(self.url)
+        return self.backend
+
+    def set_dynamic(self, dynamic_info: Dict[str, Any]) -> None:
+        """Stores the result of a poll (the keys of `DYNAMIC_FIELDS`) and updates the load index."""
+        for name in DYNAMIC_FIELDS:
+            value = dynamic_info.get(name)
+            setattr(self, name, _DYNAMIC_DEFAULTS.get(name) if value is None else value)
+        # Idle backends are polled less often, so staleness is relative to their own poll interval
+        self.fresh_until = self.timestamp + max(METRICS_CACHE_TTL_SECONDS, self.poll_interval or 0) * 2
+        refresh(self.url)
+
+    def dynamic(self) -> Dict[str, Any]:
+        """The last poll as a dict, for /health, shared memory and the adaptive poll interval."""
+        if not self.timestamp:
+            return {"ready": False}
+        return {name: getattr(self, name) for name in DYNAMIC_FIELDS}
+
+    def load(self) -> float:
+        """
+        The last polled load plus the change in the proxy's in-flight requests since the poll
+        (the requests in flight at poll time are already part of the polled value).
+        """
+        return max(0.0, self.requests_processing + inflight.get_inflight(self.url) - self.inflight_at_poll)
+
+
+class LoadIndex:
+    """Indexed binary min-heap of the routable backends, ordered by `BackendState.key`."""
+
+    __slots__ = ("heap", "_stack")
+
+    # Most backends sharing the lowest key that `peek_random` chooses from
+    MAX_TIES = 8
+
+    def __init__(self) -> None:
+        self.heap: List[BackendState] = []
+        self._stack: List[int] = []
+
+    def __len__(self) -> int:
+        return len(self.heap)
+
+    def peek(self) -> Optional[BackendState]:
+        return self.heap[0] if self.heap else None
+
+    def peek_random(self) -> Optional[BackendState]:
+        """
+        A random one of the backends sharing the lowest key (up to `MAX_TIES` of them), so that
+        equally loaded backends share the traffic. The ties form a subtree at the top of the heap.
+        """
+        heap = self.heap
+        size = len(heap)
+        if size < 2:
+            return heap[0] if heap else None
+        key = heap[0].key
+        if heap[1].key != key and (size < 3 or heap[2].key != key):
+            return heap[0]
+        stack = self._stack
+        stack.append(0)
+        chosen = heap[0]
+        seen = 0
+        while stack and seen < self.MAX_TIES:
+            pos = stack.pop()
+            seen += 1
+            # Reservoir sampling: every tie visited is kept with probability 1 / seen
+            if random.random() * seen < 1:
+                chosen = heap[pos]
+            child = 2 * pos + 1
+            if child < size and heap[child].key == key:
+                stack.append(child)
+            if child + 1 < size and heap[child + 1].key == key:
+                stack.append(child + 1)
+        stack.clear()
+        return chosen
+
+    def update(self, state: BackendState, key: float) -> None:
+        """Inserts `state` with `key`, or moves it to its new place."""
+        old = state.key
+        state.key = key
+        if state.heap_pos < 0:
+            state.heap_pos = len(self.heap)
+            self.heap.append(state)
+            self._sift_up(state.heap_pos)
+        elif key < old:
+            self._sift_up(state.heap_pos)
+        elif key > old:
+            self._sift_down(state.heap_pos)
+
+    def remove(self, state: BackendState) -> None:
+        pos = state.heap_pos
+        if pos < 0:
+            return
+        state.heap_pos = -1
+        last = self.heap.pop()
+        if last is not state:
+            self.heap[pos] = last
+            last.heap_pos = pos
+            self._sift_up(pos)
+            self._sift_down(last.heap_pos)
+
+    def _sift_up(self, pos: int) -> None:
+        heap = self.heap
+        state = heap[pos]
+        while pos > 0:
+            parent = (pos - 1) >> 1
+            if heap[parent].key <= state.key:
+                break
+            heap[pos] = heap[parent]
+            heap[pos].heap_pos = pos
+            pos = parent
+        heap[pos] = state
+        state.heap_pos = pos
+
+    def _sift_down(self, pos: int) -> None:
+        heap = self.heap
+        size = len(heap)
+        state = heap[pos]
+        while True:
+            child = 2 * pos + 1
+            if child >= size:
+                break
+            if child + 1 < size and heap[child + 1].key < heap[child].key:
+                child += 1
+            if heap[child].key >= state.key:
+                break
+            heap[pos] = heap[child]
+            heap[pos].heap_pos = pos
+            pos = child
+        heap[pos] = state
+        state.heap_pos = pos
+
+
+# {backend_url: state} of every configured backend, plus removed ones whose requests are still finishing
+_STATES: Dict[str, BackendState] = {}
+_index = LoadIndex()
+# Number of backends by the context window in their static info (None: unknown)
+_context_windows: "Counter[Optional[int]]" = Counter()
+
+
+def get_state(backend_url: str) -> Optional[BackendState]:
+    return _STATES.get(backend_url)
+
+
+def ensure_state(backend_url: str) -> BackendState:
+    state = _STATES.get(backend_url)
+    if state is None:
+        state = _STATES[backend_url] = BackendState(backend_url)
+        _context_windows[None] += 1
+    return state
+
+
+def get_static(backend_url: str) -> Dict[str, Any]:
+    """Static info of `backend_url` (empty until it was fetched); do not modify it."""
+    state = _STATES.get(backend_url)
+    return state.static if state is not None else _NO_STATIC
+
+
+def all_states() -> List[BackendState]:
+    return list(_STATES.values())
+
+
+def has_context_windows() -> bool:
+    """Whether backends differ in context window (or in knowing it), so that it matters where a request goes."""
+    return sum(1 for count in _context_windows.values() if count > 0) > 1
+
+
+def remove_state(backend_url: str) -> None:
+    """Forgets a removed backend once its requests are done."""
+    state = _STATES.pop(backend_url, None)
+    if state is not None:
+        _index.remove(state)
+        _context_windows[state.static.get("context_window")] -= 1
+
+
+def is_routable(state: BackendState) -> bool:
+    """Whether a backend may get new requests at all, whatever the request (see `LoadIndex`)."""
+    return (state.active and state.ready and state.backend is not None
+            and state.url not in _DRAINING_BACKENDS and circuit_breaker.allows(state.url))
+
+
+def refresh(backend_url: str) -> None:
+    """Re-evaluates the place of `backend_url` in the load index after its load or state changed."""
+    strategy = get_strategy()
+    if not strategy.indexed:
+        return
+    state = _STATES.get(backend_url)
+    if state is None:
+        return
+    if is_routable(state):
+        _index.update(state, strategy.index_key(backend_url, state.load()))
+    else:
+        _index.remove(state)
+
+
+def refresh_all() -> None:
+    """Re-evaluates every backend, e.g. after other workers' in-flight counts changed."""
+    if get_strategy().indexed:
+        for backend_url in list(_STATES):
+            refresh(backend_url)
+
+
+def get_load_index() -> Optional[LoadIndex]:
+    """The load index, or None if the configured strategy does not pick by it."""
+    return _index if get_strategy().indexed else None
@@ -1,96 +1,194 @@
 import asyncio
 import time
 import logging
-from typing import Tuple, Optional
-from .constants import BACKENDS, METRICS_CACHE_TTL_SECONDS, _METRICS_CACHE
-from ..utils.utils import a_get_model_name, a_check_provider
+from typing import Dict, Tuple, Optional
+from .constants import (
+    BACKENDS,
+    POLL_FAST_INTERVAL_SECONDS,
+    POLL_SLOW_INTERVAL_SECONDS,
+    POLL_MAX_BACKOFF_SECONDS,
+    POLL_FLAP_WINDOW_SECONDS,
+    POLL_DEADLINE_SECONDS,
+)
+from .backend_state import ensure_state
+from .inflight import get_inflight
+from .metrics_scraper import MetricsSnapshot
+from .models import rebuild_model_index
+from .shared_state import get_shared_state
+from .admission import notify_capacity
+from .registry import wait_for_change
+from . import telemetry
+from ..utils.utils import a_get_models
 
 logger = logging.getLogger("cache-refresher")
 
 
+def _get_backend(backend_url: str, provider: str):
+    """Returns the long-lived backend object of `backend_url` (shared with routing), or None for an unknown provider."""
+    return ensure_state(backend_url).ensure_backend(provider)
+
+
 # ✅ 將 fetch_metrics 函式移動到這裡，並重新命名為 _fetch_backend_metrics
-async def _fetch_backend_metrics(backend_url: str, provider: str) -> Optional[Tuple[float, bool]]:
+async def _fetch_backend_metrics(backend_url: str, provider: str) -> Optional[Tuple[MetricsSnapshot, bool]]:
     """
     Fetches dynamic metrics for a given backend based on its provider.
     """
-    from ..backends.llamacpp import LlamacppBackend
-    from ..backends.vllm import VllmBackend
-
-    backend = None
-    if provider == "llamacpp":
-        backend = LlamacppBackend(backend_url)
-    elif provider == "vllm":
-        backend = VllmBackend(backend_url)
-    else:
+    backend = _get_backend(backend_url, provider)
+    if backend is None:
         return None
     return await backend.fetch_metrics()
 
 
-async def refresh_loop():
+async def _fetch_context_window(backend_url: str, provider: str, models: list) -> Optional[int]:
+    """Context window of a backend, or None (no context window routing for it) if it cannot be read."""
+    backend = _get_backend(backend_url, provider)
+    if backend is None:
+        return None
+    try:
+        return await asyncio.wait_for(backend.fetch_context_window(models), POLL_DEADLINE_SECONDS)
+    except Exception as e:
+        logger.warning("Cannot read the context window of %s: %r", backend_url, e)
+        return None
+
+
+async def _fetch_static_info(backend_url: str, force: bool = False) -> bool:
+    """
+    Fetches provider, served models and context window once per backend, or again when `force` is set
+    (a restarted backend may serve different models). Returns True on success.
+    """
+    state = ensure_state(backend_url)
+    if state.static.get("provider") and not force:
+        return True
+    try:
+        logger.info("Fetching static info for %s...", backend_url)
+        # 一次 /v1/models 請求同時取得所有模型與 provider
+        models = await asyncio.wait_for(a_get_models(backend_url), POLL_DEADLINE_SECONDS)
+        provider = models[0].get("owned_by")          # 'llamacpp' or 'vllm'
+        state.set_static({
+            "provider": provider,
+            "model_name": models[0]["id"],
+            "models": [m for m in models if isinstance(m, dict) and m.get("id")],
+            "context_window": await _fetch_context_window(backend_url, provider, models),
+        })
+        rebuild_model_index()
+        shared = get_shared_state()
+        if shared is not None:
+            shared.publish_static(backend_url, state.static)
+        logger.info("Successfully fetched static info for %s: provider=%s, models=%s, context_window=%s",
+                    backend_url, provider, [m["id"] for m in state.static["models"]],
+                    state.static["context_window"])
+        return True
+    except Exception as e:
+        logger.error("Failed to fetch static info for %s: %s. Will retry later.", backend_url, e)
+        return False
+
+
+def _next_interval(dynamic_info: Dict, healthy: bool, failures: int, last_flap: float, now: float) -> float:
     """
-    Periodically refreshes the metrics and status of all backends.
-    It also fetches static information (provider, model_name) once per backend.
+    Adaptive polling interval:
+    - dead nodes back off exponentially up to POLL_MAX_BACKOFF_SECONDS,
+    - busy or recently flapping nodes are polled every POLL_FAST_INTERVAL_SECONDS,
+    - idle healthy nodes every POLL_SLOW_INTERVAL_SECONDS.
     """
+    if not healthy:
+        return min(POLL_MAX_BACKOFF_SECONDS, POLL_FAST_INTERVAL_SECONDS * (2 ** max(0, failures - 1)))
+    busy = dynamic_info.get("requests_processing", 0) > 0 or dynamic_info.get("inflight_at_poll", 0) > 0
+    if busy or not dynamic_info.get("ready") or now - last_flap < POLL_FLAP_WINDOW_SECONDS:
+        return POLL_FAST_INTERVAL_SECONDS
+    return POLL_SLOW_INTERVAL_SECONDS
+
+
+async def _poll_backend(backend_url: str) -> None:
+    """Polls one backend forever on its own adaptive schedule."""
+    failures = 0
+    last_flap = 0.0
+    last_ready: Optional[bool] = None
+
+    metrics = telemetry.backend_metrics(backend_url)
+    state = ensure_state(backend_url)
+
     while True:
-        start_time = time.time()
-        
-        # --- Stage 1: Ensure static info is cached for all backends ---
-        for backend_url in BACKENDS:
-            # If backend is new or static info fetching failed before
-            if backend_url not in _METRICS_CACHE or not _METRICS_CACHE[backend_url].get("static", {}).get("provider"):
-                if backend_url not in _METRICS_CACHE:
-                    # Initialize cache structure for new backend
-                    _METRICS_CACHE[backend_url] = {"dynamic": {}, "static": {}}
-                try:
-                    logger.info("Fetching static info for %s...", backend_url)
-                    model_name = await a_get_model_name(backend_url)
-                    provider = await a_check_provider(backend_url, model_name)
-                    _METRICS_CACHE[backend_url]["static"] = {
-                        "provider": provider,
-                        "model_name": model_name
-                    }
-                    logger.info("Successfully fetched static info for %s: provider=%s", backend_url, provider)
-                except Exception as e:
-                    logger.error("Failed to fetch static info for %s: %s. Will retry in the next cycle.", backend_url, e)
-        
-        # --- Stage 2: Fetch dynamic metrics for ready backends ---
-        tasks = []
-        for backend_url, cache_entry in _METRICS_CACHE.items():
-            provider = cache_entry.get("static", {}).get("provider")
-            if provider: # Only fetch metrics if we know the provider
-                # ✅ 使用在此檔案中定義的函式
-                tasks.append(_fetch_backend_metrics(backend_url, provider))
-        
-        results = await asyncio.gather(*tasks, return_exceptions=True)
-        
-        # --- Stage 3: Update cache with new dynamic metrics ---
-        now = time.time()
-        backend_index = 0
-        for backend_url, cache_entry in _METRICS_CACHE.items():
-            if not cache_entry.get("static", {}).get("provider"):
-                continue # Skip backends we couldn't get static info for
-
-            res = results[backend_index]
-            backend_index += 1
-            
-            if isinstance(res, Exception):
-                logger.warning("Metrics error for %s -> %s", backend_url, res)
+        interval = POLL_FAST_INTERVAL_SECONDS
+        poll_start = time.monotonic()
+        if await _fetch_static_info(backend_url):
+            provider = state.static["provider"]
+            # Snapshot of our own in-flight count at poll time, so routing can add
+            # only the requests sent (or finished) after the backend reported its load.
+            inflight_at_poll = get_inflight(backend_url)
+            healthy = True
+            try:
+                res = await asyncio.wait_for(_fetch_backend_metrics(backend_url, provider), POLL_DEADLINE_SECONDS)
+                if res is None:
+                    raise ValueError(f"unsupported provider {provider}")
+                # res = (MetricsSnapshot, ready)
+                snapshot, ready = res
+                healthy = getattr(state.backend, "healthy", ready)
+            except Exception as e:
+                logger.warning("Metrics error for %s -> %r", backend_url, e)
                 # Mark backend as not ready if metrics fetch fails
-                _METRICS_CACHE[backend_url]["dynamic"] = {
-                    "timestamp": now,
-                    "requests_processing": float("inf"),
-                    "ready": False
-                }
-                continue
-
-            # res = (requests_processing, ready)
-            requests_processing, ready = res
-            _METRICS_CACHE[backend_url]["dynamic"] = {
+                snapshot, ready, healthy = MetricsSnapshot(requests_processing=float("inf")), False, False
+
+            now = time.time()
+            if healthy and failures > 0:
+                # After an outage the backend may have been restarted with other models; refetched
+                # once it is back, not on every poll while it is down
+                await _fetch_static_info(backend_url, force=True)
+            failures = 0 if healthy else failures + 1
+            if last_ready is not None and ready != last_ready:
+                last_flap = now
+            last_ready = ready
+
+            dynamic_info = {
                 "timestamp": now,
-                "requests_processing": requests_processing,
-                "ready": ready
+                "requests_processing": snapshot.requests_processing,
+                "requests_deferred": snapshot.requests_deferred,
+                "inflight_at_poll": inflight_at_poll,
+                "ready": ready,
+                "kv_cache_usage": snapshot.kv_cache_usage,
+                "prompt_tokens_per_second": snapshot.prompt_tokens_per_second,
+                "generation_tokens_per_second": snapshot.generation_tokens_per_second,
             }
+            interval = _next_interval(dynamic_info, healthy, failures, last_flap, now)
+            dynamic_info["poll_interval"] = interval
+            state.set_dynamic(dynamic_info)
+            shared = get_shared_state()
+            if shared is not None:
+                shared.publish_dynamic(backend_url, dynamic_info)
+
+            # Fresh metrics may have made the backend ready again
+            notify_capacity()
+        else:
+            failures += 1
+            interval = min(POLL_MAX_BACKOFF_SECONDS, POLL_FAST_INTERVAL_SECONDS * (2 ** (failures - 1)))
+        metrics.poll.observe(time.monotonic() - poll_start)
 
-        # Sleep until the next cycle
-        elapsed_time = time.time() - start_time
-        await asyncio.sleep(max(0, METRICS_CACHE_TTL_SECONDS - elapsed_time))
\ No newline at end of file
+        # Sleep until the next poll
+        await asyncio.sleep(interval)
+
+
+async def refresh_loop():
+    """
+    Keeps the metrics and status of all backends fresh.
+    Every backend is polled by its own task on an adaptive interval (see `_next_interval`),
+    so a slow or dead node never delays the others; static information
+    (provider, model_name) is fetched once per backend.
+    Backends added or removed at runtime (see registry.py) get their poller started or
+    stopped as soon as the list changes; the other pollers keep running undisturbed.
+    """
+    pollers: Dict[str, asyncio.Task] = {}
+    try:
+        while True:
+            for backend_url in list(BACKENDS):
+                task = pollers.get(backend_url)
+                if task is None or task.done():
+                    if task is not None and not task.cancelled() and task.exception():
+                        logger.error("Poller for %s crashed: %r. Restarting.", backend_url, task.exception())
+                    pollers[backend_url] = asyncio.create_task(_poll_backend(backend_url))
+            for backend_url in [url for url in pollers if url not in BACKENDS]:
+                pollers.pop(backend_url).cancel()
+                logger.info("Stopped polling removed backend %s", backend_url)
+            await wait_for_change(POLL_SLOW_INTERVAL_SECONDS)
+    finally:
+        for task in pollers.values():
+            task.cancel()
+        await asyncio.gather(*pollers.values(), return_exceptions=True)
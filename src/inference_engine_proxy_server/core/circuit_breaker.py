@@ -0,0 +1,253 @@
+"""
+被動健康檢查 (circuit breaker / outlier ejection):
+`/health` 與佇列門檻只反映輪詢當下的狀態，通過 `/health` 卻回傳 500、或在生成途中停住的節點仍會持續收到流量。
+這裡以 `forward_request` 的實際結果，為每個後端維護 `CIRCUIT_WINDOW_SECONDS` 秒的滑動時間窗：
+
+- 錯誤: 連線失敗或逾時、5xx 回應、串流途中中斷，以及兩個 chunk 之間停頓超過 `CIRCUIT_STALL_SECONDS` 的串流。
+  錯誤率達到 `CIRCUIT_ERROR_RATE` 時剔除該節點。
+- 延遲: 串流回應的首字延遲 (TTFT) p90 超過同模型其他節點中位數的 `CIRCUIT_LATENCY_FACTOR` 倍
+  （且至少 `CIRCUIT_LATENCY_MIN_SECONDS` 秒）時剔除，用來發現降頻或反覆 OOM 而變慢、但仍然回應的 GPU。
+
+剔除 (open) 的時間從 `CIRCUIT_EJECTION_SECONDS` 起算，連續被剔除時加倍，最多 `CIRCUIT_MAX_EJECTION_SECONDS`。
+時間到後進入 half-open，只放行 `CIRCUIT_HALF_OPEN_REQUESTS` 個請求作為探測：成功就恢復，失敗就以加倍的時間再次剔除。
+同時被剔除的節點最多佔所有後端的 `CIRCUIT_MAX_EJECTION_PERCENT`，避免整個後端池因為共同的問題（例如錯誤的請求）被清空。
+多 worker 模式下每個 worker 依自己看到的結果各自判斷。
+"""
+
+import logging
+import time
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+from .constants import (
+    BACKENDS,
+    CIRCUIT_BREAKER_ENABLED,
+    CIRCUIT_EJECTION_SECONDS,
+    CIRCUIT_ERROR_RATE,
+    CIRCUIT_HALF_OPEN_REQUESTS,
+    CIRCUIT_LATENCY_FACTOR,
+    CIRCUIT_LATENCY_MIN_SECONDS,
+    CIRCUIT_MAX_EJECTION_PERCENT,
+    CIRCUIT_MAX_EJECTION_SECONDS,
+    CIRCUIT_MIN_REQUESTS,
+    CIRCUIT_WINDOW_SECONDS,
+)
+from . import backend_state, telemetry
+
+logger = logging.getLogger("circuit-breaker")
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+_STATE_VALUES = {CLOSED: 0, OPEN: 1, HALF_OPEN: 2}
+# The TTFT p90 of a backend is recomputed at most this often (it sorts the whole window)
+LATENCY_CHECK_SECONDS = 1.0
+
+
+def _p90(values: List[float]) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(0.9 * len(values)))]
+
+
+class CircuitBreaker:
+    """Sliding windows of request outcomes and TTFTs of one backend, and its ejection state."""
+
+    __slots__ = ("backend_url", "state", "reason", "ejections", "open_until", "changed_at", "probes",
+                 "outcomes", "errors", "ttfts", "ttft_p90", "latency_checked", "_state_gauge")
+
+    def __init__(self, backend_url: str) -> None:
+        self.backend_url = backend_url
+        self.state = CLOSED
+        self.reason = ""
+        # Consecutive ejections; sets the backoff of the next one
+        self.ejections = 0
+        self.open_until = 0.0
+        # When the current state was entered; requests started before that are not counted
+        self.changed_at = 0.0
+        self.probes = 0
+        self.outcomes: Deque[Tuple[float, bool]] = deque()   # (finished, ok)
+        self.errors = 0
+        self.ttfts: Deque[Tuple[float, float]] = deque()     # (finished, seconds)
+        self.ttft_p90: Optional[float] = None
+        self.latency_checked = 0.0
+        self._state_gauge = telemetry.CIRCUIT_STATE.labels(backend_url)
+        self._state_gauge.set(0)
+
+    def _set_state(self, state: str, now: float) -> None:
+        self.state = state
+        self.changed_at = now
+        self.probes = 0
+        self._state_gauge.set(_STATE_VALUES[state])
+        backend_state.refresh(self.backend_url)
+
+    def _clear(self) -> None:
+        self.outcomes.clear()
+        self.errors = 0
+        self.ttfts.clear()
+        self.ttft_p90 = None
+
+    def _prune(self, now: float) -> None:
+        horizon = now - CIRCUIT_WINDOW_SECONDS
+        while self.outcomes and self.outcomes[0][0] < horizon:
+            if not self.outcomes.popleft()[1]:
+                self.errors -= 1
+        while self.ttfts and self.ttfts[0][0] < horizon:
+            self.ttfts.popleft()
+
+    def allows(self, now: float) -> bool:
+        if self.state == OPEN:
+            if now < self.open_until:
+                return False
+            self._set_state(HALF_OPEN, now)
+            logger.info("Backend %s half-open: probing with %d request(s)", self.backend_url, CIRCUIT_HALF_OPEN_REQUESTS)
+        if self.state == HALF_OPEN:
+            return self.probes < CIRCUIT_HALF_OPEN_REQUESTS
+        return True
+
+    def eject(self, reason: str, now: float) -> None:
+        # Consecutive ejections back off exponentially; a long healthy period starts over
+        if self.state == CLOSED and now - self.changed_at > CIRCUIT_MAX_EJECTION_SECONDS:
+            self.ejections = 0
+        duration = min(CIRCUIT_EJECTION_SECONDS * 2 ** self.ejections, CIRCUIT_MAX_EJECTION_SECONDS)
+        self.ejections += 1
+        self.reason = reason
+        self.open_until = now + duration
+        self._set_state(OPEN, now)
+        self._clear()
+        telemetry.CIRCUIT_EJECTIONS.labels(self.backend_url).inc()
+        logger.warning("Backend %s ejected for %.0fs: %s", self.backend_url, duration, reason)
+
+    def recover(self, now: float) -> None:
+        self._set_state(CLOSED, now)
+        self.reason = ""
+        self._clear()
+        logger.info("Backend %s recovered after a successful probe", self.backend_url)
+
+
+_breakers: Dict[str, CircuitBreaker] = {}
+
+
+def _get(backend_url: str) -> CircuitBreaker:
+    breaker = _breakers.get(backend_url)
+    if breaker is None:
+        breaker = _breakers[backend_url] = CircuitBreaker(backend_url)
+    return breaker
+
+
+def allows(backend_url: str) -> bool:
+    """Whether `backend_url` may get a new request (not ejected, or a half-open probe slot is free)."""
+    breaker = _breakers.get(backend_url)
+    return breaker is None or breaker.allows(time.monotonic())
+
+
+def begin(backend_url: str) -> float:
+    """Called when a request is forwarded to `backend_url`; returns the start time to pass to `record`."""
+    now = time.monotonic()
+    if CIRCUIT_BREAKER_ENABLED:
+        breaker = _breakers.get(backend_url)
+        if breaker is not None and breaker.state == HALF_OPEN:
+            breaker.probes += 1
+            backend_state.refresh(backend_url)
+    return now
+
+
+def record(backend_url: str, started: float, ok: Optional[bool], ttft: Optional[float] = None) -> None:
+    """
+    Records how a request to `backend_url` started at `started` (from `begin`) ended: `ok` False
+    for a backend failure, None if the client went away before it was known. `ttft` is the time to
+    the first chunk of a streamed response.
+    """
+    if not CIRCUIT_BREAKER_ENABLED:
+        return
+    breaker = _get(backend_url)
+    if started < breaker.changed_at:
+        return   # started before the last state change: says nothing about the current state
+    now = time.monotonic()
+    if breaker.state == OPEN:
+        return
+    if breaker.state == HALF_OPEN:
+        breaker.probes = max(0, breaker.probes - 1)
+        if ok is True:
+            breaker.recover(now)
+        elif ok is False:
+            breaker.eject("half-open probe failed", now)
+        else:
+            backend_state.refresh(backend_url)
+        return
+    if ok is None:
+        return
+
+    breaker.outcomes.append((now, ok))
+    if not ok:
+        breaker.errors += 1
+    if ttft is not None:
+        breaker.ttfts.append((now, ttft))
+    breaker._prune(now)
+
+    total = len(breaker.outcomes)
+    if total >= CIRCUIT_MIN_REQUESTS and breaker.errors / total >= CIRCUIT_ERROR_RATE:
+        _try_eject(breaker, f"{breaker.errors}/{total} requests failed in the last {CIRCUIT_WINDOW_SECONDS:g}s", now)
+    elif ttft is not None and now - breaker.latency_checked >= LATENCY_CHECK_SECONDS:
+        breaker.latency_checked = now
+        _check_latency(breaker, now)
+
+
+def _check_latency(breaker: CircuitBreaker, now: float) -> None:
+    if len(breaker.ttfts) < CIRCUIT_MIN_REQUESTS:
+        breaker.ttft_p90 = None
+        return
+    breaker.ttft_p90 = _p90([seconds for _, seconds in breaker.ttfts])
+    if CIRCUIT_LATENCY_FACTOR <= 0 or breaker.ttft_p90 < CIRCUIT_LATENCY_MIN_SECONDS:
+        return
+    # Only backends serving the same model are comparable
+    model = backend_state.get_static(breaker.backend_url).get("model_name")
+    peers = [
+        other.ttft_p90 for other in list(_breakers.values())
+        if other is not breaker and other.state == CLOSED and other.ttft_p90 is not None
+        and other.ttfts and now - other.ttfts[-1][0] < CIRCUIT_WINDOW_SECONDS
+        and backend_state.get_static(other.backend_url).get("model_name") == model
+    ]
+    if not peers:
+        return
+    peers.sort()
+    median = peers[len(peers) // 2]
+    if breaker.ttft_p90 > CIRCUIT_LATENCY_FACTOR * median:
+        _try_eject(breaker, f"TTFT p90 {breaker.ttft_p90:.2f}s vs {median:.2f}s on its peers", now)
+
+
+def _try_eject(breaker: CircuitBreaker, reason: str, now: float) -> None:
+    ejected = sum(1 for other in list(_breakers.values()) if other.state != CLOSED and other.backend_url in BACKENDS)
+    if ejected + 1 > len(BACKENDS) * CIRCUIT_MAX_EJECTION_PERCENT / 100:
+        logger.debug("Backend %s is an outlier (%s) but %d of %d backends are already ejected",
+                     breaker.backend_url, reason, ejected, len(BACKENDS))
+        return
+    breaker.eject(reason, now)
+
+
+def status(backend_url: str) -> Dict[str, Any]:
+    """The breaker state of `backend_url` for /health."""
+    breaker = _breakers.get(backend_url)
+    if breaker is None:
+        return {"state": CLOSED}
+    now = time.monotonic()
+    breaker._prune(now)
+    result: Dict[str, Any] = {
+        "state": breaker.state,
+        "requests": len(breaker.outcomes),
+        "errors": breaker.errors,
+        "ttft_p90": breaker.ttft_p90,
+        "ejections": breaker.ejections,
+    }
+    if breaker.state != CLOSED:
+        result["reason"] = breaker.reason
+    if breaker.state == OPEN:
+        result["retry_in_seconds"] = round(max(0.0, breaker.open_until - now), 1)
+    return result
+
+
+def forget(backend_url: str) -> None:
+    """Drops the breaker of a backend that was removed, with its metric series."""
+    if _breakers.pop(backend_url, None) is not None:
+        telemetry.CIRCUIT_STATE.remove(backend_url)
+        try:
+            telemetry.CIRCUIT_EJECTIONS.remove(backend_url)
+        except KeyError:
+            pass   # never ejected
@@ -2,14 +2,17 @@ import sys
 import os
 import logging
 from dotenv import load_dotenv
-from typing import Dict, Any
+from typing import Dict, Any, List, Set
 
 load_dotenv()
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger("llm-proxy")
 
+# Backend list; changed in place at runtime by the admin API and BACKENDS_FILE (src/inference_engine_proxy_server/core/registry.py)
 BACKENDS = [b.strip() for b in os.getenv("BACKENDS", "").split(",") if b.strip()]
-if not BACKENDS:
+# Optional JSON file with the backend list, watched for changes; once it exists it replaces BACKENDS
+BACKENDS_FILE = os.getenv("BACKENDS_FILE", "").strip()
+if not BACKENDS and not BACKENDS_FILE:
     logger.error("No BACKENDS defined in .env")
     sys.exit(1)
 
@@ -22,13 +25,262 @@ EXCLUDE_HEADERS = {
 
 
 # --- OPTIMIZED CACHE STRUCTURE ---
-# cache: {backend_url: {"dynamic": {...}, "static": {...}}}
-# "dynamic" part is updated frequently by the refresh loop(src/inference_engine_proxy_server/core/cache_refresher.py).
-# "static" part is fetched once and then reused(provider & model name).
-_METRICS_CACHE: Dict[str, Dict[str, Any]] = {}
+# The state of each backend is one `BackendState` record (src/inference_engine_proxy_server/core/backend_state.py):
+# its polled values are updated frequently by the refresh loop (src/inference_engine_proxy_server/core/cache_refresher.py),
+# its static info (provider, models, context window) is fetched once and then reused.
+# model index: {model_id: [backend_url, ...]} built from every `/v1/models` entry of every backend
+# (src/inference_engine_proxy_server/core/models.py), rebuilt whenever a backend's static info changes.
+_MODEL_INDEX: Dict[str, List[str]] = {}
+# in-flight: {backend_url: number of requests this proxy has forwarded and not yet finished}
+# Updated on the request path (src/inference_engine_proxy_server/core/inflight.py), not by the refresh loop.
+_INFLIGHT_REQUESTS: Dict[str, int] = {}
+# in-flight tokens: {backend_url: [prompt_tokens, max_generation_tokens, requests]} estimated for the requests
+# in `_INFLIGHT_REQUESTS` that carried an estimate (token_aware strategy only, this worker only)
+_INFLIGHT_TOKENS: Dict[str, List[int]] = {}
+# draining: backends that get no new requests while their in-flight requests finish (core/registry.py)
+_DRAINING_BACKENDS: Set[str] = set()
 METRICS_CACHE_TTL_SECONDS = float(os.getenv("METRICS_CACHE_TTL_SECONDS", "3"))   # 秒
 
+# Adaptive polling (src/inference_engine_proxy_server/core/cache_refresher.py):
+# busy / flapping backends are polled fast, idle healthy ones slowly, dead ones with exponential backoff.
+POLL_FAST_INTERVAL_SECONDS = float(os.getenv("POLL_FAST_INTERVAL_SECONDS", "1"))
+POLL_SLOW_INTERVAL_SECONDS = float(os.getenv("POLL_SLOW_INTERVAL_SECONDS", str(METRICS_CACHE_TTL_SECONDS)))
+POLL_MAX_BACKOFF_SECONDS = float(os.getenv("POLL_MAX_BACKOFF_SECONDS", "30"))
+# A backend whose readiness changed within this window counts as flapping
+POLL_FLAP_WINDOW_SECONDS = float(os.getenv("POLL_FLAP_WINDOW_SECONDS", "30"))
+# Upper bound for one poll of one backend (/metrics and /health run concurrently)
+POLL_DEADLINE_SECONDS = float(os.getenv("POLL_DEADLINE_SECONDS", "2"))
+
+# --- MULTI-WORKER (src/inference_engine_proxy_server/core/shared_state.py) ---
+# Number of uvicorn worker processes (scripts/run.sh). Above 1, one leader worker polls the backends
+# and shares their state and every worker's in-flight counts through a shared-memory file.
+# /metrics aggregates the workers only with PROMETHEUS_MULTIPROC_DIR set (see core/telemetry.py).
+PROXY_WORKERS = max(1, int(os.getenv("PROXY_WORKERS", "1")))
+# Shared file; by default /dev/shm/inference-proxy-<hash of cwd, BACKENDS and PROXY_WORKERS>
+SHARED_STATE_PATH = os.getenv("SHARED_STATE_PATH", "").strip()
+# Backend slots in the shared file, i.e. the most backends configured at once (including ones being removed)
+SHARED_STATE_MAX_BACKENDS = int(os.getenv("SHARED_STATE_MAX_BACKENDS", "64"))
+# Space for each backend's static info (provider, models) in the shared file
+SHARED_STATE_STATIC_BYTES = int(os.getenv("SHARED_STATE_STATIC_BYTES", "65536"))
+# How often followers copy the leader's updates into their local cache
+SHARED_STATE_SYNC_INTERVAL_SECONDS = float(os.getenv("SHARED_STATE_SYNC_INTERVAL_SECONDS", "0.05"))
+
 BACKEND_TIMEOUT_SECONDS = int(os.getenv("BACKEND_TIMEOUT_SECONDS", "300"))
 
+# --- UPSTREAM CONNECTION POOLS (src/inference_engine_proxy_server/core/http_client.py) ---
+# Proxied traffic uses one pool per backend; health / metrics / model probes use a separate small pool.
+# Idle keep-alive connections are closed after this many seconds; keep it below the engines' own idle
+# timeout (uvicorn / llama-server close idle connections after 5s) so a request never picks up a dying one
+POOL_KEEPALIVE_EXPIRY_SECONDS = float(os.getenv("POOL_KEEPALIVE_EXPIRY_SECONDS", "4"))
+# Longest a request waits for a free connection of its backend's pool before failing over
+POOL_ACQUIRE_TIMEOUT_SECONDS = float(os.getenv("POOL_ACQUIRE_TIMEOUT_SECONDS", "10"))
+# Timeout of the control-plane probes
+CONTROL_TIMEOUT_SECONDS = float(os.getenv("CONTROL_TIMEOUT_SECONDS", "5"))
+
+# Failover: total attempts per request across different backends (1 disables retries).
+# Only failures before the first response byte is sent to the client are retried.
+RETRY_MAX_ATTEMPTS = max(1, int(os.getenv("RETRY_MAX_ATTEMPTS", "2")))
+RETRY_ON_STATUS = {int(s) for s in os.getenv("RETRY_ON_STATUS", "429,502,503").split(",") if s.strip()}
+
+# Request bodies (src/inference_engine_proxy_server/core/request_body.py): bodies that need no inspection are
+# streamed upstream; buffered bodies keep at most this many bytes in memory and spill the rest to a temp file
+REQUEST_BODY_STREAMING_ENABLED = os.getenv("REQUEST_BODY_STREAMING_ENABLED", "true").strip().lower() in ("1", "true", "yes")
+REQUEST_BODY_MAX_MEMORY_BYTES = int(os.getenv("REQUEST_BODY_MAX_MEMORY_BYTES", str(1024 * 1024)))
+
+# SSE streaming (src/inference_engine_proxy_server/core/streaming.py): coalesce upstream chunks arriving
+# within the delay into one write to the client, flushing early at the byte limit
+STREAM_COALESCE_ENABLED = os.getenv("STREAM_COALESCE_ENABLED", "true").strip().lower() in ("1", "true", "yes")
+STREAM_COALESCE_MAX_DELAY_MS = float(os.getenv("STREAM_COALESCE_MAX_DELAY_MS", "5"))
+STREAM_COALESCE_MAX_BYTES = int(os.getenv("STREAM_COALESCE_MAX_BYTES", "16384"))
+# Streams' time-to-first-token and inter-token latencies (src/inference_engine_proxy_server/core/stream_stats.py)
+# count half as much after this many seconds
+STREAM_STATS_HALF_LIFE_SECONDS = float(os.getenv("STREAM_STATS_HALF_LIFE_SECONDS", "60"))
+
 MAX_ALLOWED_REQUEST_QUEUE=int(os.getenv("MAX_ALLOWED_REQUEST_QUEUE", "4"))
-MAX_ALLOWED_DEFERRED=int(os.getenv("MAX_ALLOWED_DEFERRED", "2"))
\ No newline at end of file
+MAX_ALLOWED_DEFERRED=int(os.getenv("MAX_ALLOWED_DEFERRED", "2"))
+# A backend whose KV cache usage (0..1) is above this is considered not ready; 1 disables the check
+MAX_KV_CACHE_USAGE=float(os.getenv("MAX_KV_CACHE_USAGE", "1"))
+
+
+# --- LOAD BALANCING ---
+# least_requests | p2c | weighted_least_connections | peak_ewma | token_aware | stream_latency (src/inference_engine_proxy_server/core/strategies.py)
+LB_STRATEGY = os.getenv("LB_STRATEGY", "least_requests").strip().lower()
+
+def _parse_mapping(env_name: str, value_type=float, positive: bool = True) -> Dict[str, Any]:
+    """Parses "<key>=<value>,<key>=<value>" from the environment variable `env_name`."""
+    mapping: Dict[str, Any] = {}
+    for item in os.getenv(env_name, "").split(","):
+        if not item.strip():
+            continue
+        key, sep, value = item.strip().rpartition("=")
+        try:
+            if not sep or (positive and value_type(value) <= 0):
+                raise ValueError
+            mapping[key.strip()] = value_type(value)
+        except ValueError:
+            logger.error("Invalid %s entry: %s (expected <key>=<%snumber>)", env_name, item, "positive " if positive else "")
+            sys.exit(1)
+    return mapping
+
+# Capacity weight per backend, e.g. "http://llm-1:8080=2,http://llm-2:8080=1". Unlisted backends weigh 1.
+BACKEND_WEIGHTS: Dict[str, float] = _parse_mapping("BACKEND_WEIGHTS")
+
+# Connections per backend, e.g. "http://llm-1:8080=64". Unlisted backends get
+# 2 * MAX_ALLOWED_REQUEST_QUEUE * weight, enough for the requests routing lets through plus failover headroom.
+BACKEND_MAX_CONNECTIONS: Dict[str, int] = _parse_mapping("BACKEND_MAX_CONNECTIONS", int)
+# Backends spoken to over HTTP/2 (comma separated, or "*" for all); requires the `h2` package.
+# https backends negotiate it with ALPN, plain http ones use prior knowledge (h2c) and must support it.
+HTTP2_BACKENDS = {b.strip() for b in os.getenv("HTTP2_BACKENDS", "").split(",") if b.strip()}
+
+# --- DYNAMIC BACKENDS (src/inference_engine_proxy_server/core/registry.py) ---
+# How often BACKENDS_FILE is checked for changes
+BACKENDS_FILE_POLL_SECONDS = float(os.getenv("BACKENDS_FILE_POLL_SECONDS", "2"))
+# Bearer token of the /admin/backends API; the API is disabled when empty
+ADMIN_API_KEY = os.getenv("ADMIN_API_KEY", "").strip()
+# A removed backend keeps its connection pool until its in-flight requests finish, for at most this long
+BACKEND_REMOVE_GRACE_SECONDS = float(os.getenv("BACKEND_REMOVE_GRACE_SECONDS", "600"))
+
+# Time constant of the peak-EWMA time-to-first-token average
+PEAK_EWMA_DECAY_SECONDS = float(os.getenv("PEAK_EWMA_DECAY_SECONDS", "10"))
+
+# Token estimation for token_aware (src/inference_engine_proxy_server/core/token_estimator.py)
+# tiktoken encoding used as a local approximation; without it (or its cached BPE file) a character heuristic is used
+TOKEN_ESTIMATOR_ENCODING = os.getenv("TOKEN_ESTIMATOR_ENCODING", "cl100k_base").strip()
+# Number of recently seen prompt texts / messages whose token counts are kept
+TOKEN_ESTIMATOR_CACHE_SIZE = int(os.getenv("TOKEN_ESTIMATOR_CACHE_SIZE", "4096"))
+# Bodies above this many bytes are estimated in the thread pool instead of on the event loop
+TOKEN_ESTIMATOR_THREAD_THRESHOLD_BYTES = int(os.getenv("TOKEN_ESTIMATOR_THREAD_THRESHOLD_BYTES", "16384"))
+# Generation length assumed for requests without max_tokens
+TOKEN_ESTIMATOR_DEFAULT_MAX_TOKENS = int(os.getenv("TOKEN_ESTIMATOR_DEFAULT_MAX_TOKENS", "512"))
+
+
+# --- PREFIX AFFINITY (src/inference_engine_proxy_server/core/affinity.py) ---
+# Route requests sharing a prompt prefix to the same backend to reuse its KV cache
+PREFIX_AFFINITY_ENABLED = os.getenv("PREFIX_AFFINITY_ENABLED", "false").strip().lower() in ("1", "true", "yes")
+# Number of leading characters of messages/prompt that form the affinity key
+PREFIX_AFFINITY_CHARS = int(os.getenv("PREFIX_AFFINITY_CHARS", "2048"))
+# Bounded load: a node may take at most this factor times the average load before the next node is used
+PREFIX_AFFINITY_LOAD_FACTOR = float(os.getenv("PREFIX_AFFINITY_LOAD_FACTOR", "1.25"))
+PREFIX_AFFINITY_VNODES = int(os.getenv("PREFIX_AFFINITY_VNODES", "100"))
+
+
+# --- MULTI-MODEL ROUTING (src/inference_engine_proxy_server/core/models.py) ---
+# Route each request to the backends serving its "model" field
+MODEL_ROUTING_ENABLED = os.getenv("MODEL_ROUTING_ENABLED", "true").strip().lower() in ("1", "true", "yes")
+# Send requests for models no backend serves to any backend instead of answering 404.
+# Only applies when backends serve different models; with a single pool unknown names are always
+# forwarded (llama.cpp ignores the model name)
+MODEL_ROUTING_FALLBACK = os.getenv("MODEL_ROUTING_FALLBACK", "false").strip().lower() in ("1", "true", "yes")
+
+
+# --- CONTEXT WINDOW ROUTING (src/inference_engine_proxy_server/core/context_window.py) ---
+# Skip backends whose context window (vLLM max_model_len, llama.cpp n_ctx) cannot hold the request,
+# and reject requests that fit on no backend with an OpenAI `context_length_exceeded` error.
+# Requests are only estimated while backends differ in context window
+CONTEXT_WINDOW_ROUTING_ENABLED = os.getenv("CONTEXT_WINDOW_ROUTING_ENABLED", "true").strip().lower() in ("1", "true", "yes")
+# Prompts are counted with another tokenizer than the model's, so a request still fits while its estimate
+# is at most this factor times the window; near the limit the backend has the final word
+CONTEXT_WINDOW_TOLERANCE = float(os.getenv("CONTEXT_WINDOW_TOLERANCE", "1.1"))
+
+
+# --- PASSIVE HEALTH CHECKING (src/inference_engine_proxy_server/core/circuit_breaker.py) ---
+# Eject backends temporarily based on the outcomes of the requests forwarded to them
+CIRCUIT_BREAKER_ENABLED = os.getenv("CIRCUIT_BREAKER_ENABLED", "true").strip().lower() in ("1", "true", "yes")
+# Sliding window of outcomes per backend, and the fewest outcomes in it to judge a backend by
+CIRCUIT_WINDOW_SECONDS = float(os.getenv("CIRCUIT_WINDOW_SECONDS", "30"))
+CIRCUIT_MIN_REQUESTS = max(1, int(os.getenv("CIRCUIT_MIN_REQUESTS", "5")))
+# Eject a backend once this fraction of its requests failed (errors, 5xx, broken or stalled streams)
+CIRCUIT_ERROR_RATE = float(os.getenv("CIRCUIT_ERROR_RATE", "0.5"))
+# A stream waiting longer than this for its next chunk counts as failed
+CIRCUIT_STALL_SECONDS = float(os.getenv("CIRCUIT_STALL_SECONDS", "30"))
+# Eject a backend whose streamed TTFT p90 exceeds this factor times the median of its peers serving the same model
+# (and is at least CIRCUIT_LATENCY_MIN_SECONDS); 0 disables latency ejection
+CIRCUIT_LATENCY_FACTOR = float(os.getenv("CIRCUIT_LATENCY_FACTOR", "3"))
+CIRCUIT_LATENCY_MIN_SECONDS = float(os.getenv("CIRCUIT_LATENCY_MIN_SECONDS", "1"))
+# First ejection length; it doubles with each consecutive ejection up to the maximum
+CIRCUIT_EJECTION_SECONDS = float(os.getenv("CIRCUIT_EJECTION_SECONDS", "10"))
+CIRCUIT_MAX_EJECTION_SECONDS = float(os.getenv("CIRCUIT_MAX_EJECTION_SECONDS", "300"))
+# Requests let through to an ejected backend at a time once its ejection expires (half-open probes)
+CIRCUIT_HALF_OPEN_REQUESTS = max(1, int(os.getenv("CIRCUIT_HALF_OPEN_REQUESTS", "1")))
+# At most this percentage of the backends is ejected at once
+CIRCUIT_MAX_EJECTION_PERCENT = float(os.getenv("CIRCUIT_MAX_EJECTION_PERCENT", "50"))
+
+
+# --- REQUEST HEDGING (src/inference_engine_proxy_server/core/hedging.py) ---
+# Send short non-streaming requests to a second backend as well when the first one is slower than usual
+HEDGING_ENABLED = os.getenv("HEDGING_ENABLED", "false").strip().lower() in ("1", "true", "yes")
+HEDGING_PATHS = {p.strip().strip("/") for p in os.getenv(
+    "HEDGING_PATHS", "v1/embeddings,tokenize,detokenize,v1/chat/completions,v1/completions").split(",") if p.strip()}
+# Completion requests are only hedged when they ask for at most this many tokens (e.g. classification prompts)
+HEDGING_MAX_TOKENS = int(os.getenv("HEDGING_MAX_TOKENS", "16"))
+# The hedge is sent once a request took longer than this percentile of the recent latencies of its path on its
+# backend (at least HEDGING_MIN_DELAY_MS); paths with fewer than HEDGING_MIN_SAMPLES latencies are not hedged
+HEDGING_PERCENTILE = float(os.getenv("HEDGING_PERCENTILE", "95"))
+HEDGING_MIN_SAMPLES = max(1, int(os.getenv("HEDGING_MIN_SAMPLES", "20")))
+HEDGING_WINDOW_SIZE = max(1, int(os.getenv("HEDGING_WINDOW_SIZE", "200")))
+HEDGING_MIN_DELAY_MS = float(os.getenv("HEDGING_MIN_DELAY_MS", "10"))
+# Hedges are capped at this percentage of the hedgeable requests
+HEDGING_BUDGET_PERCENT = float(os.getenv("HEDGING_BUDGET_PERCENT", "5"))
+
+
+# --- RESPONSE CACHE (src/inference_engine_proxy_server/core/response_cache.py) ---
+# Serve repeated deterministic requests (embeddings, temperature 0 or a fixed seed) from memory,
+# and send concurrent identical requests upstream once
+RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE_ENABLED", "false").strip().lower() in ("1", "true", "yes")
+RESPONSE_CACHE_PATHS = {p.strip().strip("/") for p in os.getenv(
+    "RESPONSE_CACHE_PATHS", "v1/chat/completions,v1/completions,v1/embeddings").split(",") if p.strip()}
+RESPONSE_CACHE_MAX_BYTES = int(os.getenv("RESPONSE_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+# Larger responses are passed through without being cached
+RESPONSE_CACHE_MAX_ENTRY_BYTES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRY_BYTES", str(1024 * 1024)))
+RESPONSE_CACHE_TTL_SECONDS = float(os.getenv("RESPONSE_CACHE_TTL_SECONDS", "300"))
+
+
+# --- EMBEDDINGS MICRO-BATCHING (src/inference_engine_proxy_server/core/embeddings_batcher.py) ---
+# Merge concurrent /v1/embeddings requests with the same parameters into one upstream request
+EMBEDDINGS_BATCHING_ENABLED = os.getenv("EMBEDDINGS_BATCHING_ENABLED", "false").strip().lower() in ("1", "true", "yes")
+# A batch is sent once it holds this many inputs or request body bytes, or once its first request waited this long
+EMBEDDINGS_BATCH_MAX_INPUTS = max(1, int(os.getenv("EMBEDDINGS_BATCH_MAX_INPUTS", "64")))
+EMBEDDINGS_BATCH_MAX_BYTES = int(os.getenv("EMBEDDINGS_BATCH_MAX_BYTES", str(1024 * 1024)))
+EMBEDDINGS_BATCH_MAX_DELAY_MS = float(os.getenv("EMBEDDINGS_BATCH_MAX_DELAY_MS", "5"))
+
+
+# --- ADMISSION QUEUE (src/inference_engine_proxy_server/core/admission.py) ---
+# Requests that find every backend full wait here instead of getting an immediate 503.
+# Set the depth to 0 to disable queueing.
+ADMISSION_QUEUE_MAX_DEPTH = int(os.getenv("ADMISSION_QUEUE_MAX_DEPTH", "100"))
+ADMISSION_QUEUE_MAX_WAIT_SECONDS = float(os.getenv("ADMISSION_QUEUE_MAX_WAIT_SECONDS", "30"))
+# Optional header carrying an integer priority (higher is served first), e.g. "x-priority"
+ADMISSION_PRIORITY_HEADER = os.getenv("ADMISSION_PRIORITY_HEADER", "").strip().lower()
+# Priority per API key (Authorization: Bearer <key>), e.g. "key-a=10,key-b=-5"
+ADMISSION_API_KEY_PRIORITIES: Dict[str, int] = _parse_mapping("ADMISSION_API_KEY_PRIORITIES", int, positive=False)
+# Priority classes, e.g. interactive chat and offline batch jobs. A request's class comes from PRIORITY_CLASS_HEADER
+# (e.g. "x-priority-class"), else from the first PRIORITY_CLASS_ROUTES path prefix it matches
+# (e.g. "v1/embeddings=batch"), else it is PRIORITY_DEFAULT_CLASS; unknown class names count as the default class.
+PRIORITY_CLASS_HEADER = os.getenv("PRIORITY_CLASS_HEADER", "").strip().lower()
+PRIORITY_CLASS_ROUTES: Dict[str, str] = {
+    path.strip("/"): name for path, name in _parse_mapping("PRIORITY_CLASS_ROUTES", str, positive=False).items()}
+PRIORITY_DEFAULT_CLASS = os.getenv("PRIORITY_DEFAULT_CLASS", "interactive").strip()
+# Admission queue priority of each class, added to the request's own priority (higher is served first)
+PRIORITY_CLASS_PRIORITIES: Dict[str, int] = (_parse_mapping("PRIORITY_CLASS_PRIORITIES", int, positive=False)
+                                             or {"interactive": 10, "batch": -10})
+# A class may only use backends whose load is below this fraction of MAX_ALLOWED_REQUEST_QUEUE (default 1),
+# keeping headroom for the other classes
+PRIORITY_CLASS_WATERMARKS: Dict[str, float] = _parse_mapping("PRIORITY_CLASS_WATERMARKS") or {"batch": 0.5}
+
+
+# --- PER-TENANT RATE LIMITS (src/inference_engine_proxy_server/core/rate_limit.py) ---
+# Limit each caller in memory before any backend slot is used; over-limit requests get 429 with Retry-After
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "false").strip().lower() in ("1", "true", "yes")
+# Header naming the caller, e.g. "x-tenant-id"; requests without it are keyed by their API key (Authorization: Bearer)
+RATE_LIMIT_KEY_HEADER = os.getenv("RATE_LIMIT_KEY_HEADER", "").strip().lower()
+# Limits per caller; 0 disables a limit. Requests per second may burst up to RATE_LIMIT_BURST
+# (0: one second's worth); tokens per minute (generated tokens only) may burst up to one minute's worth.
+RATE_LIMIT_MAX_CONCURRENT = int(os.getenv("RATE_LIMIT_MAX_CONCURRENT", "0"))
+RATE_LIMIT_REQUESTS_PER_SECOND = float(os.getenv("RATE_LIMIT_REQUESTS_PER_SECOND", "0"))
+RATE_LIMIT_BURST = float(os.getenv("RATE_LIMIT_BURST", "0"))
+RATE_LIMIT_TOKENS_PER_MINUTE = float(os.getenv("RATE_LIMIT_TOKENS_PER_MINUTE", "0"))
+# Factor applied to every limit of the listed callers, e.g. "key-a=10,tenant-b=0.5"
+RATE_LIMIT_KEY_MULTIPLIERS: Dict[str, float] = _parse_mapping("RATE_LIMIT_KEY_MULTIPLIERS")
+# Callers idle for this long are forgotten; beyond RATE_LIMIT_MAX_KEYS the least recently seen ones are
+RATE_LIMIT_IDLE_SECONDS = float(os.getenv("RATE_LIMIT_IDLE_SECONDS", "300"))
+RATE_LIMIT_MAX_KEYS = max(1, int(os.getenv("RATE_LIMIT_MAX_KEYS", "100000")))
\ No newline at end of file
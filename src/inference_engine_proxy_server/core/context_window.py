@@ -0,0 +1,58 @@
+"""
+Context window 路由:
+每個後端的 context window（vLLM `/v1/models` 的 `max_model_len`、llama.cpp `/props` 的 `n_ctx`）
+在取得 static info 時一併記錄。請求估計需要的 token 數（prompt 加上明確指定的 `max_tokens`）放不下的後端
+不參與挑選；整個後端池都放不下時，代理直接回傳 `context_length_exceeded`，不必佔用後端。
+context window 未知的後端一律視為放得下。
+
+所有後端的 context window 都相同時，挑選哪個後端都一樣，請求不做估計（過長的請求由後端自行拒絕），
+只有 context window 不同（或部分未知）時才在每個請求估計 token 數。
+"""
+
+from typing import Iterable, Optional
+
+from .constants import CONTEXT_WINDOW_ROUTING_ENABLED, CONTEXT_WINDOW_TOLERANCE
+from . import backend_state
+from .token_estimator import TokenEstimate
+
+
+def get_context_window(backend_url: str) -> Optional[int]:
+    """Context window of `backend_url` in tokens, or None if unknown."""
+    return backend_state.get_static(backend_url).get("context_window")
+
+
+def has_context_windows() -> bool:
+    """Whether backends differ in context window, i.e. whether a token estimate can change where a request goes."""
+    return CONTEXT_WINDOW_ROUTING_ENABLED and backend_state.has_context_windows()
+
+
+def fits(backend_url: str, tokens: Optional[TokenEstimate]) -> bool:
+    """Whether the request can fit in the context window of `backend_url`."""
+    if not CONTEXT_WINDOW_ROUTING_ENABLED or tokens is None or tokens.context_tokens is None:
+        return True
+    window = get_context_window(backend_url)
+    return window is None or tokens.context_tokens <= window * CONTEXT_WINDOW_TOLERANCE
+
+
+def largest_context_window(pool: Iterable[str]) -> Optional[int]:
+    """Largest context window in `pool`, or None if any backend's window is unknown."""
+    largest = None
+    for backend_url in pool:
+        window = get_context_window(backend_url)
+        if window is None:
+            return None
+        largest = window if largest is None else max(largest, window)
+    return largest
+
+
+def exceeds_pool(pool: Iterable[str], tokens: Optional[TokenEstimate]) -> Optional[int]:
+    """
+    The largest context window of `pool` if the request fits on none of its backends, else None.
+    Pools with a backend of unknown window are never rejected.
+    """
+    if not CONTEXT_WINDOW_ROUTING_ENABLED or tokens is None or tokens.context_tokens is None:
+        return None
+    window = largest_context_window(pool)
+    if window is None or tokens.context_tokens <= window * CONTEXT_WINDOW_TOLERANCE:
+        return None
+    return window
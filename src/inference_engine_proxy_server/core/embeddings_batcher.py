@@ -0,0 +1,210 @@
+"""
+Embeddings micro-batching (`EMBEDDINGS_BATCHING_ENABLED`):
+RAG 管線常送出大量只有單一 input 的 `/v1/embeddings` 請求，每個請求各自經過挑選後端、連線與引擎排程，
+固定開銷遠大於一次 embedding 的計算。這裡把同時到達、參數相同（模型、`encoding_format`、`dimensions` 等 `input`
+以外的欄位、query string 與 `Authorization` 標頭都相同）的請求合併成一個 `input` 為清單的上游請求：
+累積到 `EMBEDDINGS_BATCH_MAX_INPUTS` 個 input 或 `EMBEDDINGS_BATCH_MAX_BYTES` 就立即送出，
+否則批次中第一個請求最多等待 `EMBEDDINGS_BATCH_MAX_DELAY_MS` 毫秒。
+
+合併的回應依各請求在清單中的位置拆回：`data` 的 `index` 從 0 重新編號，`usage` 依各請求 input 的字元數比例分配
+（總和與後端回報的相同）。合併的請求失敗（非 200 回應、數量不符等無法拆分的情況）時，每個請求改為各自送出，
+一個過長的 input 不會連帶讓同一批的其他請求失敗。只有一個請求的批次直接送出原本的 body。
+"""
+
+import asyncio
+import json
+import logging
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+from fastapi import Request, Response
+from fastapi.responses import StreamingResponse
+
+from .constants import EMBEDDINGS_BATCH_MAX_BYTES, EMBEDDINGS_BATCH_MAX_DELAY_MS, EMBEDDINGS_BATCH_MAX_INPUTS
+from .request_body import RequestBody
+from .request_parsing import load_json_body
+from . import telemetry
+
+logger = logging.getLogger("embeddings-batcher")
+
+# OpenAI-style embeddings endpoints whose requests may be merged
+BATCHABLE_PATHS = {"v1/embeddings"}
+
+
+def is_batchable_path(path: str) -> bool:
+    return path.strip("/") in BATCHABLE_PATHS
+
+
+def _text_inputs(data: Optional[Dict[str, Any]]) -> Optional[List[str]]:
+    """The inputs of a request as a list of strings, or None if they are token ids or invalid."""
+    if data is None:
+        return None
+    value = data.get("input")
+    if isinstance(value, str):
+        return [value]
+    if isinstance(value, list) and value and all(isinstance(item, str) for item in value):
+        return value
+    return None
+
+
+def _apportion(total: int, weights: List[int]) -> List[int]:
+    """Splits `total` into integers proportional to `weights` that add up to `total` (largest remainder)."""
+    weight_sum = sum(weights)
+    if weight_sum <= 0:
+        weights = [1] * len(weights)
+        weight_sum = len(weights)
+    exact = [total * weight / weight_sum for weight in weights]
+    shares = [int(share) for share in exact]
+    by_remainder = sorted(range(len(weights)), key=lambda i: exact[i] - shares[i], reverse=True)
+    for i in by_remainder[:total - sum(shares)]:
+        shares[i] += 1
+    return shares
+
+
+def _split_usage(usage: Any, weights: List[int]) -> List[Any]:
+    """One `usage` object per request of a batch, with the token counts split by `weights`."""
+    if not isinstance(usage, dict):
+        return [usage] * len(weights)
+    parts = [dict(usage) for _ in weights]
+    for name, value in usage.items():
+        if isinstance(value, int) and not isinstance(value, bool):
+            for part, share in zip(parts, _apportion(value, weights)):
+                part[name] = share
+    return parts
+
+
+class _Waiter:
+    __slots__ = ("future", "offset", "count", "chars")
+
+    def __init__(self, future: asyncio.Future, offset: int, count: int, chars: int) -> None:
+        self.future = future
+        self.offset = offset   # position of its first input in the merged request
+        self.count = count
+        self.chars = chars     # weight of its share of the usage
+
+
+class _Batch:
+    __slots__ = ("params", "forward", "inputs", "size", "waiters", "timer")
+
+    def __init__(self, params: Dict[str, Any], forward: Callable[[RequestBody], Awaitable[Response]]) -> None:
+        self.params = params    # the request fields other than "input", shared by every request of the batch
+        self.forward = forward  # sends the merged body upstream as the first request of the batch
+        self.inputs: List[str] = []
+        self.size = 0           # request body bytes
+        self.waiters: List[_Waiter] = []
+        self.timer: Optional[asyncio.TimerHandle] = None
+
+
+class EmbeddingsBatcher:
+    """Merges concurrent embeddings requests with the same parameters and splits the merged response."""
+
+    def __init__(self, max_inputs: int = EMBEDDINGS_BATCH_MAX_INPUTS,
+                 max_bytes: int = EMBEDDINGS_BATCH_MAX_BYTES,
+                 max_delay_ms: float = EMBEDDINGS_BATCH_MAX_DELAY_MS) -> None:
+        self.max_inputs = max_inputs
+        self.max_bytes = max_bytes
+        self.max_delay = max_delay_ms / 1000
+        self._open: Dict[Tuple[str, str, str], _Batch] = {}
+        # Merged requests in flight, referenced so they are not garbage collected
+        self._tasks: Set[asyncio.Task] = set()
+
+    async def submit(self, request: Request, body: RequestBody,
+                     forward: Callable[[RequestBody], Awaitable[Response]]) -> Response:
+        """
+        Answers an embeddings request as part of a merged upstream request. `forward(body)`
+        sends a body upstream on behalf of `request`; requests that cannot be merged use it directly.
+        """
+        data = load_json_body(body.data) if body.in_memory else None
+        inputs = _text_inputs(data)
+        if inputs is None or len(inputs) >= self.max_inputs or body.size >= self.max_bytes:
+            return await forward(body)
+
+        params = {name: value for name, value in data.items() if name != "input"}
+        key = (json.dumps(params, sort_keys=True, separators=(",", ":")),
+               request.url.query, request.headers.get("authorization", ""))
+        batch = self._open.get(key)
+        if batch is not None and (len(batch.inputs) + len(inputs) > self.max_inputs
+                                  or batch.size + body.size > self.max_bytes):
+            self._flush(key, batch)
+            batch = None
+        if batch is None:
+            batch = self._open[key] = _Batch(params, forward)
+            batch.timer = asyncio.get_running_loop().call_later(self.max_delay, self._flush, key, batch)
+
+        waiter = _Waiter(asyncio.get_running_loop().create_future(), len(batch.inputs), len(inputs),
+                         sum(len(text) for text in inputs))
+        batch.inputs.extend(inputs)
+        batch.size += body.size
+        batch.waiters.append(waiter)
+        if len(batch.inputs) >= self.max_inputs or batch.size >= self.max_bytes:
+            self._flush(key, batch)
+
+        response = await waiter.future
+        if response is None:
+            # Alone in its batch, or the merged request could not be answered: send it as it came
+            return await forward(body)
+        return response
+
+    def _flush(self, key: Tuple[str, str, str], batch: _Batch) -> None:
+        if self._open.get(key) is batch:
+            del self._open[key]
+        if batch.timer is not None:
+            batch.timer.cancel()
+            batch.timer = None
+        task = asyncio.create_task(self._send(batch))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _send(self, batch: _Batch) -> None:
+        telemetry.EMBEDDINGS_BATCH_REQUESTS.observe(len(batch.waiters))
+        responses: Optional[List[Response]] = None
+        try:
+            if len(batch.waiters) > 1:
+                merged = RequestBody(json.dumps({**batch.params, "input": batch.inputs}).encode())
+                try:
+                    responses = self._split(batch, await batch.forward(merged))
+                except Exception as e:
+                    logger.warning("Merged embeddings request of %d requests failed: %r", len(batch.waiters), e)
+                finally:
+                    merged.close()
+                if responses is None:
+                    telemetry.EMBEDDINGS_BATCH_FALLBACKS.inc()
+        finally:
+            for i, waiter in enumerate(batch.waiters):
+                if not waiter.future.done():   # the client may have gone away
+                    waiter.future.set_result(responses[i] if responses is not None else None)
+
+    def _split(self, batch: _Batch, response: Response) -> Optional[List[Response]]:
+        """One response per request of `batch`, or None if the merged response cannot be split."""
+        if response.status_code != 200 or isinstance(response, StreamingResponse):
+            return None
+        result = load_json_body(response.body)
+        items = result.get("data") if result is not None else None
+        if not isinstance(items, list) or len(items) != len(batch.inputs):
+            return None
+        ordered: List[Any] = [None] * len(items)
+        for item in items:
+            index = item.get("index") if isinstance(item, dict) else None
+            if not isinstance(index, int) or not 0 <= index < len(items) or ordered[index] is not None:
+                return None
+            ordered[index] = item
+
+        usages = _split_usage(result.get("usage"), [waiter.chars for waiter in batch.waiters])
+        headers = {name: value for name, value in response.headers.items() if name != "content-length"}
+        responses = []
+        for waiter, usage in zip(batch.waiters, usages):
+            data = [{**item, "index": i} for i, item in enumerate(ordered[waiter.offset:waiter.offset + waiter.count])]
+            part = {**result, "data": data}
+            if usage is not None:
+                part["usage"] = usage
+            responses.append(Response(json.dumps(part).encode(), status_code=200, headers=headers))
+        return responses
+
+
+_batcher: Optional[EmbeddingsBatcher] = None
+
+
+def get_embeddings_batcher() -> EmbeddingsBatcher:
+    global _batcher
+    if _batcher is None:
+        _batcher = EmbeddingsBatcher()
+    return _batcher
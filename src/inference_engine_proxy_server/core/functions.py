@@ -1,65 +1,161 @@
 import random
 import time
-from typing import Union, Optional, List, Dict, Any
+from typing import Union, Optional, List, Dict, Any, Set, Tuple
 
-from ..core.constants import BACKENDS, _METRICS_CACHE, METRICS_CACHE_TTL_SECONDS
+from ..core.constants import BACKENDS, MAX_ALLOWED_REQUEST_QUEUE
+from ..core.backend_state import get_load_index, get_state, refresh
+from ..core.inflight import get_inflight
+from ..core.strategies import get_strategy
+from ..core.affinity import select_by_affinity
+from ..core.models import get_model_pool
+from ..core.context_window import fits, get_context_window
+from ..core.registry import is_draining
+from ..core import circuit_breaker, stream_stats, telemetry
+from ..core.token_estimator import TokenEstimate
 from ..backends.llamacpp import LlamacppBackend
 from ..backends.vllm import VllmBackend
 
+# Random draws a sampled strategy (p2c) makes to find two eligible backends before it scans them all
+SAMPLE_ATTEMPTS = 8
+# Candidate buffers reused by every selection; `_select_backend` never awaits, so they are never shared
+_candidates: List[Tuple[str, float]] = []
+_sample: List[Tuple[str, float]] = []
+
 def get_all_metrics_from_cache() -> List[Dict[str, Any]]:
     """
     Gets the current status of all backends directly from the cache.
     This is a fast, non-blocking operation.
     """
     results = []
+    now = time.monotonic()
     for backend_url in BACKENDS:
-        cache_entry = _METRICS_CACHE.get(backend_url, {})
-        dynamic_info = cache_entry.get("dynamic", {"ready": False})
+        state = get_state(backend_url)
+        dynamic_info = state.dynamic() if state is not None else {"ready": False}
         results.append({
             "backend": backend_url,
-            "ready": dynamic_info.get("ready", False),
+            "ready": dynamic_info["ready"],
+            "inflight": get_inflight(backend_url),
+            "draining": is_draining(backend_url),
+            "circuit": circuit_breaker.status(backend_url),
+            "context_window": get_context_window(backend_url),
+            "streams": stream_stats.status(backend_url, now),
             "metrics": dynamic_info
         })
     return results
 
-async def choose_backend() -> Optional[Union[LlamacppBackend, VllmBackend]]:
+def mark_backend_unready(backend_url: str) -> None:
+    """
+    Marks a backend as not ready right after a request to it failed, instead of
+    waiting for the next refresh_loop cycle, which will re-evaluate it.
+    """
+    state = get_state(backend_url)
+    if state is None:
+        return
+    state.ready = False
+    refresh(backend_url)
+
+async def choose_backend(affinity_key: Optional[int] = None,
+                         exclude: Optional[Set[str]] = None,
+                         model: Optional[str] = None,
+                         tokens: Optional[TokenEstimate] = None,
+                         max_load: float = MAX_ALLOWED_REQUEST_QUEUE) -> Optional[Union[LlamacppBackend, VllmBackend]]:
     """
     Chooses the best backend based on metrics from the cache.
-    This function no longer performs any network I/O and is extremely fast.
+    This function no longer performs any network I/O and is extremely fast;
+    with an indexed strategy (see backend_state.py) it usually only looks at the least loaded backend.
+    If `affinity_key` (a prompt prefix hash) is given, the backend owning it on the
+    consistent hash ring is preferred as long as it is ready and not overloaded.
+    Backends in `exclude` (e.g. ones that already failed this request) are skipped.
+    If `model` is given, only the backends serving that model are considered.
+    Draining backends and backends ejected by the circuit breaker get no new requests.
+    `tokens` is the request's token estimate, for strategies that weigh load by tokens;
+    backends whose context window cannot hold the request are skipped.
+    Only backends whose load is below `max_load` are considered (lower for batch priority classes).
     """
+    start = time.perf_counter()
+    try:
+        return _select_backend(affinity_key, exclude, model, tokens, max_load)
+    finally:
+        telemetry.ROUTING_DECISION_SECONDS.observe(time.perf_counter() - start)
+
+def _select_backend(affinity_key: Optional[int],
+                    exclude: Optional[Set[str]],
+                    model: Optional[str],
+                    tokens: Optional[TokenEstimate],
+                    max_load: float = MAX_ALLOWED_REQUEST_QUEUE) -> Optional[Union[LlamacppBackend, VllmBackend]]:
     now = time.time()
-    candidates = []
-    
-    for backend_url, cache_entry in _METRICS_CACHE.items():
-        dynamic_info = cache_entry.get("dynamic", {})
-        ts = dynamic_info.get("timestamp", 0)
-        ready = dynamic_info.get("ready", False)
-        reqs = dynamic_info.get("requests_processing", float("inf"))
+    pool = get_model_pool(model) if model is not None else None
+
+    strategy = get_strategy()
+    # The load index holds the routable backends ordered by the strategy; its head (a random one
+    # of the equally loaded backends at the top) is the answer unless the request needs a subset
+    # of the backends or the head cannot take it.
+    index = get_load_index()
+    if index is not None and affinity_key is None and (pool is None or len(pool) == len(BACKENDS)):
+        state = index.peek_random()
+        if state is None:
+            return None
+        if (state.fresh_until > now and state.load() < max_load
+                and not (exclude and state.url in exclude) and fits(state.url, tokens)):
+            return state.backend
+
+    backend_urls = BACKENDS if pool is None else pool
+    # A sampled strategy only needs two eligible backends drawn at random
+    if strategy.sampled and affinity_key is None and len(backend_urls) > 2:
+        sample = _sample
+        sample.clear()
+        for _ in range(SAMPLE_ATTEMPTS):
+            candidate = _candidate(backend_urls[random.randrange(len(backend_urls))], exclude, now, tokens, max_load)
+            if candidate is not None and (not sample or sample[0][0] != candidate[0]):
+                sample.append(candidate)
+                if len(sample) == 2:
+                    return get_state(strategy.select(sample, tokens)).backend
+        # Too few eligible backends to find two at random: look at all of them
 
-        # Check if backend is ready and its data is not too stale (with a grace period)
-        if ready and (now - ts) < METRICS_CACHE_TTL_SECONDS * 2:
-            candidates.append((backend_url, reqs))
+    candidates = _candidates
+    candidates.clear()
+    for backend_url in backend_urls:
+        candidate = _candidate(backend_url, exclude, now, tokens, max_load)
+        if candidate is not None:
+            candidates.append(candidate)
 
-    if not candidates:
+    selected_backend_url = None
+    if affinity_key is not None:
+        selected_backend_url = select_by_affinity(affinity_key, candidates, pool)
+
+    # The configured strategy (LB_STRATEGY) picks among the ready candidates
+    if selected_backend_url is None:
+        selected_backend_url = strategy.select(candidates, tokens)
+    if selected_backend_url is None:
         return None
 
-    # Find the minimum load value among candidates
-    min_load = min(reqs for _, reqs in candidates)
-    
-    # Get all backends that have the same minimum load
-    best_options = [url for url, reqs in candidates if reqs == min_load]
-    
-    # Randomly select one from the best options to distribute load evenly
-    selected_backend_url = random.choice(best_options)
-    
     # --- NO MORE AWAITS! ---
-    # Get the provider directly from the cache
-    provider = _METRICS_CACHE[selected_backend_url].get("static", {}).get("provider")
+    # The long-lived backend object of the selected backend
+    return get_state(selected_backend_url).backend
 
-    if provider == "llamacpp":
-        return LlamacppBackend(selected_backend_url)
-    elif provider == "vllm":
-        return VllmBackend(selected_backend_url)
-    else:
-        # This should not happen if the cache is working correctly
-        return None
\ No newline at end of file
+def _candidate(backend_url: str,
+               exclude: Optional[Set[str]],
+               now: float,
+               tokens: Optional[TokenEstimate],
+               max_load: float) -> Optional[Tuple[str, float]]:
+    """`(backend_url, load)` if the backend can take the request, else None."""
+    if exclude and backend_url in exclude:
+        return None
+    state = get_state(backend_url)
+    # Check if backend is ready and its data is not too stale (with a grace period).
+    if state is None or not state.ready or state.fresh_until <= now:
+        return None
+    if is_draining(backend_url):
+        return None
+    if not fits(backend_url, tokens):
+        return None
+    if not circuit_breaker.allows(backend_url):
+        return None
+    # The live load is checked too, since `ready` only reflects the queue at the last poll.
+    reqs = state.load()
+    if reqs >= max_load:
+        return None
+    candidate = state.candidate
+    if candidate[1] != reqs:
+        candidate = state.candidate = (backend_url, reqs)
+    return candidate
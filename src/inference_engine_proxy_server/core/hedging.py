@@ -0,0 +1,234 @@
+"""
+Request hedging (`HEDGING_ENABLED`):
+分類 prompt、embeddings、`/tokenize` 這類短的非串流請求，p99 往往由單一變慢的節點決定。
+`HEDGING_PATHS` 中的請求若在「該路徑在該後端最近延遲的 `HEDGING_PERCENTILE` 百分位數」內還沒有回應，
+就向 `choose_backend` 選出的下一個最佳後端再送一份，先完成者勝出；另一個請求被取消，
+其 httpx 串流隨之關閉，推論引擎也會中止該請求。落敗的請求若已經有回應（同時完成、被較好的回應取代的 5xx），
+該回應也會被關閉，釋放上游連線與後端的 in-flight 計數。
+
+- 完成類路徑（`chat/completions`、`completions`）只對非串流、`max_tokens` 不超過 `HEDGING_MAX_TOKENS` 的請求啟用。
+- 延遲以每個 (路徑, 後端) 最近 `HEDGING_WINDOW_SIZE` 次的完成時間計算，樣本少於 `HEDGING_MIN_SAMPLES` 時不 hedge。
+- 額外的請求以預算限制：每個可 hedge 的請求累積 `HEDGING_BUDGET_PERCENT`% 個額度，每次 hedge 用掉一個，
+  後端普遍變慢時額外負載最多只有流量的這個比例。
+- 5xx 回應或故障轉移錯誤不算勝出，會等待另一個請求。
+"""
+
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Iterable, Optional, Set, Tuple
+
+from fastapi import Request, Response
+
+from .constants import (
+    HEDGING_BUDGET_PERCENT,
+    HEDGING_MAX_TOKENS,
+    HEDGING_MIN_DELAY_MS,
+    HEDGING_MIN_SAMPLES,
+    HEDGING_PATHS,
+    HEDGING_PERCENTILE,
+    HEDGING_WINDOW_SIZE,
+)
+from .functions import mark_backend_unready
+from .request_body import RequestBody
+from .request_parsing import load_json_body
+from .token_estimator import TokenEstimate
+from . import telemetry
+
+logger = logging.getLogger("hedging")
+
+# The hedge delay of a path on a backend is recomputed at most this often (it sorts the window)
+DELAY_CHECK_SECONDS = 1.0
+# Unused hedge budget saved up for bursts of slow requests
+MAX_BUDGET = 10.0
+_COMPLETION_PATHS = ("chat/completions", "completions")
+
+
+def is_hedgeable(path: str, request: Request, body: Optional[RequestBody]) -> bool:
+    """Whether a request may be sent twice: a short, non-streaming call on `HEDGING_PATHS` with a replayable body."""
+    path = path.strip("/")
+    if path not in HEDGING_PATHS or body is None or not body.in_memory:
+        return False
+    if request.method != "POST":
+        return True
+    data = load_json_body(body.data)
+    if data is None:
+        return not body.size
+    if data.get("stream"):
+        return False
+    if path.endswith(_COMPLETION_PATHS):
+        requested = data.get("max_tokens", data.get("max_completion_tokens"))
+        return isinstance(requested, int) and 0 < requested <= HEDGING_MAX_TOKENS
+    return True
+
+
+class _LatencyWindow:
+    """Recent completion times of one path on one backend, and the hedge delay derived from them."""
+
+    __slots__ = ("samples", "delay", "checked")
+
+    def __init__(self) -> None:
+        self.samples: Deque[float] = deque(maxlen=HEDGING_WINDOW_SIZE)
+        self.delay: Optional[float] = None
+        self.checked = float("-inf")
+
+    def hedge_delay(self, now: float) -> Optional[float]:
+        if now - self.checked >= DELAY_CHECK_SECONDS:
+            self.checked = now
+            if len(self.samples) < HEDGING_MIN_SAMPLES:
+                self.delay = None
+            else:
+                values = sorted(self.samples)
+                percentile = values[min(len(values) - 1, int(HEDGING_PERCENTILE / 100 * len(values)))]
+                self.delay = max(percentile, HEDGING_MIN_DELAY_MS / 1000)
+        return self.delay
+
+
+_windows: Dict[Tuple[str, str], _LatencyWindow] = {}
+_budget = MAX_BUDGET
+# Closing responses of attempts that finished after being cancelled
+_discarding: Set[asyncio.Task] = set()
+
+
+def _window(path: str, backend_url: str) -> _LatencyWindow:
+    key = (path.strip("/"), backend_url)
+    window = _windows.get(key)
+    if window is None:
+        window = _windows[key] = _LatencyWindow()
+    return window
+
+
+def _take_budget() -> bool:
+    global _budget
+    if _budget < 1:
+        return False
+    _budget -= 1
+    return True
+
+
+async def _discard(response: Response) -> None:
+    """Closes a response that is not sent to the client, so a streamed one releases its backend."""
+    aclose = getattr(getattr(response, "body_iterator", None), "aclose", None)
+    if aclose is not None:
+        try:
+            await aclose()
+        except Exception as e:
+            logger.debug("Closing a discarded response failed: %s", e)
+
+
+def _discard_result(task: asyncio.Task) -> None:
+    # A cancelled attempt may still have finished or failed; its response is closed, its error ignored
+    if task.cancelled() or task.exception() is not None:
+        return
+    closing = asyncio.ensure_future(_discard(task.result()))
+    _discarding.add(closing)
+    closing.add_done_callback(_discarding.discard)
+
+
+async def forward_hedged(backend, request: Request, path: str,
+                         choose: Callable[[Set[str]], Awaitable[Any]], failed: Set[str],
+                         allow_failover: bool = False, body: Optional[RequestBody] = None,
+                         tokens: Optional[TokenEstimate] = None) -> Response:
+    """
+    `backend.forward_request(...)`, hedged: if it has not answered within the hedge delay of `path`
+    on `backend`, the request is also sent to `choose(exclude)` (the next-best backend) and the first
+    good response wins. The other attempt is cancelled, or its response closed if it already has one.
+    Backends whose attempt failed over are added to `failed`; if every attempt failed, the primary's
+    error is raised as without hedging.
+    """
+    global _budget
+    _budget = min(MAX_BUDGET, _budget + HEDGING_BUDGET_PERCENT / 100)
+    started = time.monotonic()
+    delay = _window(path, backend.backend_url).hedge_delay(started)
+
+    attempts: Dict[asyncio.Task, Tuple[Any, float]] = {}
+
+    def start(target) -> None:
+        task = asyncio.create_task(target.forward_request(
+            request, path, allow_failover=allow_failover, body=body, tokens=tokens))
+        attempts[task] = (target, time.monotonic())
+
+    start(backend)
+    hedged = False
+    winner: Optional[asyncio.Task] = None
+    try:
+        if delay is not None:
+            done, _ = await asyncio.wait(attempts, timeout=delay)
+            if not done:
+                if not _take_budget():
+                    telemetry.HEDGED_REQUESTS.labels("no_budget").inc()
+                else:
+                    hedge = await choose(failed | {backend.backend_url})
+                    if hedge is None:
+                        _budget += 1   # unused
+                        telemetry.HEDGED_REQUESTS.labels("no_backend").inc()
+                    else:
+                        logger.debug("Hedging %s on %s after %.3fs on %s",
+                                     path, hedge.backend_url, delay, backend.backend_url)
+                        start(hedge)
+                        hedged = True
+        winner, response = await _first_response(attempts, path, failed)
+        if hedged:
+            won = "hedge_won" if attempts[winner][0] is not backend else "primary_won"
+            telemetry.HEDGED_REQUESTS.labels(won).inc()
+        return response
+    finally:
+        # Every attempt but the winner is cancelled, and a response it already produced is closed
+        for task, (target, attempt_started) in attempts.items():
+            if task is winner:
+                continue
+            if task.done():
+                if not task.cancelled() and task.exception() is None:
+                    await _discard(task.result())
+            else:
+                task.cancel()
+                task.add_done_callback(_discard_result)
+                # It took at least this long; keeps a slow backend's delay from drifting down
+                _window(path, target.backend_url).samples.append(time.monotonic() - attempt_started)
+
+
+async def _first_response(attempts: Dict[asyncio.Task, Tuple[Any, float]], path: str,
+                          failed: Set[str]) -> Tuple[asyncio.Task, Response]:
+    """The task and response of the first attempt answering below 500, else the best answer or error."""
+    from ..backends.base import BackendUnavailableError
+
+    pending = set(attempts)
+    fallback: Optional[Tuple[asyncio.Task, Response]] = None
+    errors: Dict[asyncio.Task, BaseException] = {}
+    while pending:
+        done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+        # The primary first if both finished together
+        for task in sorted(done, key=lambda t: attempts[t][1]):
+            target, attempt_started = attempts[task]
+            try:
+                response = task.result()
+            except Exception as e:
+                errors[task] = e
+                continue
+            if response.status_code < 500:
+                _window(path, target.backend_url).samples.append(time.monotonic() - attempt_started)
+                _mark_failed(errors.values(), failed, BackendUnavailableError)
+                return task, response
+            if fallback is None:
+                fallback = (task, response)
+    if fallback is not None:
+        _mark_failed(errors.values(), failed, BackendUnavailableError)
+        return fallback
+    # The caller fails the primary's error over; the other attempts' backends are already excluded
+    ordered = [errors[task] for task in attempts]
+    _mark_failed(ordered[1:], failed, BackendUnavailableError)
+    raise ordered[0]
+
+
+def _mark_failed(errors: Iterable[BaseException], failed: Set[str], error_type: type) -> None:
+    for error in errors:
+        if isinstance(error, error_type):
+            failed.add(error.backend_url)
+            mark_backend_unready(error.backend_url)
+
+
+def forget(backend_url: str) -> None:
+    """Drops the latency windows of a backend that was removed."""
+    for key in [key for key in _windows if key[1] == backend_url]:
+        del _windows[key]
@@ -1,30 +1,161 @@
 """
 全域 httpx.AsyncClient:
-使用 FastAPI 的 lifespan 事件來管理一個全域的 httpx 客戶端實例是標準的最佳實踐。
+使用 FastAPI 的 lifespan 事件來管理全域的 httpx 客戶端實例是標準的最佳實踐。
 利用了連線池 (Connection Pooling)，避免了為每個請求重複建立 TCP 連線和 TLS 交握的開銷。
+
+連線池分為兩種:
+- 資料平面 (`get_backend_client`): 每個後端一個連線池，上限依後端容量設定，
+  一個後端塞滿時不會佔用其他後端的連線，也不會讓健康檢查排隊。可選擇對支援的後端使用 HTTP/2。
+- 控制平面 (`get_client`): `/health`、`/metrics`、`/v1/models` 等探測共用的小型連線池，逾時較短。
+
+`pool_trace` 透過 httpcore 的 trace extension 量測每個轉發請求等待連線、建立連線的時間與連線是否重用。
 """
 
 import asyncio
 import contextlib
+import logging
+import math
+import time
+from typing import Any, Dict
+
 import httpx
 from .cache_refresher import refresh_loop
+from .constants import (
+    BACKENDS,
+    BACKEND_MAX_CONNECTIONS,
+    BACKEND_TIMEOUT_SECONDS,
+    BACKEND_WEIGHTS,
+    BACKENDS_FILE,
+    CONTEXT_WINDOW_ROUTING_ENABLED,
+    CONTROL_TIMEOUT_SECONDS,
+    HTTP2_BACKENDS,
+    MAX_ALLOWED_REQUEST_QUEUE,
+    POOL_ACQUIRE_TIMEOUT_SECONDS,
+    POOL_KEEPALIVE_EXPIRY_SECONDS,
+    PROXY_WORKERS,
+)
+from .strategies import get_strategy
+from .token_estimator import get_token_estimator
+from . import registry, shared_state, telemetry
+
+logger = logging.getLogger("http-client")
 
 _client: httpx.AsyncClient | None = None
+# data plane: {backend_url: client with a pool sized for that backend}
+_backend_clients: Dict[str, httpx.AsyncClient] = {}
+
 
 def get_client() -> httpx.AsyncClient:
+    """Control-plane client for health, metrics and model probes."""
     global _client
     if _client is None:
-        # ✅ 移除 http2=True，讓 httpx 自動協商協定
-        _client = httpx.AsyncClient(timeout=5)
+        _client = httpx.AsyncClient(
+            timeout=CONTROL_TIMEOUT_SECONDS,
+            limits=httpx.Limits(max_connections=None, max_keepalive_connections=32,
+                                keepalive_expiry=POOL_KEEPALIVE_EXPIRY_SECONDS),
+        )
     return _client
 
+
+def max_connections(backend_url: str) -> int:
+    """Pool size of a backend: `BACKEND_MAX_CONNECTIONS`, else twice what routing lets through."""
+    if backend_url in BACKEND_MAX_CONNECTIONS:
+        return BACKEND_MAX_CONNECTIONS[backend_url]
+    return max(1, math.ceil(2 * MAX_ALLOWED_REQUEST_QUEUE * BACKEND_WEIGHTS.get(backend_url, 1.0)))
+
+
+def uses_http2(backend_url: str) -> bool:
+    return "*" in HTTP2_BACKENDS or backend_url in HTTP2_BACKENDS
+
+
+def get_backend_client(backend_url: str) -> httpx.AsyncClient:
+    """Data-plane client of `backend_url`, created on first use."""
+    client = _backend_clients.get(backend_url)
+    if client is None:
+        size = max_connections(backend_url)
+        options: Dict[str, Any] = {}
+        if uses_http2(backend_url):
+            from ..utils.utils import check_required_packages
+            check_required_packages("h2")
+            # https negotiates HTTP/2 with ALPN; plain http needs prior knowledge (h2c)
+            options = {"http2": True} if backend_url.startswith("https://") else {"http1": False, "http2": True}
+        client = httpx.AsyncClient(
+            timeout=httpx.Timeout(BACKEND_TIMEOUT_SECONDS, pool=POOL_ACQUIRE_TIMEOUT_SECONDS),
+            limits=httpx.Limits(max_connections=size, max_keepalive_connections=size,
+                                keepalive_expiry=POOL_KEEPALIVE_EXPIRY_SECONDS),
+            **options,
+        )
+        _backend_clients[backend_url] = client
+        logger.info("Connection pool for %s: %d connections%s", backend_url, size, ", HTTP/2" if options else "")
+    return client
+
+
+async def close_backend_client(backend_url: str) -> None:
+    """Closes the pool of a removed backend; a later request to it would open a new one."""
+    client = _backend_clients.pop(backend_url, None)
+    if client is not None:
+        await client.aclose()
+
+
+def pool_trace(backend_url: str):
+    """
+    httpcore `trace` extension for one proxied request. `connect_tcp.started` ends the wait for
+    the pool and starts a new connection, which is set up once the request headers go out;
+    `send_request_headers.started` without a connect before it means a pooled connection was reused.
+    """
+    metrics = telemetry.backend_metrics(backend_url)
+    start = time.monotonic()
+    connect_start = None
+    done = False
+
+    async def trace(event: str, info: Dict[str, Any]) -> None:
+        nonlocal connect_start, done
+        if done:
+            return
+        if event == "connection.connect_tcp.started":
+            connect_start = time.monotonic()
+            metrics.pool_wait.observe(connect_start - start)
+            metrics.new_connections.inc()
+        elif event.endswith(".send_request_headers.started"):
+            done = True
+            if connect_start is None:
+                metrics.pool_wait.observe(time.monotonic() - start)
+                metrics.reused_connections.inc()
+            else:
+                metrics.connect.observe(time.monotonic() - connect_start)
+
+    return trace
+
+
 async def lifespan(app):
-    app.state.metrics_task = asyncio.create_task(refresh_loop())
+    # 多 worker 模式的 /metrics 需要 PROMETHEUS_MULTIPROC_DIR，未設定時警告、路徑無效時直接失敗
+    telemetry.check_multiprocess(PROXY_WORKERS)
+    # BACKENDS_FILE 存在時以它作為後端清單，之後持續監看變更
+    if BACKENDS_FILE:
+        registry.load_file(BACKENDS_FILE)
+    # 啟動時就建立負載平衡策略，設定錯誤的 LB_STRATEGY 會在此直接失敗；
+    # 需要估計 token 數時先在背景載入編碼器（tiktoken 第一次使用時會下載），不在請求路徑中載入
+    if get_strategy().uses_tokens or CONTEXT_WINDOW_ROUTING_ENABLED:
+        get_token_estimator().start_loading()
+    # 同樣在啟動時建立各後端的連線池，HTTP2_BACKENDS 缺少 h2 套件時直接失敗
+    for backend_url in BACKENDS:
+        get_backend_client(backend_url)
+    if shared_state.get_shared_state() is not None:
+        # 多 worker 模式：只有 leader worker 輪詢後端，其他 worker 讀取共享記憶體
+        app.state.metrics_task = asyncio.create_task(shared_state.run(refresh_loop))
+    else:
+        app.state.metrics_task = asyncio.create_task(refresh_loop())
+    app.state.registry_task = asyncio.create_task(registry.watch_file(BACKENDS_FILE)) if BACKENDS_FILE else None
 
     yield
+    if app.state.registry_task is not None:
+        app.state.registry_task.cancel()
     if _client is not None:
         await _client.aclose()
-    
+    for client in list(_backend_clients.values()):
+        await client.aclose()
+    _backend_clients.clear()
+
     app.state.metrics_task.cancel()
     with contextlib.suppress(asyncio.CancelledError):
-        await app.state.metrics_task
\ No newline at end of file
+        await app.state.metrics_task
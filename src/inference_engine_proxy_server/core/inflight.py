@@ -0,0 +1,56 @@
+"""
+Proxy 端的 in-flight 請求計數:
+後端狀態表 (backend_state.py) 只會每 `METRICS_CACHE_TTL_SECONDS` 秒刷新一次，在兩次輪詢之間湧入的請求
+都會看到同一個「最空閒」的後端。這裡的計數在請求路徑上同步更新，讓路由能即時看到本代理送出的負載。
+多 worker 模式下另外寫入共享記憶體，`get_inflight` 回傳所有 worker 的總和。
+"""
+
+from typing import Optional
+
+from .constants import _INFLIGHT_REQUESTS, _INFLIGHT_TOKENS
+from .admission import notify_capacity
+from . import backend_state
+from .shared_state import get_shared_state
+from .token_estimator import TokenEstimate
+
+
+def _add_tokens(backend_url: str, tokens: TokenEstimate, sign: int) -> None:
+    entry = _INFLIGHT_TOKENS.setdefault(backend_url, [0, 0, 0])
+    entry[0] = max(0, entry[0] + sign * tokens.prompt_tokens)
+    entry[1] = max(0, entry[1] + sign * tokens.max_tokens)
+    entry[2] = max(0, entry[2] + sign)
+
+
+def acquire(backend_url: str, tokens: Optional[TokenEstimate] = None) -> None:
+    """Counts one more request in flight on `backend_url`, with its token estimate if known."""
+    _INFLIGHT_REQUESTS[backend_url] = _INFLIGHT_REQUESTS.get(backend_url, 0) + 1
+    if tokens is not None:
+        _add_tokens(backend_url, tokens, 1)
+    shared = get_shared_state()
+    if shared is not None:
+        shared.add_inflight(backend_url, 1)
+    backend_state.refresh(backend_url)
+
+
+def release(backend_url: str, tokens: Optional[TokenEstimate] = None) -> None:
+    """Counts one request on `backend_url` as finished; `tokens` must match the `acquire` call."""
+    if tokens is not None:
+        _add_tokens(backend_url, tokens, -1)
+    count = _INFLIGHT_REQUESTS.get(backend_url, 0)
+    _INFLIGHT_REQUESTS[backend_url] = max(0, count - 1)
+    shared = get_shared_state()
+    if shared is not None and count > 0:
+        shared.add_inflight(backend_url, -1)
+    backend_state.refresh(backend_url)
+    # A slot was freed: let the next request waiting for admission retry
+    notify_capacity()
+
+
+def get_inflight(backend_url: str) -> int:
+    """Returns the number of requests currently in flight on `backend_url` (across all workers)."""
+    shared = get_shared_state()
+    if shared is not None:
+        total = shared.total_inflight(backend_url)
+        if total is not None:
+            return total
+    return _INFLIGHT_REQUESTS.get(backend_url, 0)
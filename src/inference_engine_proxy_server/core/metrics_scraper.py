@@ -0,0 +1,152 @@
+"""
+Prometheus `/metrics` 的輕量擷取器:
+後端的 exposition（特別是 vLLM）包含數百個 histogram bucket，但路由只需要少數幾個 gauge/counter。
+這裡以串流方式逐行掃描，只解析指定名稱的 series，必要的欄位全部找到後即停止解析
+（回應仍會完整下載，剩餘內容僅讀取丟棄以保留 keep-alive 連線），最後回傳型別化的 `MetricsSnapshot`。
+"""
+
+from dataclasses import dataclass, fields
+from typing import Collection, Dict, Iterable, Optional
+
+import httpx
+
+
+@dataclass
+class MetricsSnapshot:
+    """Routing-relevant values scraped from one backend. Fields stay None when not exposed."""
+    requests_processing: Optional[float] = None
+    requests_deferred: Optional[float] = None
+    # Throughput gauges (llama.cpp) in tokens/s
+    prompt_tokens_per_second: Optional[float] = None
+    generation_tokens_per_second: Optional[float] = None
+    # Monotonic token counters (vLLM), turned into throughput by the backend between polls
+    prompt_tokens_total: Optional[float] = None
+    generation_tokens_total: Optional[float] = None
+    # Fraction of the KV cache in use, 0..1
+    kv_cache_usage: Optional[float] = None
+
+
+SNAPSHOT_FIELDS = frozenset(f.name for f in fields(MetricsSnapshot))
+
+
+class MetricsScanner:
+    """
+    Incremental parser fed with raw exposition bytes.
+    `wanted` maps metric names (both `a:b` and `a_b` spellings, or the names of different
+    engine versions, may be listed) to `MetricsSnapshot` field names. Samples of the same
+    metric with different labels are summed; of several names for one field, only the first
+    one found is used. Once every wanted field except the `optional` ones has been seen and a
+    different metric starts, `done` becomes True and further input is ignored, so an optional
+    field is only found if the exposition lists it before that point.
+    """
+
+    def __init__(self, wanted: Dict[str, str], optional: Collection[str] = ()) -> None:
+        unknown = (set(wanted.values()) | set(optional)) - SNAPSHOT_FIELDS
+        if unknown:
+            raise ValueError(f"Unknown snapshot fields: {unknown}")
+        self._wanted = {name.encode(): field for name, field in wanted.items()}
+        self._missing = set(wanted.values()) - set(optional)
+        self._values: Dict[str, float] = {}
+        # The metric name each field was taken from
+        self._sources: Dict[str, bytes] = {}
+        self._partial = b""
+        self._current: Optional[str] = None
+        self.done = False
+
+    def feed(self, chunk: bytes) -> None:
+        if self.done:
+            return
+        data = self._partial + chunk if self._partial else chunk
+        start = 0
+        while True:
+            end = data.find(b"\n", start)
+            if end == -1:
+                self._partial = data[start:]
+                return
+            self._line(data, start, end)
+            if self.done:
+                self._partial = b""
+                return
+            start = end + 1
+
+    def close(self) -> None:
+        """Processes a trailing line without newline."""
+        if self._partial and not self.done:
+            self._line(self._partial, 0, len(self._partial))
+        self._partial = b""
+
+    def _line(self, data: bytes, start: int, end: int) -> None:
+        if start == end or data[start] == 0x23:  # empty line or '#' comment
+            return
+        space = data.find(b" ", start, end)
+        if space == -1:
+            return
+        brace = data.find(b"{", start, space)
+        name = data[start:brace if brace != -1 else space]
+        field = self._wanted.get(name)
+        if field is not None and self._sources.setdefault(field, name) != name:
+            field = None   # another name of a field already taken from its first name
+        if field is None:
+            if self._current is not None and not self._missing:
+                self.done = True
+            self._current = None
+            return
+        if brace != -1:
+            # Label values may contain spaces: the value starts after the closing brace
+            close = data.rfind(b"}", brace, end)
+            if close == -1:
+                return
+            value_start = close + 1
+        else:
+            value_start = space
+        parts = data[value_start:end].split()
+        if not parts:
+            return
+        try:
+            value = float(parts[0])
+        except ValueError:
+            return
+        self._values[field] = self._values.get(field, 0.0) + value
+        self._missing.discard(field)
+        self._current = field
+
+    def snapshot(self) -> MetricsSnapshot:
+        return MetricsSnapshot(**self._values)
+
+
+def parse_metrics(payload: bytes, wanted: Dict[str, str], optional: Collection[str] = ()) -> MetricsSnapshot:
+    """Parses a complete exposition body."""
+    scanner = MetricsScanner(wanted, optional)
+    scanner.feed(payload)
+    scanner.close()
+    return scanner.snapshot()
+
+
+def parse_metrics_chunks(chunks: Iterable[bytes], wanted: Dict[str, str],
+                         optional: Collection[str] = ()) -> MetricsSnapshot:
+    """Parses an exposition body delivered in chunks, stopping at the first chunk that completes it."""
+    scanner = MetricsScanner(wanted, optional)
+    for chunk in chunks:
+        scanner.feed(chunk)
+        if scanner.done:
+            break
+    scanner.close()
+    return scanner.snapshot()
+
+
+async def scrape_metrics(client: httpx.AsyncClient, url: str, wanted: Dict[str, str],
+                         timeout: float = 5.0, optional: Collection[str] = ()) -> MetricsSnapshot:
+    """
+    Streams `url` and extracts only the `wanted` metrics (see `MetricsScanner` for `optional`).
+    Parsing stops early, but the rest of the body is still read so the connection can be reused.
+    Raises httpx.HTTPStatusError for non-2xx responses.
+    """
+    scanner = MetricsScanner(wanted, optional)
+    async with client.stream("GET", url, timeout=timeout) as r:
+        r.raise_for_status()
+        async for chunk in r.aiter_bytes():
+            if scanner.done:
+                continue  # drain without parsing so the connection can be reused
+            scanner.feed(chunk)
+    scanner.close()
+    return scanner.snapshot()
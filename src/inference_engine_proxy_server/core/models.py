@@ -0,0 +1,79 @@
+"""
+多模型路由:
+每個後端的 `/v1/models` 全部項目（不只 `data[0]`）都會記錄在 static 快取中，並彙整成
+「模型 id → 後端」索引 `_MODEL_INDEX`。請求會依 body 中的 `model` 欄位只在該模型的後端池內挑選，
+`/v1/models` 則直接由快取合併回應，不需對後端逐一發送請求。
+"""
+
+import json
+import re
+from typing import Any, Dict, List, Optional
+
+from .constants import BACKENDS, _MODEL_INDEX
+from .backend_state import get_static
+
+# A JSON string (with escapes) or a bracket; everything else between them is skipped by the regex engine
+_TOKEN = re.compile(rb'"(?:[^"\\]|\\.)*"|[{}\[\]]')
+_STRING = re.compile(rb'"(?:[^"\\]|\\.)*"')
+_KEY_SEPARATOR = re.compile(rb'\s*:\s*')
+
+
+def extract_model(body: bytes) -> Optional[str]:
+    """
+    Returns the top-level "model" string of a JSON object body without decoding the whole document.
+    Strings are consumed as single tokens, so "model" keys inside message contents or nested
+    objects (e.g. tool schemas) are ignored. Returns None if there is no such field.
+    """
+    depth = 0
+    for match in _TOKEN.finditer(body):
+        token = match.group()
+        if token[0] != 0x22:  # bracket
+            depth += 1 if token in (b"{", b"[") else -1
+            continue
+        if depth != 1 or token != b'"model"':
+            continue
+        separator = _KEY_SEPARATOR.match(body, match.end())
+        if separator is None:
+            continue  # a value that happens to be "model", not the key
+        value = _STRING.match(body, separator.end())
+        if value is None:
+            return None  # not a string
+        try:
+            return json.loads(value.group())
+        except ValueError:
+            return None
+    return None
+
+
+def rebuild_model_index() -> None:
+    """Rebuilds `_MODEL_INDEX` from the static info of all backends, keeping `BACKENDS` order."""
+    index: Dict[str, List[str]] = {}
+    for backend_url in BACKENDS:
+        for entry in get_static(backend_url).get("models", []):
+            pool = index.setdefault(entry["id"], [])
+            if backend_url not in pool:
+                pool.append(backend_url)
+    _MODEL_INDEX.clear()
+    _MODEL_INDEX.update(index)
+
+
+def get_model_pool(model: str) -> List[str]:
+    """Backends serving `model` (ready or not); empty if none is known."""
+    return _MODEL_INDEX.get(model, [])
+
+
+def has_multiple_pools() -> bool:
+    """Whether routing by model matters, i.e. not every model is served by the same backends."""
+    return len({tuple(pool) for pool in _MODEL_INDEX.values()}) > 1
+
+
+def list_models() -> List[Dict[str, Any]]:
+    """Merged `/v1/models` entries of all backends, one per model id."""
+    seen = set()
+    merged = []
+    for backend_url in BACKENDS:
+        for entry in get_static(backend_url).get("models", []):
+            if entry["id"] not in seen:
+                seen.add(entry["id"])
+                merged.append(entry)
+    return merged
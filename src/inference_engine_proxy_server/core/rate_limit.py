@@ -0,0 +1,287 @@
+"""
+Per-tenant 限流 (`RATE_LIMIT_ENABLED`):
+單一呼叫端不應能把所有後端都塞滿到 `MAX_ALLOWED_REQUEST_QUEUE`，讓其他人只能排隊。每個呼叫端
+（`RATE_LIMIT_KEY_HEADER` 標頭的值，沒有時為 `Authorization: Bearer` 的 API key，兩者皆無的請求共用一個匿名額度）
+在記憶體中各有三項限制，在讀取 body、挑選後端之前檢查，超過時回傳 429 與 `Retry-After`：
+
+- 同時進行的請求數 (`RATE_LIMIT_MAX_CONCURRENT`)：串流回應在串流結束時才釋放。
+- 每秒請求數 (`RATE_LIMIT_REQUESTS_PER_SECOND`)：token bucket，最多累積 `RATE_LIMIT_BURST` 個。
+- 每分鐘 token 數 (`RATE_LIMIT_TOKENS_PER_MINUTE`)：token bucket，最多累積一分鐘的額度。實際用量要等回應完成才知道，
+  因此先放行、完成後扣除。只計算生成的 token：非串流回應依 `usage.completion_tokens`，SSE 串流依最後一個帶有 `usage`
+  的事件（例如 vLLM 的 `stream_options.include_usage`），沒有時以 `data:` 事件數估計，兩者扣除的量一致。
+  額度扣成負數的呼叫端要等補回後才能再送出請求。
+
+由回應快取回答 (hit / coalesced) 的請求不佔用後端，回應後立即釋放，也不扣 token。
+
+每個呼叫端一筆 `__slots__` 紀錄，放在依最近使用排序的 OrderedDict，查找、更新與淘汰都是 O(1)：
+每個請求順便檢查最久未使用的幾筆，閒置超過 `RATE_LIMIT_IDLE_SECONDS` 的就丟棄，數萬個 key 也不需要另外的清理工作；
+超過 `RATE_LIMIT_MAX_KEYS` 時丟棄最久未使用者（其額度重新開始）。
+多 worker 模式下每個 worker 各自計算，各項限制依 `PROXY_WORKERS` 平均分配。
+"""
+
+import logging
+import math
+import re
+import time
+from collections import OrderedDict
+from typing import AsyncIterable, Dict, Optional
+
+from fastapi import Response
+from fastapi.responses import StreamingResponse
+
+from .constants import (
+    PROXY_WORKERS,
+    RATE_LIMIT_BURST,
+    RATE_LIMIT_IDLE_SECONDS,
+    RATE_LIMIT_KEY_HEADER,
+    RATE_LIMIT_KEY_MULTIPLIERS,
+    RATE_LIMIT_MAX_CONCURRENT,
+    RATE_LIMIT_MAX_KEYS,
+    RATE_LIMIT_REQUESTS_PER_SECOND,
+    RATE_LIMIT_TOKENS_PER_MINUTE,
+)
+from .response_cache import CACHE_HEADER
+from . import telemetry
+
+logger = logging.getLogger("rate-limit")
+
+# Least recently seen callers looked at for eviction on each request
+EVICTION_BATCH = 2
+
+_USAGE = re.compile(rb'"usage"\s*:\s*\{')
+_USAGE_FIELD = re.compile(rb'"(prompt_tokens|completion_tokens|total_tokens)"\s*:\s*(\d+)')
+# How far after `"usage": {` its token counts are looked for
+_USAGE_SPAN = 512
+
+
+def completion_tokens(data: bytes) -> Optional[int]:
+    """
+    Generated tokens of the last `usage` object in `data` (a response body or SSE chunk), or None if
+    there is none. Prompt tokens are not counted, as they are not for streams without `usage`.
+    """
+    start = data.rfind(b'"usage"')
+    if start < 0 or not _USAGE.match(data, start):
+        return None
+    fields = {name: int(value) for name, value in _USAGE_FIELD.findall(data, start, start + _USAGE_SPAN)}
+    if b"completion_tokens" in fields:
+        return fields[b"completion_tokens"]
+    if b"total_tokens" in fields:
+        return fields[b"total_tokens"] - fields.get(b"prompt_tokens", 0)
+    return None
+
+
+def get_tenant_key(headers) -> str:
+    """The caller a request is counted against: the `RATE_LIMIT_KEY_HEADER` value, else its API key."""
+    if RATE_LIMIT_KEY_HEADER:
+        value = headers.get(RATE_LIMIT_KEY_HEADER)
+        if value:
+            return value
+    auth = headers.get("authorization", "")
+    if auth.lower().startswith("bearer "):
+        return auth[7:].strip()
+    return ""
+
+
+class RateLimitExceeded(Exception):
+    """Raised by `RateLimiter.acquire` for a caller over one of its limits."""
+
+    def __init__(self, limit: str, message: str, retry_after: float) -> None:
+        super().__init__(message)
+        self.limit = limit   # concurrency, requests or tokens
+        self.retry_after = retry_after
+
+
+class _Tenant:
+    """Buckets and concurrent requests of one caller."""
+
+    __slots__ = ("key", "scale", "active", "requests", "tokens", "updated", "seen")
+
+    def __init__(self, key: str, scale: float, requests: float, tokens: float, now: float) -> None:
+        self.key = key
+        # Factor of every limit: RATE_LIMIT_KEY_MULTIPLIERS, split between the workers
+        self.scale = scale
+        self.active = 0
+        self.requests = requests
+        # Per-minute token budget; negative while the caller owes tokens
+        self.tokens = tokens
+        self.updated = now   # last refill
+        self.seen = now      # last request or response, for eviction
+
+
+class RateLimiter:
+    """Per-caller concurrency limit and request / token buckets, kept in least recently seen order."""
+
+    def __init__(self, max_concurrent: int = RATE_LIMIT_MAX_CONCURRENT,
+                 requests_per_second: float = RATE_LIMIT_REQUESTS_PER_SECOND,
+                 burst: float = RATE_LIMIT_BURST,
+                 tokens_per_minute: float = RATE_LIMIT_TOKENS_PER_MINUTE,
+                 idle_seconds: float = RATE_LIMIT_IDLE_SECONDS,
+                 max_keys: int = RATE_LIMIT_MAX_KEYS,
+                 multipliers: Optional[Dict[str, float]] = None,
+                 workers: int = PROXY_WORKERS) -> None:
+        self.max_concurrent = max_concurrent
+        self.requests_per_second = requests_per_second
+        self.burst = burst if burst > 0 else max(1.0, requests_per_second)
+        self.tokens_per_minute = tokens_per_minute
+        self.idle_seconds = idle_seconds
+        self.max_keys = max_keys
+        self.multipliers = RATE_LIMIT_KEY_MULTIPLIERS if multipliers is None else multipliers
+        self.workers = workers
+        self._tenants: "OrderedDict[str, _Tenant]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._tenants)
+
+    @property
+    def counts_tokens(self) -> bool:
+        return self.tokens_per_minute > 0
+
+    def _refill(self, tenant: _Tenant, now: float) -> None:
+        elapsed = now - tenant.updated
+        if elapsed <= 0:
+            return
+        tenant.updated = now
+        if self.requests_per_second > 0:
+            tenant.requests = min(self.burst * tenant.scale,
+                                  tenant.requests + elapsed * self.requests_per_second * tenant.scale)
+        if self.tokens_per_minute > 0:
+            tenant.tokens = min(self.tokens_per_minute * tenant.scale,
+                                tenant.tokens + elapsed * self.tokens_per_minute * tenant.scale / 60)
+
+    def _evict(self, now: float) -> None:
+        for _ in range(EVICTION_BATCH):
+            key, oldest = next(iter(self._tenants.items()))
+            if len(self._tenants) <= self.max_keys and now - oldest.seen < self.idle_seconds:
+                return
+            self._refill(oldest, now)
+            if oldest.active > 0 or oldest.tokens < 0:
+                # Still holding a slot or owing tokens: forgetting it would lift its limits
+                self._tenants.move_to_end(key)
+                continue
+            del self._tenants[key]
+            telemetry.RATE_LIMIT_TENANTS.dec()
+
+    def _reject(self, limit: str, message: str, retry_after: float) -> RateLimitExceeded:
+        telemetry.RATE_LIMITED_REQUESTS.labels(limit).inc()
+        return RateLimitExceeded(limit, message, retry_after)
+
+    def acquire(self, key: str) -> _Tenant:
+        """
+        Counts a new request of caller `key` and returns its record, to pass to `release` or `meter`.
+        Raises `RateLimitExceeded` (without counting anything) if the caller is over a limit.
+        """
+        now = time.monotonic()
+        tenant = self._tenants.get(key)
+        if tenant is None:
+            scale = self.multipliers.get(key, 1.0) / self.workers
+            tenant = self._tenants[key] = _Tenant(key, scale, self.burst * scale, self.tokens_per_minute * scale, now)
+            telemetry.RATE_LIMIT_TENANTS.inc()
+        else:
+            self._tenants.move_to_end(key)
+            self._refill(tenant, now)
+        tenant.seen = now
+        self._evict(now)
+
+        scale = tenant.scale
+        if self.max_concurrent > 0:
+            limit = math.ceil(self.max_concurrent * scale)
+            if tenant.active >= limit:
+                raise self._reject("concurrency", f"Rate limit reached: at most {limit} concurrent requests.", 1.0)
+        if self.requests_per_second > 0 and tenant.requests < 1:
+            rate = self.requests_per_second * scale
+            raise self._reject("requests", f"Rate limit reached: {rate:g} requests per second.",
+                               (1 - tenant.requests) / rate)
+        if self.tokens_per_minute > 0 and tenant.tokens <= 0:
+            rate = self.tokens_per_minute * scale
+            raise self._reject("tokens", f"Rate limit reached: {rate:g} tokens per minute.",
+                               -tenant.tokens / (rate / 60))
+        tenant.active += 1
+        if self.requests_per_second > 0:
+            tenant.requests -= 1
+        return tenant
+
+    def release(self, tenant: _Tenant, tokens: int = 0) -> None:
+        """Ends a request of `tenant` that used `tokens` tokens."""
+        now = time.monotonic()
+        tenant.active = max(0, tenant.active - 1)
+        tenant.seen = now
+        if tenant.key in self._tenants:
+            self._tenants.move_to_end(tenant.key)
+        if tokens > 0 and self.tokens_per_minute > 0:
+            self._refill(tenant, now)
+            tenant.tokens -= tokens
+            telemetry.RATE_LIMIT_TOKENS.inc(tokens)
+
+    def meter(self, tenant: _Tenant, response: Response) -> Response:
+        """Releases `tenant` once `response` is finished, charging the tokens it used."""
+        if response.headers.get(CACHE_HEADER) in ("hit", "coalesced"):
+            self.release(tenant)
+        elif isinstance(response, StreamingResponse):
+            response.body_iterator = _MeteredStream(self, tenant, response.body_iterator)
+        else:
+            tokens = completion_tokens(response.body) if self.counts_tokens else None
+            self.release(tenant, tokens or 0)
+        return response
+
+
+class _MeteredStream:
+    """
+    Body iterator of a streamed response that counts its tokens and releases the caller once
+    the stream ends, fails or is closed (also when it is closed before it started).
+    """
+
+    __slots__ = ("limiter", "tenant", "chunks", "count", "events", "usage", "closed")
+
+    def __init__(self, limiter: RateLimiter, tenant: _Tenant, chunks: AsyncIterable[bytes]) -> None:
+        self.limiter = limiter
+        self.tenant = tenant
+        self.chunks = chunks.__aiter__()
+        self.count = limiter.counts_tokens
+        self.events = 0
+        self.usage: Optional[int] = None
+        self.closed = False
+
+    def __aiter__(self) -> "_MeteredStream":
+        return self
+
+    async def __anext__(self) -> bytes:
+        try:
+            chunk = await self.chunks.__anext__()
+        except BaseException:
+            self._finish()
+            raise
+        if self.count:
+            # Engines send about one token per event; a final `usage` replaces the estimate
+            self.events += chunk.count(b"data:") - chunk.count(b"data: [DONE]")
+            if b'"usage"' in chunk:
+                usage = completion_tokens(chunk)
+                if usage is not None:
+                    self.usage = usage
+        return chunk
+
+    async def aclose(self) -> None:
+        self._finish()
+        aclose = getattr(self.chunks, "aclose", None)
+        if aclose is not None:
+            await aclose()
+
+    def _finish(self) -> None:
+        if not self.closed:
+            self.closed = True
+            self.limiter.release(self.tenant, self.usage if self.usage is not None else self.events)
+
+
+_limiter: Optional[RateLimiter] = None
+
+
+def get_rate_limiter() -> RateLimiter:
+    global _limiter
+    if _limiter is None:
+        _limiter = RateLimiter()
+        logger.info(
+            "Rate limits per caller: %s concurrent, %s requests/s (burst %g), %s tokens/min%s",
+            RATE_LIMIT_MAX_CONCURRENT or "unlimited", RATE_LIMIT_REQUESTS_PER_SECOND or "unlimited",
+            _limiter.burst, RATE_LIMIT_TOKENS_PER_MINUTE or "unlimited",
+            f", split between {PROXY_WORKERS} workers" if PROXY_WORKERS > 1 else "",
+        )
+    return _limiter
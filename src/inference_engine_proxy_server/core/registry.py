@@ -0,0 +1,266 @@
+"""
+動態後端清單:
+`BACKENDS` 可在執行期間透過 admin API (`/admin/backends`) 或 `BACKENDS_FILE` 新增、移除、調整權重與設為 drain，
+不需重新啟動代理，進行中的串流也不會中斷。
+
+- 新增的後端由 `refresh_loop` 立即開始輪詢，取得狀態後即參與路由。
+- drain 中的後端仍會被輪詢，但不再收到新的請求，進行中的請求照常完成。
+- 移除的後端立即停止接收新請求；等到它的 in-flight 請求結束（最多 `BACKEND_REMOVE_GRACE_SECONDS` 秒）後，
+  才關閉它的連線池並清除快取、計數器與指標。
+
+`BACKENDS_FILE` 為 JSON，例如 `{"backends": [{"url": "http://llm-1:8080", "weight": 2}, {"url": "http://llm-2:8080", "drain": true}]}`
+（也可以直接是 url 字串的陣列）。檔案每次變更都會成為完整的後端清單，覆蓋之前經由 admin API 做的變更。
+"""
+
+import asyncio
+import json
+import logging
+import os
+from typing import Any, Dict, List, NamedTuple, Optional
+
+from .constants import (
+    BACKENDS,
+    BACKEND_REMOVE_GRACE_SECONDS,
+    BACKEND_WEIGHTS,
+    BACKENDS_FILE_POLL_SECONDS,
+    _DRAINING_BACKENDS,
+    _INFLIGHT_REQUESTS,
+    _INFLIGHT_TOKENS,
+)
+from .admission import notify_capacity
+from .affinity import reset_rings
+from .backend_state import ensure_state, get_state, refresh, remove_state
+from .inflight import get_inflight
+from .models import rebuild_model_index
+from .shared_state import get_shared_state
+from .strategies import get_strategy
+from . import circuit_breaker, telemetry
+
+logger = logging.getLogger("backend-registry")
+
+RECLAIM_CHECK_SECONDS = 0.5
+
+# Weights from BACKEND_WEIGHTS, restored when a weight set at runtime is dropped again
+_CONFIGURED_WEIGHTS: Dict[str, float] = dict(BACKEND_WEIGHTS)
+# {backend_url: task waiting for a removed backend's requests to finish before reclaiming its state}
+_removing: Dict[str, asyncio.Task] = {}
+_changed = asyncio.Event()
+
+
+class BackendSpec(NamedTuple):
+    url: str
+    weight: Optional[float] = None
+    draining: bool = False
+
+
+def normalize_url(url: Any) -> str:
+    if not isinstance(url, str) or not url.strip().startswith(("http://", "https://")):
+        raise ValueError(f"backend url must start with http:// or https://: {url!r}")
+    return url.strip()
+
+
+def _check_weight(weight: Any) -> Optional[float]:
+    if weight is None:
+        return None
+    if isinstance(weight, bool) or not isinstance(weight, (int, float)) or weight <= 0:
+        raise ValueError(f"weight must be a positive number: {weight!r}")
+    return float(weight)
+
+
+def parse_backends(data: Any) -> List[BackendSpec]:
+    """Backend list from the JSON of `BACKENDS_FILE`; raises ValueError if it is malformed."""
+    if isinstance(data, dict):
+        data = data.get("backends")
+    if not isinstance(data, list):
+        raise ValueError('expected a list of backends or {"backends": [...]}')
+    specs: Dict[str, BackendSpec] = {}
+    for item in data:
+        if isinstance(item, str):
+            item = {"url": item}
+        if not isinstance(item, dict):
+            raise ValueError(f"invalid backend entry: {item!r}")
+        url = normalize_url(item.get("url"))
+        specs[url] = BackendSpec(url, _check_weight(item.get("weight")), bool(item.get("drain", False)))
+    return list(specs.values())
+
+
+# -------------------- changes --------------------
+
+def _changed_backends() -> None:
+    """Updates everything derived from `BACKENDS` and wakes `refresh_loop` to start or stop pollers."""
+    rebuild_model_index()
+    reset_rings()
+    _changed.set()
+    notify_capacity()
+
+
+async def wait_for_change(timeout: float) -> None:
+    """Sleeps for `timeout` seconds or until the backend list changes."""
+    try:
+        await asyncio.wait_for(_changed.wait(), timeout)
+    except asyncio.TimeoutError:
+        pass
+    _changed.clear()
+
+
+def is_draining(backend_url: str) -> bool:
+    return backend_url in _DRAINING_BACKENDS
+
+
+def set_backend(backend_url: str, weight: Optional[float] = None, draining: Optional[bool] = None) -> bool:
+    """
+    Adds `backend_url`, or updates it if it is already configured. `weight` None keeps the current
+    weight; `draining` None keeps the current drain state. Returns True if the backend is new.
+    """
+    backend_url = normalize_url(backend_url)
+    weight = _check_weight(weight)
+    added = backend_url not in BACKENDS
+    if added:
+        task = _removing.pop(backend_url, None)
+        if task is not None:
+            task.cancel()   # re-added before its old state was reclaimed: keep using it
+        BACKENDS.append(backend_url)
+        ensure_state(backend_url).active = True
+        shared = get_shared_state()
+        if shared is not None:
+            shared.register(backend_url)
+        logger.info("Backend %s added", backend_url)
+    if weight is not None and BACKEND_WEIGHTS.get(backend_url) != weight:
+        BACKEND_WEIGHTS[backend_url] = weight
+        logger.info("Backend %s weight set to %g", backend_url, weight)
+    if draining is not None and draining != is_draining(backend_url):
+        if draining:
+            _DRAINING_BACKENDS.add(backend_url)
+        else:
+            _DRAINING_BACKENDS.discard(backend_url)
+        logger.info("Backend %s %s", backend_url, "draining" if draining else "no longer draining")
+    refresh(backend_url)
+    _changed_backends()
+    return added
+
+
+def reset_weight(backend_url: str) -> None:
+    """Goes back to the weight from BACKEND_WEIGHTS (or the default of 1)."""
+    if backend_url in _CONFIGURED_WEIGHTS:
+        BACKEND_WEIGHTS[backend_url] = _CONFIGURED_WEIGHTS[backend_url]
+    else:
+        BACKEND_WEIGHTS.pop(backend_url, None)
+    refresh(backend_url)
+
+
+def remove_backend(backend_url: str) -> bool:
+    """
+    Stops routing to `backend_url` right away; its in-flight requests finish on its connection pool,
+    which is closed and its state reclaimed afterwards. Returns False if it was not configured.
+    """
+    if backend_url not in BACKENDS:
+        return False
+    BACKENDS.remove(backend_url)
+    _DRAINING_BACKENDS.discard(backend_url)
+    state = get_state(backend_url)
+    if state is not None:
+        state.active = False
+        refresh(backend_url)
+    _removing[backend_url] = asyncio.get_running_loop().create_task(_reclaim(backend_url))
+    logger.info("Backend %s removed; %d requests still in flight", backend_url, get_inflight(backend_url))
+    _changed_backends()
+    return True
+
+
+async def _reclaim(backend_url: str) -> None:
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + BACKEND_REMOVE_GRACE_SECONDS
+    while get_inflight(backend_url) > 0 and loop.time() < deadline:
+        await asyncio.sleep(RECLAIM_CHECK_SECONDS)
+    if get_inflight(backend_url) > 0:
+        logger.warning("Closing the pool of removed backend %s with %d requests still in flight",
+                       backend_url, get_inflight(backend_url))
+
+    from .http_client import close_backend_client
+    from . import hedging, stream_stats
+
+    remove_state(backend_url)
+    _INFLIGHT_REQUESTS.pop(backend_url, None)
+    _INFLIGHT_TOKENS.pop(backend_url, None)
+    reset_weight(backend_url)
+    get_strategy().forget(backend_url)
+    telemetry.forget_backend(backend_url)
+    circuit_breaker.forget(backend_url)
+    hedging.forget(backend_url)
+    stream_stats.forget(backend_url)
+    shared = get_shared_state()
+    if shared is not None:
+        shared.release(backend_url)
+    if _removing.get(backend_url) is asyncio.current_task():
+        del _removing[backend_url]
+    await close_backend_client(backend_url)
+    logger.info("Reclaimed the state of removed backend %s", backend_url)
+
+
+def apply(specs: List[BackendSpec]) -> None:
+    """Makes `specs` the complete backend list (BACKENDS_FILE semantics)."""
+    wanted = {spec.url for spec in specs}
+    for backend_url in list(BACKENDS):
+        if backend_url not in wanted:
+            remove_backend(backend_url)
+    for spec in specs:
+        if spec.weight is None:
+            reset_weight(spec.url)
+        set_backend(spec.url, spec.weight, spec.draining)
+
+
+def list_backends() -> List[Dict[str, Any]]:
+    """Configured backends, then the removed ones whose requests are still finishing."""
+    backends = [
+        {
+            "url": backend_url,
+            "weight": BACKEND_WEIGHTS.get(backend_url, 1.0),
+            "state": "draining" if is_draining(backend_url) else "active",
+            "ready": getattr(get_state(backend_url), "ready", False),
+            "inflight": get_inflight(backend_url),
+        }
+        for backend_url in BACKENDS
+    ]
+    backends.extend(
+        {"url": backend_url, "weight": BACKEND_WEIGHTS.get(backend_url, 1.0), "state": "removing",
+         "ready": False, "inflight": get_inflight(backend_url)}
+        for backend_url in _removing
+    )
+    return backends
+
+
+# -------------------- BACKENDS_FILE --------------------
+
+def load_file(path: str) -> bool:
+    """Applies the backend list in `path`. Returns False (keeping the current list) if it is missing or invalid."""
+    try:
+        with open(path, encoding="utf-8") as f:
+            specs = parse_backends(json.load(f))
+    except FileNotFoundError:
+        logger.warning("BACKENDS_FILE %s does not exist; keeping the current backends", path)
+        return False
+    except (OSError, ValueError) as e:
+        logger.error("Invalid BACKENDS_FILE %s: %s; keeping the current backends", path, e)
+        return False
+    apply(specs)
+    return True
+
+
+def _file_version(path: str) -> Optional[tuple]:
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size, stat.st_ino
+
+
+async def watch_file(path: str) -> None:
+    """Re-applies `path` whenever it changes (checked every `BACKENDS_FILE_POLL_SECONDS`)."""
+    version = _file_version(path)
+    while True:
+        await asyncio.sleep(BACKENDS_FILE_POLL_SECONDS)
+        current = _file_version(path)
+        if current is not None and current != version:
+            logger.info("BACKENDS_FILE %s changed", path)
+            load_file(path)
+        version = current
@@ -0,0 +1,114 @@
+"""
+請求 body 的緩衝策略:
+不需要檢查內容的請求直接以 `request.stream()` 串流到後端，不在代理中緩衝；
+需要檢查（多模型路由、前綴親和性）或可重送的小型 body 才會緩衝，超過
+`REQUEST_BODY_MAX_MEMORY_BYTES` 的部分寫入暫存檔，讓併發的大型 prompt / base64 圖片不會撐大代理的記憶體。
+"""
+
+import mmap
+import tempfile
+from typing import AsyncIterator, Optional, Union
+
+from fastapi import Request
+from starlette.concurrency import run_in_threadpool
+
+from .constants import REQUEST_BODY_MAX_MEMORY_BYTES
+
+FILE_CHUNK_SIZE = 64 * 1024
+
+
+class RequestBody:
+    """A request body buffered in memory or, beyond `max_memory` bytes, in a temporary file."""
+
+    def __init__(self, data: bytes = b"") -> None:
+        self.size = len(data)
+        self._data: Optional[bytes] = data
+        self._file = None
+        self._map: Optional[mmap.mmap] = None
+
+    @classmethod
+    async def read(cls, request: Request, max_memory: int = REQUEST_BODY_MAX_MEMORY_BYTES) -> "RequestBody":
+        body = cls()
+        parts = []
+        async for chunk in request.stream():
+            if not chunk:
+                continue
+            body.size += len(chunk)
+            if body._file is None and body.size <= max_memory:
+                parts.append(chunk)
+                continue
+            if body._file is None:
+                # Spill what we have so far and keep writing to disk
+                body._file = tempfile.TemporaryFile()
+                parts.append(chunk)
+                await run_in_threadpool(body._file.writelines, parts)
+                parts = []
+                body._data = None
+            else:
+                await run_in_threadpool(body._file.write, chunk)
+        if body._file is None:
+            body._data = b"".join(parts)
+        return body
+
+    @property
+    def in_memory(self) -> bool:
+        return self._data is not None
+
+    @property
+    def data(self) -> Optional[bytes]:
+        """The body bytes, or None if the body was spilled to disk."""
+        return self._data
+
+    def view(self) -> Union[bytes, mmap.mmap]:
+        """The whole body as a bytes-like object; spilled bodies are memory-mapped instead of read."""
+        if self._data is not None:
+            return self._data
+        if self._map is None:
+            self._file.flush()
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        return self._map
+
+    def content(self) -> Union[bytes, AsyncIterator[bytes]]:
+        """Upstream request content; may be called again to replay the body on another backend."""
+        if self._data is not None:
+            return self._data
+        return self._iter_file()
+
+    async def _iter_file(self) -> AsyncIterator[bytes]:
+        offset = 0
+        while offset < self.size:
+            chunk = await run_in_threadpool(self._read_at, offset)
+            if not chunk:
+                break
+            offset += len(chunk)
+            yield chunk
+
+    def _read_at(self, offset: int) -> bytes:
+        self._file.seek(offset)
+        return self._file.read(FILE_CHUNK_SIZE)
+
+    def close(self) -> None:
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+def has_body(request: Request) -> bool:
+    """Whether the request carries a body at all (by Content-Length / Transfer-Encoding)."""
+    if "transfer-encoding" in request.headers:
+        return True
+    if "content-length" not in request.headers:
+        # HTTP/2 clients may omit both headers
+        return request.method in ("POST", "PUT", "PATCH")
+    return request.headers["content-length"].strip() not in ("", "0")
+
+
+def is_small_body(request: Request) -> bool:
+    """Whether the declared Content-Length fits in `REQUEST_BODY_MAX_MEMORY_BYTES`."""
+    try:
+        return int(request.headers["content-length"]) <= REQUEST_BODY_MAX_MEMORY_BYTES
+    except (KeyError, ValueError):
+        return False
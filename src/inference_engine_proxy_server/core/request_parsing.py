@@ -0,0 +1,19 @@
+"""
+Helpers for inspecting the body of a proxied request.
+The proxy normally forwards bodies untouched; these are only used by routing
+features that need to look inside (e.g. prefix affinity).
+"""
+
+import json
+from typing import Any, Dict, Optional
+
+
+def load_json_body(body: bytes) -> Optional[Dict[str, Any]]:
+    """Parses a JSON object body, returning None for empty, invalid or non-object bodies."""
+    if not body:
+        return None
+    try:
+        data = json.loads(body)
+    except (ValueError, UnicodeDecodeError):
+        return None
+    return data if isinstance(data, dict) else None
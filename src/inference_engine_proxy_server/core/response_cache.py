@@ -0,0 +1,399 @@
+"""
+Exact-match 回應快取 (`RESPONSE_CACHE_ENABLED`):
+結果可重現的請求（embeddings、`temperature` 為 0 或指定 `seed`）以「路徑 + 模型 + 正規化後的 JSON body」的雜湊為 key，
+後端的 200 回應保留在記憶體中（LRU，依總位元組上限與 TTL 淘汰），之後相同的請求直接由代理回應，不再佔用 GPU。
+SSE 串流會完整保存並可重播；同時到達的相同請求只會送一次到後端 (single-flight)，其他請求即時跟隨同一個回應。
+多 worker 模式下每個 worker 各有一份快取。
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, AsyncIterable, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+from fastapi import Request, Response
+from fastapi.responses import StreamingResponse
+
+from .constants import (
+    BACKEND_TIMEOUT_SECONDS,
+    RESPONSE_CACHE_MAX_BYTES,
+    RESPONSE_CACHE_MAX_ENTRY_BYTES,
+    RESPONSE_CACHE_PATHS,
+    RESPONSE_CACHE_TTL_SECONDS,
+)
+from .request_body import RequestBody
+from .request_parsing import load_json_body
+from .streaming import ProxyStreamingResponse
+from . import telemetry
+
+logger = logging.getLogger("response-cache")
+
+# Response header telling clients how the proxy answered: hit, miss or coalesced
+CACHE_HEADER = "x-proxy-cache"
+SSE_DONE = b"data: [DONE]"
+
+
+def is_cacheable_path(path: str) -> bool:
+    return path.strip("/") in RESPONSE_CACHE_PATHS
+
+
+def is_deterministic(path: str, data: Dict[str, Any]) -> bool:
+    """Whether the same request body always yields the same response."""
+    if path.endswith("embeddings"):
+        return True
+    temperature = data.get("temperature")
+    if isinstance(temperature, (int, float)) and not isinstance(temperature, bool) and temperature == 0:
+        return True
+    return data.get("seed") is not None
+
+
+def request_key(path: str, request: Request, body: RequestBody, model: Optional[str]) -> Optional[str]:
+    """Cache key of a request, or None if it is not safe to cache."""
+    path = path.strip("/")
+    if request.method != "POST" or path not in RESPONSE_CACHE_PATHS or not body.in_memory:
+        return None
+    data = load_json_body(body.data)
+    if data is None or not is_deterministic(path, data):
+        return None
+    canonical = json.dumps(data, sort_keys=True, separators=(",", ":"))
+    digest = hashlib.sha256()
+    # The credentials are part of the key, so a cached answer never bypasses the backend's auth
+    for part in (path, request.url.query, model or "", request.headers.get("authorization", ""), canonical):
+        digest.update(part.encode())
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+async def _replay(body: bytes) -> AsyncIterator[bytes]:
+    yield body
+
+
+class _Entry:
+    __slots__ = ("status_code", "headers", "body", "streaming", "expires")
+
+    def __init__(self, status_code: int, headers: Dict[str, str], body: bytes, streaming: bool, expires: float) -> None:
+        self.status_code = status_code
+        self.headers = headers
+        self.body = body
+        self.streaming = streaming
+        self.expires = expires
+
+    def response(self, result: str) -> Response:
+        headers = {**self.headers, CACHE_HEADER: result}
+        if self.streaming:
+            # A stored SSE stream is replayed as one write
+            return StreamingResponse(_replay(self.body), status_code=self.status_code, headers=headers)
+        return Response(self.body, status_code=self.status_code, headers=headers)
+
+
+class _Flight:
+    """
+    One upstream request that identical concurrent requests follow. A streamed response
+    larger than `max_bytes` is no longer cacheable; from then on only the chunks some
+    follower has not read yet are kept, and no new follower can join.
+    """
+
+    def __init__(self, max_bytes: int, timeout: float) -> None:
+        self.max_bytes = max_bytes
+        self.timeout = timeout
+        self.head: Optional[Tuple[int, Dict[str, str], bool]] = None   # status, headers, streaming
+        self.chunks: List[bytes] = []
+        self.offset = 0   # number of chunks dropped from the front of `chunks`
+        self.size = 0
+        self.cacheable = True
+        self.readers: Set["_FlightReader"] = set()
+        self.done = False
+        self.ok = False
+        self._changed = asyncio.Event()
+
+    def _notify(self) -> None:
+        changed, self._changed = self._changed, asyncio.Event()
+        changed.set()
+
+    async def _wait(self) -> bool:
+        """Waits for the next update of the flight; False if none came within `timeout`."""
+        try:
+            await asyncio.wait_for(self._changed.wait(), self.timeout)
+        except asyncio.TimeoutError:
+            return False
+        return True
+
+    def start(self, status_code: int, headers: Dict[str, str], streaming: bool) -> None:
+        self.head = (status_code, headers, streaming)
+        self._notify()
+
+    def append(self, chunk: bytes) -> None:
+        self.chunks.append(chunk)
+        self.size += len(chunk)
+        if self.cacheable and self.size > self.max_bytes and self.head is not None and self.head[2]:
+            self.cacheable = False
+        if not self.cacheable:
+            self.trim()
+        self._notify()
+
+    def trim(self) -> None:
+        """Drops the chunks every follower has already read, once the stream is too large to cache."""
+        if self.cacheable:
+            return
+        low = min((reader.sent for reader in self.readers), default=self.offset + len(self.chunks))
+        if low > self.offset:
+            del self.chunks[:low - self.offset]
+            self.offset = low
+
+    def finish(self, ok: bool) -> None:
+        self.done = True
+        self.ok = ok
+        self._notify()
+
+    async def response(self) -> Optional[Response]:
+        """
+        The response for a follower, or None if the leader failed, went silent for `timeout`
+        or is past the point where its response can still be shared.
+        """
+        while self.head is None and not self.done:
+            if not await self._wait():
+                return None
+        if self.head is None:
+            return None
+        status_code, headers, streaming = self.head
+        headers = {**headers, CACHE_HEADER: "coalesced"}
+        if streaming:
+            if self.offset:
+                return None   # the start of the stream is gone
+            reader = _FlightReader(self)
+            self.readers.add(reader)
+            return ProxyStreamingResponse(reader, status_code=status_code, headers=headers)
+        while not self.done:
+            if not await self._wait():
+                return None
+        if not self.ok:
+            return None
+        return Response(b"".join(self.chunks), status_code=status_code, headers=headers)
+
+
+class _FlightReader:
+    """
+    Body iterator of a follower of a streamed flight. It stops following once the stream ends,
+    fails, stays silent for the flight's timeout or is closed (also before it started).
+    """
+
+    __slots__ = ("flight", "sent", "closed")
+
+    def __init__(self, flight: _Flight) -> None:
+        self.flight = flight
+        self.sent = 0
+        self.closed = False
+
+    def __aiter__(self) -> "_FlightReader":
+        return self
+
+    async def __anext__(self) -> bytes:
+        flight = self.flight
+        try:
+            while not self.closed and self.sent >= flight.offset + len(flight.chunks):
+                if flight.done:
+                    if not flight.ok:
+                        logger.warning("Coalesced stream ended early together with its leading request.")
+                    break
+                if not await flight._wait():
+                    logger.warning("Coalesced stream stopped: its leading request sent nothing for %ss.",
+                                   flight.timeout)
+                    break
+        except BaseException:
+            self._close()
+            raise
+        if self.closed or self.sent >= flight.offset + len(flight.chunks):
+            self._close()
+            raise StopAsyncIteration
+        chunk = flight.chunks[self.sent - flight.offset]
+        self.sent += 1
+        return chunk
+
+    async def aclose(self) -> None:
+        self._close()
+
+    def _close(self) -> None:
+        if not self.closed:
+            self.closed = True
+            self.flight.readers.discard(self)
+            self.flight.trim()
+
+
+class _Tee:
+    """
+    Body iterator of the leader's stream that shares it with followers and stores it once
+    complete. The flight ends when the stream ends, fails or is closed, also when it is
+    closed before it started.
+    """
+
+    __slots__ = ("cache", "key", "flight", "headers", "chunks", "ended")
+
+    def __init__(self, cache: "ResponseCache", key: str, flight: _Flight, headers: Dict[str, str],
+                 chunks: AsyncIterable[bytes]) -> None:
+        self.cache = cache
+        self.key = key
+        self.flight = flight
+        self.headers = headers
+        self.chunks = chunks.__aiter__()
+        self.ended = False
+
+    def __aiter__(self) -> "_Tee":
+        return self
+
+    async def __anext__(self) -> bytes:
+        try:
+            chunk = await self.chunks.__anext__()
+        except StopAsyncIteration:
+            self._end(ok=True)
+            raise
+        except BaseException:
+            self._end(ok=False)
+            raise
+        self.flight.append(chunk)
+        return chunk
+
+    async def aclose(self) -> None:
+        self._end(ok=False)
+        aclose = getattr(self.chunks, "aclose", None)
+        if aclose is not None:
+            await aclose()
+
+    def _end(self, ok: bool) -> None:
+        if self.ended:
+            return
+        self.ended = True
+        flight = self.flight
+        # A stream cut short upstream still ends normally, so only one that reached
+        # the final `data: [DONE]` event is stored
+        if ok and flight.cacheable and b"".join(flight.chunks[-2:]).rstrip().endswith(SSE_DONE):
+            self.cache.put(self.key, _Entry(200, self.headers, b"".join(flight.chunks), True,
+                                            time.monotonic() + self.cache.ttl_seconds))
+        self.cache._end(self.key, flight, ok)
+
+
+class ResponseCache:
+    """LRU of deterministic responses, bounded by total body bytes and a TTL, with single-flight misses."""
+
+    def __init__(self, max_bytes: int = RESPONSE_CACHE_MAX_BYTES,
+                 max_entry_bytes: int = RESPONSE_CACHE_MAX_ENTRY_BYTES,
+                 ttl_seconds: float = RESPONSE_CACHE_TTL_SECONDS,
+                 follow_timeout: float = BACKEND_TIMEOUT_SECONDS) -> None:
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_entry_bytes
+        self.ttl_seconds = ttl_seconds
+        # A follower waits no longer for the leader's next update than the leader waits for its backend
+        self.follow_timeout = follow_timeout
+        self.size = 0
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._flights: Dict[str, _Flight] = {}
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: str) -> Optional[_Entry]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry.expires <= time.monotonic():
+            self._remove(key)
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def put(self, key: str, entry: _Entry) -> None:
+        if len(entry.body) > self.max_entry_bytes:
+            return
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = entry
+        self.size += len(entry.body)
+        while self.size > self.max_bytes:
+            self._remove(next(iter(self._entries)))
+        self._update_gauges()
+
+    def _remove(self, key: str) -> None:
+        entry = self._entries.pop(key)
+        self.size -= len(entry.body)
+        self._update_gauges()
+
+    def _update_gauges(self) -> None:
+        telemetry.RESPONSE_CACHE_ENTRIES.set(len(self._entries))
+        telemetry.RESPONSE_CACHE_BYTES.set(self.size)
+
+    async def fetch(self, key: str, forward: Callable[[], Awaitable[Response]], cache_control: str = "") -> Response:
+        """
+        Answers a cacheable request from the cache, from an identical request already in flight,
+        or by calling `forward()` and storing its response. `Cache-Control: no-cache` skips the
+        lookup but still stores the response; `no-store` bypasses the cache entirely.
+        """
+        directives = cache_control.lower()
+        if "no-store" in directives:
+            telemetry.RESPONSE_CACHE_REQUESTS.labels("bypass").inc()
+            return await forward()
+        if "no-cache" not in directives:
+            entry = self.get(key)
+            if entry is not None:
+                telemetry.RESPONSE_CACHE_REQUESTS.labels("hit").inc()
+                return entry.response("hit")
+            flight = self._flights.get(key)
+            if flight is not None and flight.cacheable:
+                response = await flight.response()
+                if response is not None:
+                    telemetry.RESPONSE_CACHE_REQUESTS.labels("coalesced").inc()
+                    return response
+                # The leading request failed; send this one on its own rather than queueing behind another
+
+        telemetry.RESPONSE_CACHE_REQUESTS.labels("miss").inc()
+        flight = _Flight(self.max_entry_bytes, self.follow_timeout)
+        current = self._flights.get(key)
+        if current is None or not current.cacheable:
+            self._flights[key] = flight
+        try:
+            response = await forward()
+        except BaseException:
+            self._end(key, flight, ok=False)
+            raise
+        return self._record(key, flight, response)
+
+    def _end(self, key: str, flight: _Flight, ok: bool) -> None:
+        flight.finish(ok)
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+
+    def _record(self, key: str, flight: _Flight, response: Response) -> Response:
+        if response.status_code != 200:
+            self._end(key, flight, ok=False)
+            return response
+        headers = {k: v for k, v in response.headers.items() if k != "content-length"}
+        response.headers[CACHE_HEADER] = "miss"
+        if not isinstance(response, StreamingResponse):
+            flight.start(response.status_code, headers, streaming=False)
+            flight.append(response.body)
+            self.put(key, _Entry(response.status_code, headers, response.body, False,
+                                 time.monotonic() + self.ttl_seconds))
+            self._end(key, flight, ok=True)
+            return response
+        flight.start(response.status_code, headers, streaming=True)
+        response.body_iterator = _Tee(self, key, flight, headers, response.body_iterator)
+        return response
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "entries": len(self._entries),
+            "bytes": self.size,
+            "max_bytes": self.max_bytes,
+            "requests": telemetry.collect_samples(telemetry.RESPONSE_CACHE_REQUESTS),
+        }
+
+
+_cache: Optional[ResponseCache] = None
+
+
+def get_response_cache() -> ResponseCache:
+    global _cache
+    if _cache is None:
+        _cache = ResponseCache()
+    return _cache
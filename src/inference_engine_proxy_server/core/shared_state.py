@@ -0,0 +1,423 @@
+"""
+多 worker 共享後端狀態 (`PROXY_WORKERS` > 1):
+以 `uvicorn --workers N` 執行時，每個 worker 都是獨立的行程。只有取得 leader 檔案鎖 (flock) 的 worker
+會執行 `refresh_loop` 輪詢後端，並把結果寫入 mmap 的共享記憶體；其他 worker 以 seqlock 無鎖讀取，
+同步到自己的後端狀態表 (backend_state.py)。leader 結束時鎖會自動釋放，由其他 worker 接手。
+
+每個 worker 另外佔用一列 in-flight 計數器（以 byte-range lock 認領），只寫自己那一列，
+讀取時加總所有列，因此路由看到的是所有 worker 的總負載。
+
+後端可在執行期間增減（`BACKENDS_FILE`，見 registry.py），因此每個後端佔用一個 slot：
+slot 目錄記錄各 slot 的 url，第一個登記該 url 的 worker 在初始化鎖下認領空的 slot，
+其他 worker 依 url 找到同一個 slot。移除的後端回收後 slot 可再被新的後端使用。
+
+Layout (native byte order, 8-byte aligned):
+    header           magic, layout version, slots, worker rows, static blob size
+    slot directory   per slot: NUL-padded url (empty = free)
+    dynamic records  per slot: seq + one float per `DYNAMIC_FIELDS` entry (NaN = None)
+    static records   per slot: seq + length + JSON of the static info
+    in-flight rows   per worker row: one int64 per slot
+"""
+
+import asyncio
+import contextlib
+import hashlib
+import json
+import logging
+import math
+import mmap
+import os
+import struct
+import tempfile
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from .constants import (
+    BACKENDS,
+    PROXY_WORKERS,
+    SHARED_STATE_MAX_BACKENDS,
+    SHARED_STATE_PATH,
+    SHARED_STATE_STATIC_BYTES,
+    SHARED_STATE_SYNC_INTERVAL_SECONDS,
+)
+
+logger = logging.getLogger("shared-state")
+
+MAGIC = 0x5850524F58535431  # "XPROXST1"
+LAYOUT_VERSION = 2
+
+# Polled values of a backend (the dynamic fields of `BackendState`), shared between workers; add new numeric keys here
+DYNAMIC_FIELDS = (
+    "timestamp",
+    "requests_processing",
+    "requests_deferred",
+    "inflight_at_poll",
+    "ready",
+    "kv_cache_usage",
+    "prompt_tokens_per_second",
+    "generation_tokens_per_second",
+    "poll_interval",
+)
+_INT_FIELDS = {"inflight_at_poll"}
+_BOOL_FIELDS = {"ready"}
+
+_HEADER = struct.Struct("=QIIII")
+_HEADER_SIZE = 64
+_SEQ = struct.Struct("=Q")
+_DYNAMIC = struct.Struct("=" + "d" * len(DYNAMIC_FIELDS))
+_DYNAMIC_RECORD_SIZE = -(-(_SEQ.size + _DYNAMIC.size) // 64) * 64
+_STATIC_HEADER = struct.Struct("=QQ")
+_URL_BYTES = 512
+
+LEADER_RETRY_SECONDS = 1.0
+# Attempts at a consistent read of a record before it is skipped until the next sync; a record
+# stays odd forever if its writer died in the middle of a write, until the next leader rewrites it
+SEQLOCK_READ_ATTEMPTS = 100
+
+
+def _align(n: int) -> int:
+    return -(-n // 64) * 64
+
+
+def default_path() -> str:
+    """Shared file name derived from the working directory, backends and worker count."""
+    key = f"{os.getcwd()}|{','.join(BACKENDS)}|{PROXY_WORKERS}"
+    digest = hashlib.sha1(key.encode()).hexdigest()[:12]
+    directory = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+    return os.path.join(directory, f"inference-proxy-{digest}")
+
+
+class SharedState:
+    """Shared-memory view of the backend state, opened once per worker process."""
+
+    def __init__(self, path: str, backends: List[str], worker_rows: int,
+                 slots: int = SHARED_STATE_MAX_BACKENDS, static_bytes: int = SHARED_STATE_STATIC_BYTES) -> None:
+        import fcntl  # POSIX only; multi-worker mode is not supported elsewhere
+        self._fcntl = fcntl
+
+        self.slots = max(slots, len(backends))
+        self.worker_rows = worker_rows
+        self.static_bytes = static_bytes
+        # {backend_url: slot} of the backends this worker has registered
+        self.index: Dict[str, int] = {}
+
+        n = self.slots
+        self._directory_offset = _HEADER_SIZE
+        self._dynamic_offset = self._directory_offset + n * _URL_BYTES
+        self._static_record_size = _align(_STATIC_HEADER.size + static_bytes)
+        self._static_offset = self._dynamic_offset + n * _DYNAMIC_RECORD_SIZE
+        self._inflight_offset = _align(self._static_offset + n * self._static_record_size)
+        size = self._inflight_offset + worker_rows * n * 8
+
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        with self._init_lock():
+            header = os.pread(self._fd, _HEADER.size, 0)
+            expected = (MAGIC, LAYOUT_VERSION, n, worker_rows, static_bytes)
+            if len(header) < _HEADER.size or _HEADER.unpack(header) != expected or os.fstat(self._fd).st_size != size:
+                os.ftruncate(self._fd, 0)
+                os.ftruncate(self._fd, size)
+                os.pwrite(self._fd, _HEADER.pack(*expected), 0)
+            self._mm = mmap.mmap(self._fd, size)
+            self._inflight = memoryview(self._mm)[self._inflight_offset:size].cast("q")
+            for backend_url in backends:
+                self._claim_slot(backend_url)
+
+        self.row = self._claim_row()
+        self.is_leader = False
+        # Record sequence numbers last copied into the local cache, per backend url
+        self._seen_dynamic: Dict[str, int] = {}
+        self._seen_static: Dict[str, int] = {}
+        self._last_inflight_total = -1
+
+    @contextlib.contextmanager
+    def _init_lock(self):
+        """Serialises initialisation and slot directory changes between workers (byte 0 of the file)."""
+        self._fcntl.lockf(self._fd, self._fcntl.LOCK_EX, 1, 0)
+        try:
+            yield
+        finally:
+            self._fcntl.lockf(self._fd, self._fcntl.LOCK_UN, 1, 0)
+
+    # ---------- slot directory ----------
+
+    def _slot_url(self, slot: int) -> str:
+        offset = self._directory_offset + slot * _URL_BYTES
+        return bytes(self._mm[offset:offset + _URL_BYTES]).rstrip(b"\0").decode("utf-8", "replace")
+
+    def _write_slot_url(self, slot: int, backend_url: str) -> None:
+        offset = self._directory_offset + slot * _URL_BYTES
+        self._mm[offset:offset + _URL_BYTES] = backend_url.encode().ljust(_URL_BYTES, b"\0")[:_URL_BYTES]
+
+    def _claim_slot(self, backend_url: str) -> Optional[int]:
+        """The slot of `backend_url`, claiming a free one if no worker has; call with the init lock held."""
+        if len(backend_url.encode()) > _URL_BYTES:
+            logger.error("Backend url longer than %d bytes is not shared: %s", _URL_BYTES, backend_url)
+            return None
+        free = None
+        for slot in range(self.slots):
+            url = self._slot_url(slot)
+            if url == backend_url:
+                self.index[backend_url] = slot
+                return slot
+            if not url and free is None:
+                free = slot
+        if free is None:
+            logger.error("No free slot among SHARED_STATE_MAX_BACKENDS=%d; %s is not shared.", self.slots, backend_url)
+            return None
+        # A reused slot starts empty: no record published, no requests in flight
+        for offset in (self._dynamic_offset + free * _DYNAMIC_RECORD_SIZE,
+                       self._static_offset + free * self._static_record_size):
+            _SEQ.pack_into(self._mm, offset, 0)
+        for row in range(self.worker_rows):
+            self._inflight[row * self.slots + free] = 0
+        self._write_slot_url(free, backend_url)
+        self.index[backend_url] = free
+        return free
+
+    def register(self, backend_url: str) -> None:
+        """Gives a backend added at runtime its slot (the one other workers already use, if any)."""
+        if backend_url not in self.index:
+            with self._init_lock():
+                self._claim_slot(backend_url)
+            self._seen_dynamic.pop(backend_url, None)
+            self._seen_static.pop(backend_url, None)
+
+    def release(self, backend_url: str) -> None:
+        """
+        Drops a removed backend once this worker's requests to it are done. Its slot is freed only
+        when no worker has requests in flight on it any more, since claiming it zeroes every row;
+        otherwise the last worker to release it frees it.
+        """
+        slot = self.index.pop(backend_url, None)
+        self._seen_dynamic.pop(backend_url, None)
+        self._seen_static.pop(backend_url, None)
+        if slot is None:
+            return
+        with self._init_lock():
+            if self._slot_url(slot) != backend_url:
+                return
+            if self.row is not None:
+                # Requests still counted here after the grace period are no longer tracked
+                self._inflight[self.row * self.slots + slot] = 0
+            if any(self._inflight[row * self.slots + slot] for row in range(self.worker_rows)):
+                return
+            self._write_slot_url(slot, "")
+
+    # ---------- worker rows / leadership ----------
+
+    def _claim_row(self) -> Optional[int]:
+        """Locks one in-flight row for this process (bytes 1.. of the file) and zeroes it."""
+        n = self.slots
+        for row in range(self.worker_rows):
+            try:
+                self._fcntl.lockf(self._fd, self._fcntl.LOCK_EX | self._fcntl.LOCK_NB, 1, 1 + row)
+            except OSError:
+                continue
+            for i in range(n):
+                self._inflight[row * n + i] = 0  # left over by a worker that died with requests in flight
+            return row
+        logger.error("No free in-flight row in %d rows; this worker's load is not shared.", self.worker_rows)
+        return None
+
+    def try_become_leader(self) -> bool:
+        if not self.is_leader:
+            try:
+                self._fcntl.flock(self._fd, self._fcntl.LOCK_EX | self._fcntl.LOCK_NB)
+                self.is_leader = True
+            except OSError:
+                pass
+        return self.is_leader
+
+    # ---------- in-flight counters ----------
+
+    def add_inflight(self, backend_url: str, delta: int) -> None:
+        i = self.index.get(backend_url)
+        if i is None or self.row is None:
+            return
+        cell = self.row * self.slots + i
+        self._inflight[cell] = max(0, self._inflight[cell] + delta)
+
+    def total_inflight(self, backend_url: str) -> Optional[int]:
+        """In-flight requests on `backend_url` summed over all workers, or None if not shared."""
+        i = self.index.get(backend_url)
+        if i is None:
+            return None
+        n = self.slots
+        return sum(self._inflight[row * n + i] for row in range(self.worker_rows))
+
+    # ---------- seqlock records ----------
+
+    def _write_seqlocked(self, offset: int, payload: bytes) -> None:
+        seq = _SEQ.unpack_from(self._mm, offset)[0]
+        if seq & 1:
+            seq += 1   # a previous leader died in the middle of this write
+        _SEQ.pack_into(self._mm, offset, seq + 1)   # odd: write in progress
+        self._mm[offset + _SEQ.size:offset + _SEQ.size + len(payload)] = payload
+        _SEQ.pack_into(self._mm, offset, seq + 2)
+
+    def _read_seqlocked(self, offset: int, read: Callable[[], Any]) -> Optional[tuple]:
+        """
+        Returns (seq, value) from a consistent snapshot, or None if nothing was published yet or
+        no consistent snapshot was seen within `SEQLOCK_READ_ATTEMPTS` attempts.
+        """
+        for _ in range(SEQLOCK_READ_ATTEMPTS):
+            before = _SEQ.unpack_from(self._mm, offset)[0]
+            if before == 0:
+                return None
+            if before & 1:
+                continue  # the leader is writing; a record is only a few hundred bytes
+            value = read()
+            if _SEQ.unpack_from(self._mm, offset)[0] == before:
+                return before, value
+        return None
+
+    def publish_dynamic(self, backend_url: str, dynamic_info: Dict[str, Any]) -> None:
+        i = self.index.get(backend_url)
+        if i is None:
+            return
+        values = []
+        for name in DYNAMIC_FIELDS:
+            value = dynamic_info.get(name)
+            values.append(math.nan if value is None else float(value))
+        self._write_seqlocked(self._dynamic_offset + i * _DYNAMIC_RECORD_SIZE, _DYNAMIC.pack(*values))
+
+    def publish_static(self, backend_url: str, static_info: Dict[str, Any]) -> None:
+        i = self.index.get(backend_url)
+        if i is None:
+            return
+        data = json.dumps(static_info, separators=(",", ":")).encode()
+        if len(data) > self.static_bytes:
+            logger.error("Static info of %s is %d bytes, above SHARED_STATE_STATIC_BYTES=%d; not shared.",
+                         backend_url, len(data), self.static_bytes)
+            return
+        self._write_seqlocked(self._static_offset + i * self._static_record_size,
+                              struct.pack("=Q", len(data)) + data)
+
+    def _read_dynamic(self, i: int) -> Optional[tuple]:
+        offset = self._dynamic_offset + i * _DYNAMIC_RECORD_SIZE
+        return self._read_seqlocked(offset, lambda: _DYNAMIC.unpack_from(self._mm, offset + _SEQ.size))
+
+    def _read_static(self, i: int) -> Optional[tuple]:
+        offset = self._static_offset + i * self._static_record_size
+
+        def read() -> bytes:
+            length = struct.unpack_from("=Q", self._mm, offset + _SEQ.size)[0]
+            start = offset + _STATIC_HEADER.size
+            return self._mm[start:start + min(length, self.static_bytes)]
+
+        return self._read_seqlocked(offset, read)
+
+    def republish_static(self) -> None:
+        """
+        Rewrites the static records from this worker's copy when it becomes the leader: the refresh loop
+        only publishes static info it fetches, and a record left odd by a leader that died while writing
+        it would otherwise never become readable again (dynamic records are rewritten by every poll).
+        """
+        from .backend_state import get_state
+
+        for backend_url in list(self.index):
+            state = get_state(backend_url)
+            if state is not None and state.static:
+                self.publish_static(backend_url, state.static)
+
+    # ---------- follower side ----------
+
+    def sync_cache(self) -> bool:
+        """Copies records changed since the last call into the backend states. Returns True if any changed."""
+        from .backend_state import ensure_state
+        from .models import rebuild_model_index
+
+        changed = static_changed = False
+        for backend_url in list(BACKENDS):
+            i = self.index.get(backend_url)
+            if i is None:
+                continue
+            state = ensure_state(backend_url)
+
+            snapshot = self._read_static(i)
+            if snapshot is not None and snapshot[0] != self._seen_static.get(backend_url):
+                self._seen_static[backend_url] = snapshot[0]
+                try:
+                    state.set_static(json.loads(snapshot[1]))
+                    static_changed = True
+                except ValueError:
+                    logger.warning("Corrupt static record for %s", backend_url)
+
+            snapshot = self._read_dynamic(i)
+            if snapshot is not None and snapshot[0] != self._seen_dynamic.get(backend_url):
+                self._seen_dynamic[backend_url] = snapshot[0]
+                dynamic_info: Dict[str, Any] = {}
+                for name, value in zip(DYNAMIC_FIELDS, snapshot[1]):
+                    if math.isnan(value):
+                        value = None
+                    elif name in _INT_FIELDS:
+                        value = int(value)
+                    elif name in _BOOL_FIELDS:
+                        value = bool(value)
+                    dynamic_info[name] = value
+                state.set_dynamic(dynamic_info)
+                changed = True
+
+        if static_changed:
+            rebuild_model_index()
+        return changed or static_changed
+
+    def inflight_changed(self) -> bool:
+        """True if the total in-flight count across workers changed since the last call."""
+        total = sum(self._inflight)
+        changed = total != self._last_inflight_total
+        self._last_inflight_total = total
+        return changed
+
+
+_state: Optional[SharedState] = None
+
+
+def get_shared_state() -> Optional[SharedState]:
+    """The shared state of this worker, or None in single-process mode."""
+    global _state
+    if _state is None and PROXY_WORKERS > 1:
+        path = SHARED_STATE_PATH or default_path()
+        # Extra rows let a restarted worker start before the one it replaces has exited
+        _state = SharedState(path, BACKENDS, worker_rows=PROXY_WORKERS * 2)
+        logger.info("Worker %d uses shared state %s (row %s)", os.getpid(), path, _state.row)
+    return _state
+
+
+async def run(refresh_loop: Callable[[], Awaitable[None]]) -> None:
+    """
+    Background task of every worker in multi-worker mode: runs `refresh_loop` while this
+    worker holds the leader lock, otherwise mirrors the shared records into the local cache.
+    Either way, capacity freed by any worker wakes this worker's admission queue and
+    re-sorts its load index.
+    """
+    from .admission import notify_capacity
+    from .backend_state import refresh_all
+
+    state = get_shared_state()
+    loop = asyncio.get_running_loop()
+    leader_task: Optional[asyncio.Task] = None
+    next_try = 0.0
+    try:
+        while True:
+            if leader_task is not None and leader_task.done():
+                # Still holding the leader lock: start polling again instead of leaving every worker stale
+                if not leader_task.cancelled() and leader_task.exception() is not None:
+                    logger.error("Metrics refresh loop failed, restarting it: %r", leader_task.exception())
+                leader_task = None
+            if leader_task is None and loop.time() >= next_try:
+                next_try = loop.time() + LEADER_RETRY_SECONDS
+                if state.try_become_leader():
+                    logger.info("Worker %d is now the metrics leader", os.getpid())
+                    state.republish_static()
+                    leader_task = asyncio.create_task(refresh_loop())
+            changed = False
+            if leader_task is None:
+                changed = state.sync_cache()
+            if state.inflight_changed() or changed:
+                refresh_all()
+                notify_capacity()
+            await asyncio.sleep(SHARED_STATE_SYNC_INTERVAL_SECONDS)
+    finally:
+        if leader_task is not None:
+            leader_task.cancel()
+            await asyncio.gather(leader_task, return_exceptions=True)
@@ -0,0 +1,336 @@
+"""
+可插拔的負載平衡策略:
+`choose_backend()` 先從快取中篩選出就緒的候選後端，再交給此處以 `LB_STRATEGY` 環境變數選定的策略挑選。
+每個候選者是 `(backend_url, load)`，其中 load 為輪詢到的處理中請求數加上代理本身的 in-flight 變化量。
+`uses_tokens` 為 True 的策略另外會收到請求的 token 估計值 (`TokenEstimate`)。
+`indexed` 為 True 的策略只依各後端自己的負載排序，可由負載索引（backend_state.py）直接取出最佳後端，不必每次掃描。
+`sampled` 為 True 的策略只比較隨機抽出的兩個候選者，由 `choose_backend()` 直接抽樣，同樣不必掃描。
+策略在每次挑選時不配置暫存的 list，同分的候選者以 reservoir sampling 隨機挑選。
+"""
+
+import math
+import random
+import time
+import logging
+from abc import ABC, abstractmethod
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from .constants import BACKEND_WEIGHTS, LB_STRATEGY, PEAK_EWMA_DECAY_SECONDS, _INFLIGHT_TOKENS
+from .token_estimator import TokenEstimate
+from . import stream_stats
+
+logger = logging.getLogger("lb-strategy")
+
+Candidate = Tuple[str, float]
+_NO_TOKENS = (0, 0, 0)
+
+
+class LoadBalancingStrategy(ABC):
+    name: str = ""
+    # Whether `select` needs the token estimate of the request being routed
+    uses_tokens: bool = False
+    # Whether `select` always picks the candidate with the lowest `index_key` (ties aside)
+    indexed: bool = False
+    # Whether `select` over two randomly drawn candidates is as good as over all of them
+    sampled: bool = False
+
+    @abstractmethod
+    def select(self, candidates: Sequence[Candidate], tokens: Optional[TokenEstimate] = None) -> Optional[str]:
+        """Returns the url of the chosen backend, or None if `candidates` is empty."""
+        pass
+
+    def observe_ttft(self, backend_url: str, seconds: float) -> None:
+        """Receives the time-to-first-token observed for a request forwarded to `backend_url`."""
+        pass
+
+    def forget(self, backend_url: str) -> None:
+        """Drops what the strategy keeps about a backend that was removed."""
+        pass
+
+    def index_key(self, backend_url: str, load: float) -> float:
+        """Sort key of a backend in the load index (lowest first); only used if `indexed`."""
+        return load
+
+
+class LeastRequestsStrategy(LoadBalancingStrategy):
+    """Minimum load, random tie-break (the original routing policy)."""
+    name = "least_requests"
+    indexed = True
+
+    def select(self, candidates: Sequence[Candidate], tokens: Optional[TokenEstimate] = None) -> Optional[str]:
+        best_load = math.inf
+        best: Optional[str] = None
+        ties = 0
+        for url, load in candidates:
+            if load < best_load:
+                best_load, best, ties = load, url, 1
+            elif load == best_load:
+                ties += 1
+                if random.random() * ties < 1:
+                    best = url
+        return best
+
+
+class PowerOfTwoChoicesStrategy(LoadBalancingStrategy):
+    """
+    Samples two candidates at random and keeps the less loaded one.
+    Avoids the herd behaviour of a global minimum when loads are stale, in O(1).
+    """
+    name = "p2c"
+    sampled = True
+
+    def select(self, candidates: Sequence[Candidate], tokens: Optional[TokenEstimate] = None) -> Optional[str]:
+        count = len(candidates)
+        if not count:
+            return None
+        if count == 1:
+            return candidates[0][0]
+        first = random.randrange(count)
+        second = random.randrange(count - 1)
+        if second >= first:
+            second += 1
+        a, b = candidates[first], candidates[second]
+        return a[0] if a[1] <= b[1] else b[0]
+
+
+class WeightedLeastConnectionsStrategy(LoadBalancingStrategy):
+    """
+    Minimum `load / weight`, where weight is the capacity of the backend (`BACKEND_WEIGHTS`).
+    A node with weight 2 is expected to carry twice the requests of a node with weight 1.
+    """
+    name = "weighted_least_connections"
+    indexed = True
+
+    def __init__(self, weights: Optional[Dict[str, float]] = None) -> None:
+        self.weights = BACKEND_WEIGHTS if weights is None else weights
+
+    def index_key(self, backend_url: str, load: float) -> float:
+        return (load + 1) / self.weights.get(backend_url, 1.0)
+
+    def select(self, candidates: Sequence[Candidate], tokens: Optional[TokenEstimate] = None) -> Optional[str]:
+        best_score = math.inf
+        best: Optional[str] = None
+        ties = 0
+        for url, load in candidates:
+            # (load + 1) so that idle nodes are still ordered by capacity
+            score = (load + 1) / self.weights.get(url, 1.0)
+            if score < best_score:
+                best_score, best, ties = score, url, 1
+            elif score == best_score:
+                ties += 1
+                if random.random() * ties < 1:
+                    best = url
+        return best
+
+
+class PeakEwmaStrategy(LoadBalancingStrategy):
+    """
+    Peak-EWMA of observed time-to-first-token, multiplied by the pending load.
+    A slower observation replaces the average immediately (peak), faster ones decay
+    into it with time constant `PEAK_EWMA_DECAY_SECONDS`, so a degrading node is
+    penalised at once and only slowly trusted again.
+    """
+    name = "peak_ewma"
+
+    def __init__(self, decay_seconds: float = PEAK_EWMA_DECAY_SECONDS,
+                 clock: Callable[[], float] = time.monotonic) -> None:
+        self.decay_seconds = decay_seconds
+        self.clock = clock
+        # {backend_url: [ewma_seconds, last_update]}
+        self._ewma: Dict[str, List[float]] = {}
+
+    def observe_ttft(self, backend_url: str, seconds: float) -> None:
+        now = self.clock()
+        entry = self._ewma.get(backend_url)
+        if entry is None:
+            self._ewma[backend_url] = [seconds, now]
+            return
+        if seconds > entry[0]:
+            entry[0] = seconds
+        else:
+            w = math.exp(-(now - entry[1]) / self.decay_seconds)
+            entry[0] = entry[0] * w + seconds * (1.0 - w)
+        entry[1] = now
+
+    def forget(self, backend_url: str) -> None:
+        self._ewma.pop(backend_url, None)
+
+    def get_ewma(self, backend_url: str) -> Optional[float]:
+        entry = self._ewma.get(backend_url)
+        return entry[0] if entry else None
+
+    def select(self, candidates: Sequence[Candidate], tokens: Optional[TokenEstimate] = None) -> Optional[str]:
+        if not candidates:
+            return None
+        ewma = self._ewma
+        # Unobserved backends get the average latency so they are explored, not flooded.
+        default = sum(entry[0] for entry in ewma.values()) / len(ewma) if ewma else 1.0
+        best_score = math.inf
+        best: Optional[str] = None
+        ties = 0
+        for url, load in candidates:
+            entry = ewma.get(url)
+            score = (entry[0] if entry else default) * (load + 1)
+            if score < best_score:
+                best_score, best, ties = score, url, 1
+            elif score == best_score:
+                ties += 1
+                if random.random() * ties < 1:
+                    best = url
+        return best
+
+
+class TokenAwareStrategy(LoadBalancingStrategy):
+    """
+    Minimum expected seconds of work: the prompt and generation tokens in flight on a backend,
+    plus those of the new request, divided by the backend's prompt and generation throughput
+    (`prompt_tokens_per_second` / `generation_tokens_per_second` from its metrics).
+    Requests the backend reports beyond the ones this proxy estimated are counted at the
+    average size of recent requests. Backends without a throughput figure get the average.
+    """
+    name = "token_aware"
+    uses_tokens = True
+
+    DEFAULT_PROMPT_TPS = 1000.0
+    DEFAULT_GENERATION_TPS = 50.0
+    AVERAGE_WEIGHT = 0.05
+
+    def __init__(self) -> None:
+        # Moving average of (prompt_tokens, max_tokens) of routed requests
+        self._average: Optional[List[float]] = None
+
+    def _update_average(self, tokens: TokenEstimate) -> List[float]:
+        if self._average is None:
+            self._average = [float(tokens.prompt_tokens), float(tokens.max_tokens)]
+        else:
+            for i, value in enumerate((tokens.prompt_tokens, tokens.max_tokens)):
+                self._average[i] += (value - self._average[i]) * self.AVERAGE_WEIGHT
+        return self._average
+
+    @staticmethod
+    def _rate(state, key: str) -> Optional[float]:
+        rate = getattr(state, key, None)
+        return rate if rate is not None and rate > 0 else None
+
+    def select(self, candidates: Sequence[Candidate], tokens: Optional[TokenEstimate] = None) -> Optional[str]:
+        if not candidates:
+            return None
+        if tokens is None:
+            tokens = TokenEstimate(0, 0)
+        average = self._update_average(tokens) if tokens.prompt_tokens or tokens.max_tokens else (self._average or [0.0, 0.0])
+
+        from .backend_state import get_state   # imports this module
+
+        prompt_sum = generation_sum = 0.0
+        prompt_known = generation_known = 0
+        for url, _ in candidates:
+            state = get_state(url)
+            prompt_rate = self._rate(state, "prompt_tokens_per_second")
+            if prompt_rate is not None:
+                prompt_sum += prompt_rate
+                prompt_known += 1
+            generation_rate = self._rate(state, "generation_tokens_per_second")
+            if generation_rate is not None:
+                generation_sum += generation_rate
+                generation_known += 1
+        default_prompt = prompt_sum / prompt_known if prompt_known else self.DEFAULT_PROMPT_TPS
+        default_generation = generation_sum / generation_known if generation_known else self.DEFAULT_GENERATION_TPS
+
+        best_score = math.inf
+        best: Optional[str] = None
+        ties = 0
+        for url, load in candidates:
+            state = get_state(url)
+            prompt_rate = self._rate(state, "prompt_tokens_per_second") or default_prompt
+            generation_rate = self._rate(state, "generation_tokens_per_second") or default_generation
+            prompt, generation, estimated = _INFLIGHT_TOKENS.get(url, _NO_TOKENS)
+            others = max(0.0, load - estimated)
+            prompt += others * average[0] + tokens.prompt_tokens
+            generation += others * average[1] + tokens.max_tokens
+            score = prompt / prompt_rate + generation / generation_rate
+            if score < best_score:
+                best_score, best, ties = score, url, 1
+            elif score == best_score:
+                ties += 1
+                if random.random() * ties < 1:
+                    best = url
+        return best
+
+
+class StreamLatencyStrategy(LoadBalancingStrategy):
+    """
+    Minimum expected duration from the live stream statistics (stream_stats.py): the backend's
+    recent median time-to-first-token plus its median inter-token latency times the request's
+    `max_tokens`, multiplied by the pending load. Unlike the polled `requests_processing`, this
+    follows how fast each node currently generates. Backends without enough streams get the
+    average, so they are explored.
+    """
+    name = "stream_latency"
+    uses_tokens = True
+
+    DEFAULT_TTFT = 1.0
+    DEFAULT_INTER_TOKEN = 1 / 50
+
+    def __init__(self, clock: Callable[[], float] = time.monotonic) -> None:
+        self.clock = clock
+
+    def select(self, candidates: Sequence[Candidate], tokens: Optional[TokenEstimate] = None) -> Optional[str]:
+        if not candidates:
+            return None
+        now = self.clock()
+        generation = tokens.max_tokens if tokens is not None else 0
+        ttft_sum = inter_token_sum = 0.0
+        ttft_known = inter_token_known = 0
+        for url, _ in candidates:
+            # Cached per backend for ROUTING_REFRESH_SECONDS, so the second pass below is cheap
+            ttft, inter_token = stream_stats.latency(url, now)
+            if ttft is not None:
+                ttft_sum += ttft
+                ttft_known += 1
+            if inter_token is not None:
+                inter_token_sum += inter_token
+                inter_token_known += 1
+        default_ttft = ttft_sum / ttft_known if ttft_known else self.DEFAULT_TTFT
+        default_inter_token = inter_token_sum / inter_token_known if inter_token_known else self.DEFAULT_INTER_TOKEN
+
+        best_score = math.inf
+        best: Optional[str] = None
+        ties = 0
+        for url, load in candidates:
+            ttft, inter_token = stream_stats.latency(url, now)
+            expected = (ttft or default_ttft) + (inter_token or default_inter_token) * generation
+            score = expected * (load + 1)
+            if score < best_score:
+                best_score, best, ties = score, url, 1
+            elif score == best_score:
+                ties += 1
+                if random.random() * ties < 1:
+                    best = url
+        return best
+
+
+STRATEGIES: Dict[str, Callable[[], LoadBalancingStrategy]] = {
+    LeastRequestsStrategy.name: LeastRequestsStrategy,
+    PowerOfTwoChoicesStrategy.name: PowerOfTwoChoicesStrategy,
+    WeightedLeastConnectionsStrategy.name: WeightedLeastConnectionsStrategy,
+    PeakEwmaStrategy.name: PeakEwmaStrategy,
+    TokenAwareStrategy.name: TokenAwareStrategy,
+    StreamLatencyStrategy.name: StreamLatencyStrategy,
+}
+
+_strategy: Optional[LoadBalancingStrategy] = None
+
+
+def create_strategy(name: str) -> LoadBalancingStrategy:
+    factory = STRATEGIES.get(name)
+    if factory is None:
+        raise ValueError(f"Unknown load balancing strategy: {name}. Choose from {', '.join(STRATEGIES)}")
+    return factory()
+
+
+def get_strategy() -> LoadBalancingStrategy:
+    global _strategy
+    if _strategy is None:
+        _strategy = create_strategy(LB_STRATEGY)
+        logger.info("Using load balancing strategy: %s", _strategy.name)
+    return _strategy
@@ -0,0 +1,193 @@
+"""
+串流生成速度統計:
+`_BackendStream`（backends/base.py）轉發 SSE 串流時，在合併 chunk (`coalesce_chunks`) 之前取得上游送達的原始 chunk，
+逐行找出以 `data:` 開頭的行計算事件數（不解碼 JSON，跨 chunk 的行也會接上），
+記錄每個後端的首字延遲 (TTFT，從轉發請求到第一個事件) 與事件之間的間隔 (inter-token latency)。
+一個 chunk 完成多個事件時，距離上一個事件的時間平均分給這些事件。
+
+數值存放在固定大小、以指數遞減權重的對數分桶直方圖（半衰期 `STREAM_STATS_HALF_LIFE_SECONDS`），
+每個後端的記憶體用量固定，百分位數反映的是最近的生成速度。結果顯示在 `/health` 每個後端的 `streams` 欄位，
+`stream_latency` 負載平衡策略（strategies.py）依此挑選目前生成最快的後端。多 worker 模式下每個 worker 各自統計。
+"""
+
+import math
+import time
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+from .constants import STREAM_STATS_HALF_LIFE_SECONDS
+
+# Bucket i holds values in [MIN_SECONDS * RATIO**i, MIN_SECONDS * RATIO**(i + 1)); about 1ms to 4.5 minutes
+MIN_SECONDS = 0.001
+RATIO = 1.25
+BUCKETS = 56
+_LOG_RATIO = math.log(RATIO)
+# Weights are decayed at most this often
+DECAY_STEP_SECONDS = 1.0
+# A histogram with less (decayed) weight than this has no percentiles yet
+MIN_WEIGHT = 3.0
+# Percentile used for routing, recomputed at most this often per backend
+ROUTING_PERCENTILE = 50
+ROUTING_REFRESH_SECONDS = 0.5
+_DATA = b"data:"
+_DONE = b"[DONE]"
+# Bytes kept of a line that continues in the next chunk: enough to recognise `data: [DONE]`
+_LINE_HEAD = 16
+
+
+class DecayingHistogram:
+    """Log-bucketed histogram whose weights halve every `half_life` seconds; percentiles within RATIO."""
+
+    __slots__ = ("counts", "total", "decayed_at", "half_life")
+
+    def __init__(self, half_life: float = STREAM_STATS_HALF_LIFE_SECONDS) -> None:
+        self.counts: List[float] = [0.0] * BUCKETS
+        self.total = 0.0
+        self.decayed_at: Optional[float] = None
+        self.half_life = half_life
+
+    def _decay(self, now: float) -> None:
+        if self.decayed_at is None:
+            self.decayed_at = now
+            return
+        elapsed = now - self.decayed_at
+        if elapsed < DECAY_STEP_SECONDS:
+            return
+        factor = 0.5 ** (elapsed / self.half_life) if self.half_life > 0 else 0.0
+        counts = self.counts
+        for i in range(BUCKETS):
+            counts[i] *= factor
+        self.total *= factor
+        self.decayed_at = now
+
+    def observe(self, seconds: float, now: float, weight: float = 1.0) -> None:
+        self._decay(now)
+        if seconds <= MIN_SECONDS:
+            i = 0
+        else:
+            i = min(BUCKETS - 1, int(math.log(seconds / MIN_SECONDS) / _LOG_RATIO))
+        self.counts[i] += weight
+        self.total += weight
+
+    def percentile(self, percent: float, now: float) -> Optional[float]:
+        """The `percent` percentile (the geometric middle of its bucket), or None without enough samples."""
+        self._decay(now)
+        if self.total < MIN_WEIGHT:
+            return None
+        target = self.total * percent / 100
+        cumulative = 0.0
+        for i, count in enumerate(self.counts):
+            cumulative += count
+            if cumulative >= target:
+                return MIN_SECONDS * RATIO ** (i + 0.5)
+        return MIN_SECONDS * RATIO ** (BUCKETS - 0.5)
+
+
+class BackendStreamStats:
+    __slots__ = ("ttft", "inter_token", "routing", "routing_at")
+
+    def __init__(self) -> None:
+        self.ttft = DecayingHistogram()
+        self.inter_token = DecayingHistogram()
+        self.routing: Tuple[Optional[float], Optional[float]] = (None, None)
+        self.routing_at = float("-inf")
+
+
+def _is_event(line: bytes) -> bool:
+    """Whether the start of an SSE line is a `data:` field carrying a token (not the end marker)."""
+    return line.startswith(_DATA) and line[5:].strip() != _DONE
+
+
+class StreamRecorder:
+    """
+    Times the events of one SSE stream; `feed` every chunk as it arrives from the backend,
+    before any re-chunking. An event is counted when its `data:` line is complete.
+    """
+
+    __slots__ = ("stats", "start", "last_event", "line_head")
+
+    def __init__(self, stats: BackendStreamStats, start: float) -> None:
+        self.stats = stats
+        self.start = start
+        self.last_event: Optional[float] = None
+        # Start of a line that is not complete yet, None at a line boundary
+        self.line_head: Optional[bytes] = None
+
+    def feed(self, chunk: bytes, now: float) -> None:
+        events = 0
+        start = 0
+        end = chunk.find(b"\n")
+        if self.line_head is not None and end != -1:
+            if _is_event((self.line_head + chunk[:min(end, _LINE_HEAD)])[:_LINE_HEAD]):
+                events += 1
+            self.line_head = None
+            start = end + 1
+            end = chunk.find(b"\n", start)
+        elif self.line_head is not None:
+            if len(self.line_head) < _LINE_HEAD:
+                self.line_head = (self.line_head + chunk)[:_LINE_HEAD]
+            return
+        while end != -1:
+            if chunk.startswith(_DATA, start) and _is_event(chunk[start:min(end, start + _LINE_HEAD)]):
+                events += 1
+            start = end + 1
+            end = chunk.find(b"\n", start)
+        if start < len(chunk):
+            self.line_head = chunk[start:start + _LINE_HEAD]
+        if not events:
+            return
+        if self.last_event is None:
+            # Events arriving together with the first one add no gap
+            self.stats.ttft.observe(now - self.start, now)
+        else:
+            self.stats.inter_token.observe((now - self.last_event) / events, now, events)
+        self.last_event = now
+
+
+_stats: Dict[str, BackendStreamStats] = {}
+
+
+def open_stream(backend_url: str, start: float) -> StreamRecorder:
+    """A recorder for a stream forwarded to `backend_url` at `start` (time.monotonic())."""
+    stats = _stats.get(backend_url)
+    if stats is None:
+        stats = _stats[backend_url] = BackendStreamStats()
+    return StreamRecorder(stats, start)
+
+
+def latency(backend_url: str, now: float) -> Tuple[Optional[float], Optional[float]]:
+    """The routing percentiles of (TTFT, inter-token latency) of `backend_url`, None where unknown."""
+    stats = _stats.get(backend_url)
+    if stats is None:
+        return None, None
+    if now - stats.routing_at >= ROUTING_REFRESH_SECONDS:
+        stats.routing = (stats.ttft.percentile(ROUTING_PERCENTILE, now),
+                         stats.inter_token.percentile(ROUTING_PERCENTILE, now))
+        stats.routing_at = now
+    return stats.routing
+
+
+def status(backend_url: str, now: float) -> Dict[str, Any]:
+    """The current TTFT and inter-token percentiles of `backend_url` for /health."""
+    stats = _stats.get(backend_url)
+    if stats is None:
+        return {}
+    result: Dict[str, Any] = {}
+    for name, histogram in (("ttft_seconds", stats.ttft), ("inter_token_seconds", stats.inter_token)):
+        values = {f"p{p}": histogram.percentile(p, now) for p in (50, 90, 99)}
+        if values["p50"] is not None:
+            result[name] = {key: round(value, 4) for key, value in values.items()}
+    if "inter_token_seconds" in result:
+        result["tokens_per_second"] = round(1 / result["inter_token_seconds"]["p50"], 1)
+    return result
+
+
+async def timed(recorder: StreamRecorder, chunks: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+    """Passes `chunks` on, feeding each one to `recorder` when it arrives."""
+    async for chunk in chunks:
+        recorder.feed(chunk, time.monotonic())
+        yield chunk
+
+
+def forget(backend_url: str) -> None:
+    """Drops the statistics of a backend that was removed."""
+    _stats.pop(backend_url, None)
@@ -0,0 +1,320 @@
+"""
+Proxy 自身的監控指標 (prometheus_client)，由代理的 `GET /metrics` 輸出。
+所有指標都註冊在獨立的 `REGISTRY`，與後端引擎的 `/metrics` 互不混淆。
+請求路徑上的指標透過 `backend_metrics()` 取得每個後端預先綁定好 label 的子指標，
+避免每次記錄都經過 `labels()` 的查表與鎖。
+
+多 worker 模式 (`PROXY_WORKERS` > 1) 下每個 worker 各自記錄，`/metrics` 只會回傳處理該次抓取的 worker 的數值；
+要彙總所有 worker，啟動前須將 `PROMETHEUS_MULTIPROC_DIR` 設為一個空目錄（prometheus_client 的 multiprocess 模式），
+未設定時啟動會記錄警告，設定的路徑不是目錄時啟動失敗。
+"""
+
+import logging
+import os
+from typing import Any, Dict, Optional
+
+from prometheus_client import CollectorRegistry, Counter, Gauge, Histogram, generate_latest
+
+logger = logging.getLogger("telemetry")
+
+REGISTRY = CollectorRegistry()
+
+_LATENCY_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+_CONNECT_BUCKETS = (0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10)
+_SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+
+# --- Admission queue (src/inference_engine_proxy_server/core/admission.py) ---
+ADMISSION_QUEUE_DEPTH = Gauge(
+    "proxy_admission_queue_depth",
+    "Requests currently waiting in the admission queue.",
+    multiprocess_mode="livesum",
+    registry=REGISTRY,
+)
+ADMISSION_WAIT_SECONDS = Histogram(
+    "proxy_admission_wait_seconds",
+    "Time requests spent in the admission queue.",
+    ["outcome"],
+    buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60),
+    registry=REGISTRY,
+)
+ADMISSION_REQUESTS = Counter(
+    "proxy_admission_requests",
+    "Requests that went through the admission queue, by outcome (admitted, timeout, rejected, cancelled).",
+    ["outcome"],
+    registry=REGISTRY,
+)
+PRIORITY_CLASS_REQUESTS = Counter(
+    "proxy_priority_class_requests",
+    "Requests by priority class and whether they got a backend (admitted) or a 503 (unavailable).",
+    ["class", "outcome"],
+    registry=REGISTRY,
+)
+PRIORITY_CLASS_WAIT_SECONDS = Histogram(
+    "proxy_priority_class_wait_seconds",
+    "Time requests of each priority class waited for a backend, 0 when one was free right away.",
+    ["class"],
+    buckets=(0.001, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60),
+    registry=REGISTRY,
+)
+PRIORITY_CLASS_RESPONSE_SECONDS = Histogram(
+    "proxy_priority_class_response_seconds",
+    "Time from a request's arrival until its response headers, by priority class "
+    "(for failover-capable streams, until the first chunk).",
+    ["class"],
+    buckets=_LATENCY_BUCKETS,
+    registry=REGISTRY,
+)
+
+# --- Routing (src/inference_engine_proxy_server/core/functions.py) ---
+ROUTING_DECISION_SECONDS = Histogram(
+    "proxy_routing_decision_seconds",
+    "Time spent choosing a backend from the cached metrics (one choose_backend call).",
+    buckets=(0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01),
+    registry=REGISTRY,
+)
+
+# --- Proxied requests (src/inference_engine_proxy_server/backends/base.py) ---
+UPSTREAM_REQUESTS = Counter(
+    "proxy_upstream_requests",
+    "Requests forwarded to each backend, by response status code (\"error\" when no response arrived).",
+    ["backend", "status"],
+    registry=REGISTRY,
+)
+UPSTREAM_TTFB_SECONDS = Histogram(
+    "proxy_upstream_ttfb_seconds",
+    "Time from forwarding a request until the backend's response headers arrived.",
+    ["backend"],
+    buckets=_LATENCY_BUCKETS,
+    registry=REGISTRY,
+)
+STREAM_DURATION_SECONDS = Histogram(
+    "proxy_stream_duration_seconds",
+    "Total duration of proxied SSE streams, from forwarding the request to closing the stream.",
+    ["backend"],
+    buckets=_LATENCY_BUCKETS + (600, 1800),
+    registry=REGISTRY,
+)
+UPSTREAM_REQUEST_BYTES = Histogram(
+    "proxy_upstream_request_bytes",
+    "Size of request bodies sent to each backend.",
+    ["backend"],
+    buckets=_SIZE_BUCKETS,
+    registry=REGISTRY,
+)
+UPSTREAM_RESPONSE_BYTES = Histogram(
+    "proxy_upstream_response_bytes",
+    "Size of response bodies returned by each backend.",
+    ["backend"],
+    buckets=_SIZE_BUCKETS,
+    registry=REGISTRY,
+)
+
+# --- Upstream connection pools (src/inference_engine_proxy_server/core/http_client.py) ---
+UPSTREAM_POOL_WAIT_SECONDS = Histogram(
+    "proxy_upstream_pool_wait_seconds",
+    "Time proxied requests waited for a connection of the backend's pool, before connecting.",
+    ["backend"],
+    buckets=_CONNECT_BUCKETS,
+    registry=REGISTRY,
+)
+UPSTREAM_CONNECT_SECONDS = Histogram(
+    "proxy_upstream_connect_seconds",
+    "Time to open a new connection to a backend (TCP, TLS and HTTP/2 setup).",
+    ["backend"],
+    buckets=_CONNECT_BUCKETS,
+    registry=REGISTRY,
+)
+UPSTREAM_CONNECTIONS = Counter(
+    "proxy_upstream_connections",
+    "Proxied requests by whether they reused a pooled connection or opened a new one.",
+    ["backend", "connection"],
+    registry=REGISTRY,
+)
+
+# --- Metrics refresh (src/inference_engine_proxy_server/core/cache_refresher.py) ---
+BACKEND_POLL_SECONDS = Histogram(
+    "proxy_backend_poll_seconds",
+    "Duration of one refresh cycle (static info, /metrics and /health) of a backend.",
+    ["backend"],
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2, 5),
+    registry=REGISTRY,
+)
+
+# --- Passive health checking (src/inference_engine_proxy_server/core/circuit_breaker.py) ---
+CIRCUIT_STATE = Gauge(
+    "proxy_circuit_state",
+    "Circuit breaker state of each backend (0 closed, 1 open / ejected, 2 half-open).",
+    ["backend"],
+    multiprocess_mode="livemax",
+    registry=REGISTRY,
+)
+CIRCUIT_EJECTIONS = Counter(
+    "proxy_circuit_ejections",
+    "Times a backend was ejected for its error rate, latency or a failed half-open probe.",
+    ["backend"],
+    registry=REGISTRY,
+)
+
+# --- Response cache (src/inference_engine_proxy_server/core/response_cache.py) ---
+RESPONSE_CACHE_REQUESTS = Counter(
+    "proxy_response_cache_requests",
+    "Cacheable requests by result (hit, miss, coalesced, bypass).",
+    ["result"],
+    registry=REGISTRY,
+)
+RESPONSE_CACHE_ENTRIES = Gauge(
+    "proxy_response_cache_entries",
+    "Responses currently held in the response cache.",
+    multiprocess_mode="livesum",
+    registry=REGISTRY,
+)
+RESPONSE_CACHE_BYTES = Gauge(
+    "proxy_response_cache_bytes",
+    "Body bytes currently held in the response cache.",
+    multiprocess_mode="livesum",
+    registry=REGISTRY,
+)
+
+# --- Request hedging (src/inference_engine_proxy_server/core/hedging.py) ---
+HEDGED_REQUESTS = Counter(
+    "proxy_hedged_requests",
+    "Hedgeable requests slower than their hedge delay, by outcome "
+    "(primary_won, hedge_won, no_budget, no_backend).",
+    ["outcome"],
+    registry=REGISTRY,
+)
+
+# --- Embeddings micro-batching (src/inference_engine_proxy_server/core/embeddings_batcher.py) ---
+EMBEDDINGS_BATCH_REQUESTS = Histogram(
+    "proxy_embeddings_batch_requests",
+    "Client requests merged into each upstream embeddings request.",
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256),
+    registry=REGISTRY,
+)
+EMBEDDINGS_BATCH_FALLBACKS = Counter(
+    "proxy_embeddings_batch_fallbacks",
+    "Merged embeddings requests that failed or could not be split, whose requests were then sent one by one.",
+    registry=REGISTRY,
+)
+
+# --- Per-tenant rate limits (src/inference_engine_proxy_server/core/rate_limit.py) ---
+RATE_LIMITED_REQUESTS = Counter(
+    "proxy_rate_limited_requests",
+    "Requests refused with 429, by the limit they exceeded (concurrency, requests, tokens).",
+    ["limit"],
+    registry=REGISTRY,
+)
+RATE_LIMIT_TENANTS = Gauge(
+    "proxy_rate_limit_tenants",
+    "Callers currently tracked by the rate limiter.",
+    multiprocess_mode="livesum",
+    registry=REGISTRY,
+)
+RATE_LIMIT_TOKENS = Counter(
+    "proxy_rate_limit_tokens",
+    "Tokens charged to callers' per-minute budgets (usage of responses, or streamed events).",
+    registry=REGISTRY,
+)
+
+
+class BackendMetrics:
+    """The label children of one backend, bound once so recording is a plain method call."""
+
+    __slots__ = ("backend_url", "ttfb", "stream_duration", "request_bytes", "response_bytes",
+                 "pool_wait", "connect", "new_connections", "reused_connections", "poll", "_requests")
+
+    def __init__(self, backend_url: str) -> None:
+        self.backend_url = backend_url
+        self.ttfb = UPSTREAM_TTFB_SECONDS.labels(backend_url)
+        self.stream_duration = STREAM_DURATION_SECONDS.labels(backend_url)
+        self.request_bytes = UPSTREAM_REQUEST_BYTES.labels(backend_url)
+        self.response_bytes = UPSTREAM_RESPONSE_BYTES.labels(backend_url)
+        self.pool_wait = UPSTREAM_POOL_WAIT_SECONDS.labels(backend_url)
+        self.connect = UPSTREAM_CONNECT_SECONDS.labels(backend_url)
+        self.new_connections = UPSTREAM_CONNECTIONS.labels(backend_url, "new")
+        self.reused_connections = UPSTREAM_CONNECTIONS.labels(backend_url, "reused")
+        self.poll = BACKEND_POLL_SECONDS.labels(backend_url)
+        self._requests: Dict[Any, Any] = {}
+
+    def count_request(self, status: Any) -> None:
+        """Counts one forwarded request by status code (an int, or "error")."""
+        child = self._requests.get(status)
+        if child is None:
+            child = self._requests[status] = UPSTREAM_REQUESTS.labels(self.backend_url, str(status))
+        child.inc()
+
+
+_backend_metrics: Dict[str, BackendMetrics] = {}
+
+
+def backend_metrics(backend_url: str) -> BackendMetrics:
+    metrics = _backend_metrics.get(backend_url)
+    if metrics is None:
+        metrics = _backend_metrics[backend_url] = BackendMetrics(backend_url)
+    return metrics
+
+
+def forget_backend(backend_url: str) -> None:
+    """Removes the series of a backend that was removed, so they stop being exported."""
+    metrics = _backend_metrics.pop(backend_url, None)
+    if metrics is None:
+        return
+    for metric in (UPSTREAM_TTFB_SECONDS, STREAM_DURATION_SECONDS, UPSTREAM_REQUEST_BYTES,
+                   UPSTREAM_RESPONSE_BYTES, UPSTREAM_POOL_WAIT_SECONDS, UPSTREAM_CONNECT_SECONDS,
+                   BACKEND_POLL_SECONDS):
+        metric.remove(backend_url)
+    for connection in ("new", "reused"):
+        UPSTREAM_CONNECTIONS.remove(backend_url, connection)
+    for status in metrics._requests:
+        UPSTREAM_REQUESTS.remove(backend_url, str(status))
+
+
+def multiprocess_dir() -> Optional[str]:
+    """The directory prometheus_client shares metrics between processes in, or None if it is not enabled."""
+    # prometheus_client switches to multiprocess mode as soon as either variable exists, even if empty
+    for name in ("PROMETHEUS_MULTIPROC_DIR", "prometheus_multiproc_dir"):
+        if name in os.environ:
+            return os.environ[name]
+    return None
+
+
+def check_multiprocess(workers: int) -> None:
+    """
+    Checks the metrics setup at startup: raises if the multiprocess directory is set but unusable,
+    and warns if several workers run without it, as /metrics would then only show one of them.
+    """
+    path = multiprocess_dir()
+    if path is not None and not os.path.isdir(path):
+        raise RuntimeError(f"PROMETHEUS_MULTIPROC_DIR must be an existing directory: {path!r}")
+    if path is None and workers > 1:
+        logger.warning("PROXY_WORKERS=%d but PROMETHEUS_MULTIPROC_DIR is not set: each /metrics scrape "
+                       "only shows the worker that answered it. Set it to an empty directory to aggregate them.",
+                       workers)
+
+
+def render() -> bytes:
+    """
+    The Prometheus text exposition of all proxy metrics. With PROMETHEUS_MULTIPROC_DIR set
+    (multi-worker mode), the values of every worker process are aggregated.
+    """
+    if multiprocess_dir() is not None:
+        from prometheus_client import multiprocess
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry)
+    return generate_latest(REGISTRY)
+
+
+def collect_samples(metric, buckets: bool = True) -> Dict[str, Any]:
+    """
+    Flattens a metric into {sample_name{labels}: value}, for JSON endpoints such as /health.
+    With `buckets=False`, histogram buckets are left out and only _count / _sum remain.
+    """
+    result: Dict[str, Any] = {}
+    for family in metric.collect():
+        for sample in family.samples:
+            if sample.name.endswith("_created") or (not buckets and sample.name.endswith("_bucket")):
+                continue
+            labels = ",".join(f'{k}="{v}"' for k, v in sample.labels.items())
+            result[f"{sample.name}{{{labels}}}" if labels else sample.name] = sample.value
+    return result
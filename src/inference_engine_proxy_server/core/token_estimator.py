@@ -0,0 +1,190 @@
+"""
+請求 token 數估計 (token_aware 負載平衡策略與 context window 路由使用):
+以本地的 tiktoken 編碼器（啟動時在背景載入一次）近似估計 prompt 的 token 數，加上請求的 `max_tokens` 作為生成長度。
+最近出現過的 prompt / 訊息的結果保留在 LRU 中，多輪對話只需計算新增的訊息。
+大型 body 在執行緒池中估計，不阻塞 event loop；無法載入編碼器時改用字元數的粗略估計。
+"""
+
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Iterator, NamedTuple, Optional
+
+from fastapi import Request
+from starlette.concurrency import run_in_threadpool
+
+from .constants import (
+    TOKEN_ESTIMATOR_CACHE_SIZE,
+    TOKEN_ESTIMATOR_DEFAULT_MAX_TOKENS,
+    TOKEN_ESTIMATOR_ENCODING,
+    TOKEN_ESTIMATOR_THREAD_THRESHOLD_BYTES,
+)
+from .request_body import RequestBody
+from .request_parsing import load_json_body
+
+logger = logging.getLogger("token-estimator")
+
+# Chat formats add a few tokens around every message
+TOKENS_PER_MESSAGE = 4
+BYTES_PER_TOKEN = 4
+# Last path segment of the endpoints whose prompt and completion share the context window
+COMPLETION_ENDPOINTS = ("completions", "completion")
+
+_encodings: Dict[str, Any] = {}
+_encodings_lock = threading.Lock()
+
+
+class TokenEstimate(NamedTuple):
+    prompt_tokens: int
+    max_tokens: int
+    # Context window the request needs (prompt plus an explicit max_tokens); None when unknown,
+    # e.g. the body was not parsed, holds a batch of prompts or is not a completion request
+    context_tokens: Optional[int] = None
+
+
+def load_encoding(name: str):
+    """The tiktoken encoding `name`, loaded once per process."""
+    encoding = _encodings.get(name)
+    if encoding is None:
+        with _encodings_lock:
+            encoding = _encodings.get(name)
+            if encoding is None:
+                import tiktoken
+                encoding = _encodings[name] = tiktoken.get_encoding(name)
+    return encoding
+
+
+def approximate_tokens(text: str) -> int:
+    """Character heuristic: ~4 ASCII characters per token, one token per other character (CJK)."""
+    non_ascii = (len(text.encode("utf-8")) - len(text)) // 2
+    return (len(text) - non_ascii) // BYTES_PER_TOKEN + non_ascii + 1
+
+
+class TokenEstimator:
+    """Counts prompt tokens with an LRU of recent texts; safe to call from worker threads."""
+
+    def __init__(self, encoding_name: str = TOKEN_ESTIMATOR_ENCODING, cache_size: int = TOKEN_ESTIMATOR_CACHE_SIZE,
+                 default_max_tokens: int = TOKEN_ESTIMATOR_DEFAULT_MAX_TOKENS) -> None:
+        self.encoding_name = encoding_name
+        self.cache_size = cache_size
+        self.default_max_tokens = default_max_tokens
+        self._encoding = None
+        self._loading = False
+        self._cache: "OrderedDict[tuple, int]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def load(self) -> None:
+        """Loads the encoder (blocking; tiktoken may download it once). Until then the heuristic is used."""
+        try:
+            self._encoding = load_encoding(self.encoding_name)
+            logger.info("Token estimation uses the %s encoding.", self.encoding_name)
+        except Exception as e:
+            logger.warning("Cannot load the %s encoding (%r); token estimation uses a character heuristic.",
+                           self.encoding_name, e)
+
+    def start_loading(self) -> None:
+        """Loads the encoder in a background thread, once."""
+        if self._encoding is None and not self._loading:
+            self._loading = True
+            threading.Thread(target=self.load, name="token-encoder-load", daemon=True).start()
+
+    def count(self, text: str) -> int:
+        key = (len(text), hash(text))
+        with self._lock:
+            tokens = self._cache.get(key)
+            if tokens is not None:
+                self._cache.move_to_end(key)
+                return tokens
+        if self._encoding is not None:
+            tokens = len(self._encoding.encode_ordinary(text))
+        else:
+            tokens = approximate_tokens(text)
+        with self._lock:
+            self._cache[key] = tokens
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return tokens
+
+    def _count_value(self, value: Any) -> int:
+        """Tokens of a prompt / input value: a string, token ids, or a list of either."""
+        if isinstance(value, str):
+            return self.count(value)
+        if isinstance(value, list):
+            if value and isinstance(value[0], int):
+                return len(value)
+            return sum(self._count_value(item) for item in value)
+        return 0
+
+    def _message_texts(self, messages: list) -> Iterator[str]:
+        for message in messages:
+            if not isinstance(message, dict):
+                continue
+            content = message.get("content")
+            if isinstance(content, str):
+                yield content
+            elif isinstance(content, list):
+                for part in content:
+                    if isinstance(part, dict) and isinstance(part.get("text"), str):
+                        yield part["text"]
+
+    def estimate_data(self, path: str, data: Dict[str, Any]) -> TokenEstimate:
+        messages = data.get("messages")
+        prompt = data.get("prompt", data.get("input"))
+        if isinstance(messages, list):
+            prompt_tokens = sum(self.count(text) for text in self._message_texts(messages))
+            prompt_tokens += TOKENS_PER_MESSAGE * len(messages)
+        else:
+            prompt_tokens = self._count_value(prompt)
+
+        path = path.strip("/")
+        if path.endswith("embeddings"):
+            return TokenEstimate(prompt_tokens, 0)
+        requested = data.get("max_tokens") or data.get("max_completion_tokens") or data.get("n_predict")
+        if not isinstance(requested, int) or requested <= 0:
+            requested = None
+        max_tokens = requested or self.default_max_tokens
+        n = data.get("n")
+        if isinstance(n, int) and n > 1:
+            max_tokens *= n
+
+        # Only a single conversation or prompt has to fit in the context window as a whole
+        context_tokens = None
+        single_prompt = isinstance(prompt, str) or (isinstance(prompt, list) and prompt and isinstance(prompt[0], int))
+        if path.split("/")[-1] in COMPLETION_ENDPOINTS and (isinstance(messages, list) or single_prompt):
+            context_tokens = prompt_tokens + (requested or 0)
+        return TokenEstimate(prompt_tokens, max_tokens, context_tokens)
+
+    def estimate_body(self, path: str, body: bytes) -> TokenEstimate:
+        data = load_json_body(body)
+        if data is None:
+            return TokenEstimate(len(body) // BYTES_PER_TOKEN, self.default_max_tokens)
+        return self.estimate_data(path, data)
+
+    async def estimate(self, path: str, request: Request, body: Optional[RequestBody]) -> TokenEstimate:
+        """
+        Estimates the tokens of a proxied request. Bodies that were streamed or spilled to disk are
+        not parsed; their size gives the estimate, without `context_tokens`. Large in-memory bodies are
+        parsed in the thread pool. The encoder is loaded at startup (`start_loading`), never from here.
+        """
+        if body is None or not body.in_memory:
+            if body is not None:
+                size = body.size
+            else:
+                try:
+                    size = int(request.headers.get("content-length") or 0)
+                except ValueError:
+                    size = 0
+            return TokenEstimate(size // BYTES_PER_TOKEN, self.default_max_tokens)
+        if body.size > TOKEN_ESTIMATOR_THREAD_THRESHOLD_BYTES:
+            return await run_in_threadpool(self.estimate_body, path, body.data)
+        return self.estimate_body(path, body.data)
+
+
+_estimator: Optional[TokenEstimator] = None
+
+
+def get_token_estimator() -> TokenEstimator:
+    global _estimator
+    if _estimator is None:
+        _estimator = TokenEstimator()
+    return _estimator
@@ -1,6 +1,12 @@
+import hmac
 import logging
+import math
+import os
 import time
+from typing import Optional
 from fastapi import FastAPI, Request, Response
+from prometheus_client import CONTENT_TYPE_LATEST
+from fastapi.responses import JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 
 # -------------------- 基本設定 --------------------
@@ -9,9 +15,31 @@ logger = logging.getLogger("proxy-server")
 
 
 # -------------------- 工具函式 --------------------
-from .core.constants import BACKENDS
-from .core.functions import choose_backend, get_all_metrics_from_cache
+from .core.constants import (
+    BACKENDS, PREFIX_AFFINITY_ENABLED, METRICS_CACHE_TTL_SECONDS, RETRY_MAX_ATTEMPTS,
+    ADMISSION_QUEUE_MAX_DEPTH, MODEL_ROUTING_ENABLED, MODEL_ROUTING_FALLBACK, REQUEST_BODY_STREAMING_ENABLED,
+    RESPONSE_CACHE_ENABLED, ADMIN_API_KEY, RATE_LIMIT_ENABLED, EMBEDDINGS_BATCHING_ENABLED, HEDGING_ENABLED,
+)
+from .core.functions import choose_backend, get_all_metrics_from_cache, mark_backend_unready
+from .backends.base import BackendUnavailableError
 from .core.http_client import lifespan
+from .core.affinity import get_affinity_key
+from .core.admission import (
+    get_admission_queue, get_class_max_load, get_class_priority, get_priority_class, get_priority_classes,
+    get_queue_depth, get_request_priority,
+)
+from .core.models import extract_model, get_model_pool, has_multiple_pools, list_models
+from .core.context_window import exceeds_pool, has_context_windows
+from .core import registry
+from .core.request_body import RequestBody, has_body, is_small_body
+from .core.response_cache import get_response_cache, is_cacheable_path, request_key
+from .core.rate_limit import RateLimitExceeded, get_rate_limiter, get_tenant_key
+from .core.embeddings_batcher import get_embeddings_batcher, is_batchable_path
+from .core.hedging import forward_hedged, is_hedgeable
+from .core.strategies import get_strategy
+from .core.token_estimator import get_token_estimator
+from .core import telemetry
+from .core.shared_state import get_shared_state
 
 
 # -------------------- FastAPI --------------------
@@ -37,24 +65,298 @@ async def health():
     ready_backends = [status['backend'] for status in backend_statuses if status['ready']]
     
     proxy_status = "ok" if ready_backends else "degraded"
+
+    extra = {}
+    shared = get_shared_state()
+    if shared is not None:
+        # 多 worker 模式：標示回應此請求的 worker（等待佇列為各 worker 各自的佇列）
+        extra["worker"] = {"pid": os.getpid(), "role": "leader" if shared.is_leader else "follower"}
+    if RESPONSE_CACHE_ENABLED:
+        extra["response_cache"] = get_response_cache().stats()
+    if RATE_LIMIT_ENABLED:
+        extra["rate_limit"] = {
+            "tenants": len(get_rate_limiter()),
+            "rejected": telemetry.collect_samples(telemetry.RATE_LIMITED_REQUESTS),
+        }
     
     return {
         "status": proxy_status,
         "available_backends": ready_backends,
         "total_backends": len(BACKENDS),
+        "inflight_requests": sum(status['inflight'] for status in backend_statuses),
         "timestamp": time.time(),
+        "admission": {
+            "queue_depth": get_queue_depth(),
+            "max_depth": ADMISSION_QUEUE_MAX_DEPTH,
+            "requests": telemetry.collect_samples(telemetry.ADMISSION_REQUESTS),
+            "wait_seconds": telemetry.collect_samples(telemetry.ADMISSION_WAIT_SECONDS),
+            "classes": get_priority_classes(),
+            "class_requests": telemetry.collect_samples(telemetry.PRIORITY_CLASS_REQUESTS),
+            "class_wait_seconds": telemetry.collect_samples(telemetry.PRIORITY_CLASS_WAIT_SECONDS, buckets=False),
+        },
+        "upstream": {
+            "connections": telemetry.collect_samples(telemetry.UPSTREAM_CONNECTIONS),
+            "pool_wait_seconds": telemetry.collect_samples(telemetry.UPSTREAM_POOL_WAIT_SECONDS, buckets=False),
+        },
+        **extra,
         "details": backend_statuses
     }
 
 
+@app.get("/metrics")
+async def metrics():
+    """Prometheus metrics of the proxy itself; the backends' own metrics stay on their /metrics."""
+    return Response(telemetry.render(), media_type=CONTENT_TYPE_LATEST)
+
+
+def admin_error(message: str, status_code: int) -> JSONResponse:
+    return JSONResponse({"error": {"message": message, "type": "invalid_request_error"}}, status_code=status_code)
+
+
+def check_admin(request: Request, changes: bool = False) -> Optional[JSONResponse]:
+    """The error response for a request the admin API must refuse, or None if it is allowed."""
+    if not ADMIN_API_KEY:
+        return admin_error("The admin API is disabled; set ADMIN_API_KEY to enable it.", 404)
+    auth = request.headers.get("authorization", "")
+    if not auth.lower().startswith("bearer ") or not hmac.compare_digest(auth[7:].strip(), ADMIN_API_KEY):
+        return admin_error("Invalid admin API key.", 401)
+    if changes and get_shared_state() is not None:
+        # 多 worker 模式下請求只會到達其中一個 worker，各 worker 的後端清單會不一致
+        return admin_error("Backends cannot be changed through one worker in multi-worker mode; use BACKENDS_FILE.", 409)
+    return None
+
+
+@app.get("/admin/backends")
+async def admin_list_backends(request: Request):
+    """Configured backends with their weight, state (active / draining / removing) and load."""
+    denied = check_admin(request)
+    if denied is not None:
+        return denied
+    return {"backends": registry.list_backends()}
+
+
+@app.put("/admin/backends")
+async def admin_set_backend(request: Request):
+    """Adds a backend or updates it: {"url": ..., "weight": 2, "drain": true}."""
+    denied = check_admin(request, changes=True)
+    if denied is not None:
+        return denied
+    try:
+        data = await request.json()
+        if not isinstance(data, dict):
+            raise ValueError("expected a JSON object")
+        drain = data.get("drain")
+        if drain is not None and not isinstance(drain, bool):
+            raise ValueError("drain must be true or false")
+        added = registry.set_backend(data.get("url"), data.get("weight"), drain)
+    except ValueError as e:
+        return admin_error(str(e), 400)
+    return JSONResponse({"added": added, "backends": registry.list_backends()}, status_code=201 if added else 200)
+
+
+@app.delete("/admin/backends")
+async def admin_remove_backend(request: Request, url: str):
+    """Removes a backend (`?url=...`); its in-flight requests finish before its pool is closed."""
+    denied = check_admin(request, changes=True)
+    if denied is not None:
+        return denied
+    if not registry.remove_backend(url.strip()):
+        return admin_error(f"Unknown backend: {url}", 404)
+    return {"removed": url.strip(), "backends": registry.list_backends()}
+
+
 @app.get("/")
 async def read_root():
     return {"message": "Welcome to vLLM/llama.cpp inference engine proxy server!"}
 
 
+def model_not_found(model: str) -> JSONResponse:
+    """OpenAI-style error for a model no backend serves."""
+    return JSONResponse(
+        {
+            "error": {
+                "message": f"The model `{model}` does not exist.",
+                "type": "invalid_request_error",
+                "param": "model",
+                "code": "model_not_found",
+            }
+        },
+        status_code=404,
+    )
+
+
+def context_length_exceeded(context_window: int, requested_tokens: int, path: str) -> JSONResponse:
+    """OpenAI-style error for a request that fits in the context window of no backend."""
+    param = "messages" if path.endswith("chat/completions") else "prompt"
+    return JSONResponse(
+        {
+            "error": {
+                "message": f"This model's maximum context length is {context_window} tokens. However, you requested "
+                           f"about {requested_tokens} tokens (estimated). Please reduce the length of the "
+                           f"{param} or completion.",
+                "type": "invalid_request_error",
+                "param": param,
+                "code": "context_length_exceeded",
+            }
+        },
+        status_code=400,
+    )
+
+
+def rate_limit_exceeded(e: RateLimitExceeded) -> JSONResponse:
+    """OpenAI-style error for a caller over one of its rate limits."""
+    return JSONResponse(
+        {
+            "error": {
+                "message": str(e),
+                "type": e.limit,
+                "param": None,
+                "code": "rate_limit_exceeded",
+            }
+        },
+        status_code=429,
+        headers={"Retry-After": str(max(1, math.ceil(e.retry_after)))},
+    )
+
+
+@app.get("/v1/models")
+async def models():
+    """Merged model list of all backends, answered from the cache."""
+    return {"object": "list", "data": list_models()}
+
+
+@app.get("/v1/models/{model_id:path}")
+async def retrieve_model(model_id: str):
+    for entry in list_models():
+        if entry["id"] == model_id:
+            return entry
+    return model_not_found(model_id)
+
+
 @app.api_route("/{full_path:path}", methods=["GET", "POST", "PUT", "DELETE", "PATCH", "OPTIONS", "HEAD"])
 async def proxy(full_path: str, request: Request):
-    backend = await choose_backend()
+    # 限流在讀取 body、挑選後端之前檢查，超過限制的呼叫端不會佔用任何後端 slot
+    tenant = None
+    if RATE_LIMIT_ENABLED:
+        try:
+            tenant = get_rate_limiter().acquire(get_tenant_key(request.headers))
+        except RateLimitExceeded as e:
+            return rate_limit_exceeded(e)
+
+    # 只有需要檢查內容（多模型路由、前綴親和性、回應快取、embeddings 合併）或可完整重送的小型 body 才先緩衝，
+    # 之後進入等待佇列時不會再被 I/O 打斷；其餘的 body 在選定後端後直接串流過去
+    inspect = request.method == "POST" and (
+        PREFIX_AFFINITY_ENABLED or (MODEL_ROUTING_ENABLED and has_multiple_pools())
+        or (RESPONSE_CACHE_ENABLED and is_cacheable_path(full_path))
+        or (EMBEDDINGS_BATCHING_ENABLED and is_batchable_path(full_path))
+    )
+    body = None
+    try:
+        if not has_body(request):
+            body = RequestBody()
+        elif inspect or is_small_body(request) or not REQUEST_BODY_STREAMING_ENABLED:
+            body = await RequestBody.read(request)
+        response = await _route(full_path, request, body)
+    except BaseException:
+        if tenant is not None:
+            get_rate_limiter().release(tenant)
+        raise
+    finally:
+        if body is not None:
+            body.close()
+    # 串流回應在串流結束時才釋放，並依 usage 或事件數扣除 token 額度
+    return get_rate_limiter().meter(tenant, response) if tenant is not None else response
+
+
+async def _route(full_path: str, request: Request, body: Optional[RequestBody]) -> Response:
+    # 依 body 中的 "model" 欄位，只在提供該模型的後端之間挑選
+    model = requested_model = None
+    if MODEL_ROUTING_ENABLED and request.method == "POST" and body is not None:
+        model = requested_model = extract_model(body.view())
+        if model is not None and not get_model_pool(model):
+            # 只有一個後端池時照常轉發（llama.cpp 會忽略模型名稱，客戶端常送 "gpt-4" 之類的名稱）
+            if not MODEL_ROUTING_FALLBACK and has_multiple_pools():
+                return model_not_found(model)
+            model = None
+
+    forward = lambda: _forward(full_path, request, body, model)
+    # 同時到達、參數相同的 embeddings 請求合併成一個上游請求，回應再拆回各請求
+    if EMBEDDINGS_BATCHING_ENABLED and request.method == "POST" and body is not None and is_batchable_path(full_path):
+        forward = lambda: get_embeddings_batcher().submit(
+            request, body, lambda batch_body: _forward(full_path, request, batch_body, model)
+        )
+
+    # 結果可重現的請求先查回應快取，相同的請求同時到達時只送一次到後端
+    if RESPONSE_CACHE_ENABLED and body is not None:
+        cache_key = request_key(full_path, request, body, requested_model)
+        if cache_key is not None:
+            return await get_response_cache().fetch(cache_key, forward, request.headers.get("cache-control", ""))
+    return await forward()
+
+
+async def _forward(full_path: str, request: Request, body: Optional[RequestBody], model: Optional[str]) -> Response:
+    started = time.monotonic()
+    # 優先權類別決定在等待佇列中的順序，以及可使用的後端負載上限（批次類別為互動請求保留空位）
+    priority_class = get_priority_class(full_path, request.headers)
+    max_load = get_class_max_load(priority_class)
+
+    affinity_key = None
+    # 已寫入暫存檔的大型 body 不解析 JSON，改由負載平衡策略挑選
+    if PREFIX_AFFINITY_ENABLED and request.method == "POST" and body is not None and body.in_memory:
+        affinity_key = get_affinity_key(full_path, body.data)
+
+    # token_aware 策略依 prompt 與生成長度的估計值衡量各後端的負載；
+    # context window 路由依同一個估計值排除放不下請求的後端，整個後端池都放不下時直接拒絕
+    tokens = None
+    if request.method == "POST" and (get_strategy().uses_tokens or has_context_windows()):
+        tokens = await get_token_estimator().estimate(full_path, request, body)
+        context_window = exceeds_pool(get_model_pool(model) if model is not None else BACKENDS, tokens)
+        if context_window is not None:
+            return context_length_exceeded(context_window, tokens.context_tokens, full_path.strip("/"))
+
+    # 所有後端都滿載時，在佇列中等待空位，而非立即回傳 503
+    queued = time.monotonic()
+    backend = await get_admission_queue(model).admit(
+        lambda: choose_backend(affinity_key, model=model, tokens=tokens, max_load=max_load),
+        priority=get_class_priority(priority_class) + get_request_priority(request.headers),
+    )
     if not backend:
-        return Response("No backend available", status_code=503)
-    return await backend.forward_request(request, full_path)
\ No newline at end of file
+        telemetry.PRIORITY_CLASS_REQUESTS.labels(priority_class, "unavailable").inc()
+        return Response(
+            "No backend available",
+            status_code=503,
+            headers={"Retry-After": str(math.ceil(METRICS_CACHE_TTL_SECONDS))},
+        )
+
+    telemetry.PRIORITY_CLASS_REQUESTS.labels(priority_class, "admitted").inc()
+    telemetry.PRIORITY_CLASS_WAIT_SECONDS.labels(priority_class).observe(time.monotonic() - queued)
+
+    # 短的非串流請求回應太慢時，同時送一份到下一個最佳後端，先完成者勝出
+    hedge = HEDGING_ENABLED and is_hedgeable(full_path, request, body)
+
+    # 失敗時以已緩衝的 body 改送下一個最佳後端，並排除已失敗的節點
+    failed = set()
+    for attempt in range(1, RETRY_MAX_ATTEMPTS + 1):
+        try:
+            if hedge and attempt == 1:
+                response = await forward_hedged(
+                    backend, request, full_path,
+                    lambda exclude: choose_backend(affinity_key, exclude=exclude, model=model, tokens=tokens,
+                                                   max_load=max_load),
+                    failed, allow_failover=attempt < RETRY_MAX_ATTEMPTS, body=body, tokens=tokens,
+                )
+            else:
+                response = await backend.forward_request(
+                    request, full_path, allow_failover=attempt < RETRY_MAX_ATTEMPTS, body=body, tokens=tokens
+                )
+            telemetry.PRIORITY_CLASS_RESPONSE_SECONDS.labels(priority_class).observe(time.monotonic() - started)
+            return response
+        except BackendUnavailableError as e:
+            failed.add(e.backend_url)
+            mark_backend_unready(e.backend_url)
+            next_backend = await choose_backend(affinity_key, exclude=failed, model=model, tokens=tokens,
+                                                max_load=max_load)
+            if next_backend is None:
+                return e.response
+            logger.warning("Retrying request on %s after %s (attempt %d)", next_backend.backend_url, e, attempt + 1)
+            backend = next_backend
\ No newline at end of file
@@ -6,7 +6,7 @@ import importlib.util
 from urllib.parse import urljoin
 from rich import print as rprint
 
-__all__ = ["a_get_model_name", "a_check_provider"]
+__all__ = ["a_get_models", "a_get_model_name", "a_check_provider"]
 
 def check_required_packages(*package_names: str) -> None:
     """Check if required Python packages are installed.
@@ -121,6 +121,18 @@ def print_detail(context, title: str = "", padding: str = "=", start_index: Opti
 
 # ==================== LLM API ====================
 
+async def a_get_models(base_url: str) -> list:
+    """Returns the `data` entries of `/v1/models` (each has at least `id` and `owned_by`)."""
+    url = urljoin(base_url, "/v1/models")
+    from ..core.http_client import get_client
+    client = get_client()
+    r = await client.get(url)
+    r.raise_for_status()
+    data = r.json()["data"]
+    if not data:
+        raise ValueError(f"no models served at {base_url}")
+    return data
+
 async def a_get_model_name(base_url: str, index: int = 0) -> str:
     url = urljoin(base_url, "/v1/models")
     from ..core.http_client import get_client   # 使用全域的 httpx.AsyncClient 實例，避免每次請求都創建新的連接
@@ -0,0 +1,115 @@
+import os
+import sys
+import time
+from types import SimpleNamespace
+
+import pytest
+
+# constants.py requires BACKENDS; the tests never talk to them.
+os.environ.setdefault("BACKENDS", "http://b1:8080,http://b2:8080")
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+
+class FakeClock:
+    """Stands in for the `time` module of code that only reads `time.monotonic()`."""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+@pytest.fixture
+def fake_clock():
+    return FakeClock()
+
+
+def _make_request(chunks=(), method="POST", path="/v1/chat/completions", headers=None):
+    from starlette.requests import Request
+
+    if isinstance(chunks, bytes):
+        chunks = [chunks]
+    messages = [{"type": "http.request", "body": chunk, "more_body": True} for chunk in chunks]
+    messages.append({"type": "http.request", "body": b"", "more_body": False})
+
+    async def receive():
+        return messages.pop(0) if messages else {"type": "http.disconnect"}
+
+    scope = {
+        "type": "http", "method": method, "path": path, "query_string": b"", "scheme": "http",
+        "server": ("proxy", 80), "client": ("client", 1234), "root_path": "", "http_version": "1.1",
+        "headers": [(k.lower().encode(), v.encode()) for k, v in (headers or {}).items()],
+    }
+    return Request(scope, receive)
+
+
+@pytest.fixture
+def make_request():
+    """Builds a Starlette request whose body arrives in the given chunks."""
+    return _make_request
+
+
+@pytest.fixture
+def backends():
+    """
+    Replaces the configured backends with ready ones of the given loads (None: not ready) and
+    context windows, routed by `strategy`; restores them afterwards.
+    """
+    from inference_engine_proxy_server.core import backend_state, strategies
+    from inference_engine_proxy_server.core.constants import BACKENDS
+
+    saved_backends, saved_strategy = BACKENDS[:], strategies._strategy
+    saved_states = dict(backend_state._STATES)
+    saved_windows = dict(backend_state._context_windows)
+
+    def populate(loads, strategy, windows=None):
+        for backend_url in list(backend_state._STATES):
+            backend_state.remove_state(backend_url)
+        strategies._strategy = strategies.create_strategy(strategy)
+        urls = [f"http://select-{i}:8080" for i in range(len(loads))]
+        BACKENDS[:] = urls
+        for i, (backend_url, load) in enumerate(zip(urls, loads)):
+            state = backend_state.ensure_state(backend_url)
+            state.set_static({"provider": "vllm", "model_name": "a", "models": [{"id": "a"}],
+                              "context_window": windows[i] if windows else None})
+            state.set_dynamic({"timestamp": time.time() + 3600, "requests_processing": load,
+                               "inflight_at_poll": 0, "ready": load is not None})
+        return urls
+
+    yield populate
+    for backend_url in list(backend_state._STATES):
+        backend_state.remove_state(backend_url)
+    backend_state._STATES.update(saved_states)
+    backend_state._context_windows.clear()
+    backend_state._context_windows.update(saved_windows)
+    BACKENDS[:] = saved_backends
+    strategies._strategy = saved_strategy
+    backend_state.refresh_all()
+
+
+@pytest.fixture
+def stub_backends(monkeypatch):
+    """
+    Sends the proxied requests of every backend to `route(handler)`, an httpx.MockTransport handler,
+    and keeps what is reported to the circuit breaker in `records`. `backend(url)` is a BaseBackend for `url`.
+    """
+    import httpx
+    from inference_engine_proxy_server.backends import base
+    from inference_engine_proxy_server.core import circuit_breaker
+
+    class StubBackend(base.BaseBackend):
+        async def fetch_health(self):
+            return True
+
+        async def fetch_metrics(self):
+            return None, True
+
+    records = []
+    monkeypatch.setattr(circuit_breaker, "record", lambda url, started, ok, ttft=None: records.append(ok))
+
+    def route(handler):
+        client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        monkeypatch.setattr(base, "get_backend_client", lambda url: client)
+
+    return SimpleNamespace(backend=StubBackend, route=route, records=records)
@@ -0,0 +1,89 @@
+import asyncio
+
+from inference_engine_proxy_server.core.admission import AdmissionQueue
+
+
+class _Slots:
+    """Backend capacity shared by the waiters of a test; `take(fits)` is a `try_acquire`."""
+
+    def __init__(self, free=0):
+        self.free = free
+        self.tries = []
+
+    def take(self, name, fits=True):
+        async def try_acquire():
+            self.tries.append(name)
+            if fits and self.free > 0:
+                self.free -= 1
+                return name
+            return None
+        return try_acquire
+
+
+def test_higher_priority_waiter_is_admitted_first():
+    async def main():
+        queue = AdmissionQueue(max_depth=10, max_wait_seconds=5)
+        slots = _Slots()
+        low = asyncio.create_task(queue.admit(slots.take("low"), priority=0))
+        await asyncio.sleep(0)
+        high = asyncio.create_task(queue.admit(slots.take("high"), priority=10))
+        await asyncio.sleep(0)
+
+        slots.free = 1
+        queue.notify()
+        assert await high == "high"
+        assert not low.done()
+        slots.free = 1
+        queue.notify()
+        assert await low == "low"
+        assert queue.depth == 0
+
+    asyncio.run(main())
+
+
+def test_head_that_cannot_be_admitted_passes_the_turn():
+    async def main():
+        queue = AdmissionQueue(max_depth=10, max_wait_seconds=0.5)
+        slots = _Slots()
+        # e.g. a batch request held back by its class watermark, queued ahead by priority
+        blocked = asyncio.create_task(queue.admit(slots.take("blocked", fits=False), priority=10))
+        await asyncio.sleep(0)
+        other = asyncio.create_task(queue.admit(slots.take("other"), priority=0))
+        await asyncio.sleep(0)
+
+        slots.free = 1
+        queue.notify()
+        assert await asyncio.wait_for(other, 0.2) == "other"
+        assert await blocked is None   # timed out, never admitted
+        assert queue.depth == 0
+
+    asyncio.run(main())
+
+
+def test_full_queue_rejects_and_wait_times_out():
+    async def main():
+        queue = AdmissionQueue(max_depth=1, max_wait_seconds=0.05)
+        slots = _Slots()
+        first = asyncio.create_task(queue.admit(slots.take("first")))
+        await asyncio.sleep(0)
+        assert await queue.admit(slots.take("second")) is None
+        assert await first is None
+        assert queue.depth == 0
+
+    asyncio.run(main())
+
+
+def test_cancelled_head_wakes_the_next_waiter():
+    async def main():
+        queue = AdmissionQueue(max_depth=10, max_wait_seconds=5)
+        slots = _Slots()
+        head = asyncio.create_task(queue.admit(slots.take("head"), priority=1))
+        await asyncio.sleep(0)
+        nxt = asyncio.create_task(queue.admit(slots.take("next")))
+        await asyncio.sleep(0)
+
+        slots.free = 1
+        head.cancel()
+        assert await asyncio.wait_for(nxt, 0.2) == "next"
+
+    asyncio.run(main())
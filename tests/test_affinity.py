@@ -0,0 +1,61 @@
+import json
+
+from inference_engine_proxy_server.core.affinity import ConsistentHashRing, get_affinity_key, select_by_affinity
+
+BACKENDS = [f"http://affinity-{i}:8080" for i in range(4)]
+KEYS = [get_affinity_key("v1/completions", json.dumps({"prompt": f"prompt {i}"}).encode()) for i in range(2000)]
+
+
+def _owners(ring):
+    return [next(ring.walk(key)) for key in KEYS]
+
+
+def test_later_turns_of_a_conversation_keep_their_key():
+    first = [{"role": "system", "content": "You are helpful."}, {"role": "user", "content": "Hi"}]
+    later = first + [{"role": "assistant", "content": "Hello!"}, {"role": "user", "content": "More"}]
+    key = get_affinity_key("v1/chat/completions", json.dumps({"messages": first}).encode())
+    assert key is not None
+    assert get_affinity_key("/v1/chat/completions/", json.dumps({"messages": later, "seed": 1}).encode()) == key
+    other = [{"role": "system", "content": "You are terse."}, {"role": "user", "content": "Hi"}]
+    assert get_affinity_key("v1/chat/completions", json.dumps({"messages": other}).encode()) != key
+
+
+def test_requests_without_a_prompt_have_no_key():
+    assert get_affinity_key("v1/embeddings", b'{"input": "x"}') is None
+    assert get_affinity_key("v1/completions", b'{"prompt": ""}') is None
+    assert get_affinity_key("v1/completions", b"not json") is None
+
+
+def test_ring_is_deterministic_and_balanced():
+    owners = _owners(ConsistentHashRing(BACKENDS))
+    assert owners == _owners(ConsistentHashRing(list(reversed(BACKENDS))))
+    shares = [owners.count(url) / len(KEYS) for url in BACKENDS]
+    assert min(shares) > 0.1 and max(shares) < 0.4
+
+
+def test_adding_a_backend_moves_only_keys_to_it():
+    before = _owners(ConsistentHashRing(BACKENDS))
+    added = "http://affinity-new:8080"
+    after = _owners(ConsistentHashRing(BACKENDS + [added]))
+    moved = [(old, new) for old, new in zip(before, after) if old != new]
+    assert all(new == added for _, new in moved)
+    assert 0.1 < len(moved) / len(KEYS) < 0.3   # about 1/5
+
+
+def test_removing_a_backend_moves_only_its_keys():
+    before = _owners(ConsistentHashRing(BACKENDS))
+    after = _owners(ConsistentHashRing(BACKENDS[1:]))
+    assert all(old == new for old, new in zip(before, after) if old != BACKENDS[0])
+    assert BACKENDS[0] not in after
+
+
+def test_bounded_load_walks_past_busy_owner():
+    key = KEYS[0]
+    owner, second = list(ConsistentHashRing(BACKENDS).walk(key))[:2]
+    idle = [(url, 0.0) for url in BACKENDS]
+    assert select_by_affinity(key, idle, BACKENDS) == owner
+
+    busy = [(url, 8.0 if url == owner else 0.0) for url in BACKENDS]
+    assert select_by_affinity(key, busy, BACKENDS) == second
+    # An owner that is not ready leaves the choice to the load balancing strategy
+    assert select_by_affinity(key, [c for c in idle if c[0] != owner], BACKENDS) is None
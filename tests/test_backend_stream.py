@@ -0,0 +1,148 @@
+import asyncio
+
+import httpx
+import pytest
+
+from inference_engine_proxy_server.backends import base
+from inference_engine_proxy_server.core import inflight
+from inference_engine_proxy_server.core.request_body import RequestBody
+
+URL = "http://stream-test:8080"
+
+
+class _Upstream(httpx.AsyncByteStream):
+    """An SSE body that sends `chunks`, then ends, raises `error` or, with `hang`, waits until closed."""
+
+    def __init__(self, chunks, hang=True, error=None):
+        self.chunks = chunks
+        self.hang = hang
+        self.error = error
+        self.closed = False
+
+    async def __aiter__(self):
+        for chunk in self.chunks:
+            yield chunk
+        if self.error is not None:
+            raise self.error
+        if self.hang:
+            await asyncio.Event().wait()
+
+    async def aclose(self):
+        self.closed = True
+
+
+def _setup(stubs, upstream=None, handler=None):
+    if handler is None:
+        def handler(request):
+            return httpx.Response(200, headers={"content-type": "text/event-stream"}, stream=upstream)
+
+    stubs.route(handler)
+    return stubs.records
+
+
+def _forward(stubs, request, allow_failover=True):
+    return stubs.backend(URL).forward_request(
+        request, "v1/chat/completions", allow_failover=allow_failover, body=RequestBody(b"{}"))
+
+
+def test_stream_closed_before_iterating_releases_backend(stub_backends, make_request):
+    async def main():
+        upstream = _Upstream([b"data: 1\n\n"])
+        records = _setup(stub_backends, upstream)
+        response = await _forward(stub_backends, make_request(), allow_failover=False)
+        assert inflight.get_inflight(URL) == 1
+        await response.body_iterator.aclose()   # the client left before the first write
+        assert inflight.get_inflight(URL) == 0
+        assert upstream.closed
+        assert records == [None]
+
+    asyncio.run(main())
+
+
+def test_cancelled_first_chunk_prefetch_releases_backend(stub_backends, make_request):
+    async def main():
+        upstream = _Upstream([])
+        records = _setup(stub_backends, upstream)
+        forwarding = asyncio.create_task(_forward(stub_backends, make_request()))
+        await asyncio.sleep(0.05)
+        forwarding.cancel()
+        try:
+            await forwarding
+        except asyncio.CancelledError:
+            pass
+        assert inflight.get_inflight(URL) == 0
+        assert upstream.closed
+        assert records == [None]
+
+    asyncio.run(main())
+
+
+def test_finished_stream_reports_success_once(stub_backends, make_request):
+    async def main():
+        chunks = [b"data: 1\n\n", b"data: [DONE]\n\n"]
+        records = _setup(stub_backends, _Upstream(chunks, hang=False))
+        response = await _forward(stub_backends, make_request(), allow_failover=False)
+        received = b"".join([chunk async for chunk in response.body_iterator])
+        await response.body_iterator.aclose()
+        assert received == b"".join(chunks)
+        assert records == [True]
+        assert inflight.get_inflight(URL) == 0
+
+    asyncio.run(main())
+
+
+def test_connect_error_fails_over(stub_backends, make_request):
+    async def main():
+        def refuse(request):
+            raise httpx.ConnectError("connection refused")
+
+        records = _setup(stub_backends, handler=refuse)
+        with pytest.raises(base.BackendUnavailableError) as raised:
+            await _forward(stub_backends, make_request())
+        assert raised.value.backend_url == URL
+        assert raised.value.response.status_code == 503
+        # The last attempt answers the client instead
+        assert (await _forward(stub_backends, make_request(), allow_failover=False)).status_code == 503
+        assert records == [False, False]
+        assert inflight.get_inflight(URL) == 0
+
+    asyncio.run(main())
+
+
+def test_retry_status_fails_over_with_the_backends_answer(stub_backends, make_request):
+    async def main():
+        records = _setup(stub_backends, handler=lambda request: httpx.Response(503, content=b"overloaded"))
+        with pytest.raises(base.BackendUnavailableError) as raised:
+            await _forward(stub_backends, make_request())
+        assert raised.value.response.status_code == 503
+        assert raised.value.response.body == b"overloaded"
+        assert records == [False]
+        assert inflight.get_inflight(URL) == 0
+
+    asyncio.run(main())
+
+
+def test_stream_dying_before_the_first_chunk_fails_over(stub_backends, make_request):
+    async def main():
+        upstream = _Upstream([], error=httpx.ReadError("connection reset"))
+        records = _setup(stub_backends, upstream)
+        with pytest.raises(base.BackendUnavailableError):
+            await _forward(stub_backends, make_request())
+        assert upstream.closed
+        assert records == [False]
+        assert inflight.get_inflight(URL) == 0
+
+    asyncio.run(main())
+
+
+def test_stream_dying_after_the_first_chunk_does_not_fail_over(stub_backends, make_request):
+    async def main():
+        upstream = _Upstream([b"data: 1\n\n"], error=httpx.ReadError("connection reset"))
+        records = _setup(stub_backends, upstream)
+        response = await _forward(stub_backends, make_request())
+        received = [chunk async for chunk in response.body_iterator]
+        assert received == [b"data: 1\n\n"]   # the client already has a byte; the stream just ends
+        assert records == [False]
+        assert inflight.get_inflight(URL) == 0
+
+    asyncio.run(main())
@@ -0,0 +1,44 @@
+import asyncio
+
+from inference_engine_proxy_server.core import backend_state, cache_refresher
+from inference_engine_proxy_server.core.metrics_scraper import MetricsSnapshot
+
+URL = "http://refresher-test:8080"
+
+
+def test_static_info_is_refetched_once_after_an_outage(monkeypatch):
+    async def main():
+        static_calls = []
+        polls = iter([True, False, False, False, True, True, True])
+        done = asyncio.Event()
+
+        async def fetch_static_info(backend_url, force=False):
+            static_calls.append(force)
+            backend_state.ensure_state(backend_url).static = {"provider": "vllm"}
+            return True
+
+        async def fetch_backend_metrics(backend_url, provider):
+            ready = next(polls, None)
+            if ready is None:
+                done.set()
+                await asyncio.Event().wait()
+            if not ready:
+                raise ConnectionError("down")
+            return MetricsSnapshot(requests_processing=0.0), True
+
+        monkeypatch.setattr(cache_refresher, "_fetch_static_info", fetch_static_info)
+        monkeypatch.setattr(cache_refresher, "_fetch_backend_metrics", fetch_backend_metrics)
+        monkeypatch.setattr(cache_refresher, "_next_interval", lambda *args: 0)
+        monkeypatch.setattr(cache_refresher, "POLL_FAST_INTERVAL_SECONDS", 0)
+
+        task = asyncio.create_task(cache_refresher._poll_backend(URL))
+        await asyncio.wait_for(done.wait(), 5)
+        task.cancel()
+        # One regular check per poll, plus a single forced refetch when the backend came back
+        assert static_calls.count(True) == 1
+        assert static_calls.index(True) == 5
+
+    try:
+        asyncio.run(main())
+    finally:
+        backend_state.remove_state(URL)
@@ -0,0 +1,72 @@
+import pytest
+
+from inference_engine_proxy_server.core import circuit_breaker
+from inference_engine_proxy_server.core.circuit_breaker import CLOSED, HALF_OPEN, OPEN
+
+URL = "http://breaker-test:8080"
+PEER = "http://breaker-peer:8080"
+
+
+@pytest.fixture
+def clock(fake_clock, monkeypatch):
+    monkeypatch.setattr(circuit_breaker, "time", fake_clock)
+    monkeypatch.setattr(circuit_breaker, "CIRCUIT_BREAKER_ENABLED", True)
+    monkeypatch.setattr(circuit_breaker, "BACKENDS", [URL, PEER])
+    yield fake_clock
+    circuit_breaker.forget(URL)
+    circuit_breaker.forget(PEER)
+
+
+def _fail(times):
+    for _ in range(times):
+        circuit_breaker.record(URL, circuit_breaker.begin(URL), False)
+
+
+def test_error_rate_ejects_backend(clock):
+    _fail(circuit_breaker.CIRCUIT_MIN_REQUESTS)
+    assert circuit_breaker.status(URL)["state"] == OPEN
+    assert not circuit_breaker.allows(URL)
+
+
+def test_half_open_probe_success_closes_the_circuit(clock):
+    _fail(circuit_breaker.CIRCUIT_MIN_REQUESTS)
+    clock.now += circuit_breaker.CIRCUIT_EJECTION_SECONDS
+    assert circuit_breaker.allows(URL)
+    assert circuit_breaker.status(URL)["state"] == HALF_OPEN
+
+    started = [circuit_breaker.begin(URL) for _ in range(circuit_breaker.CIRCUIT_HALF_OPEN_REQUESTS)]
+    assert not circuit_breaker.allows(URL)   # every probe slot is taken
+    circuit_breaker.record(URL, started[0], True)
+    assert circuit_breaker.status(URL)["state"] == CLOSED
+    assert circuit_breaker.allows(URL)
+
+
+def test_failed_probe_ejects_again_for_longer(clock):
+    _fail(circuit_breaker.CIRCUIT_MIN_REQUESTS)
+    first = circuit_breaker.status(URL)["retry_in_seconds"]
+    clock.now += circuit_breaker.CIRCUIT_EJECTION_SECONDS
+    assert circuit_breaker.allows(URL)
+    circuit_breaker.record(URL, circuit_breaker.begin(URL), False)
+
+    status = circuit_breaker.status(URL)
+    assert status["state"] == OPEN and status["reason"] == "half-open probe failed"
+    assert status["retry_in_seconds"] > first
+
+
+def test_probe_abandoned_by_client_frees_its_slot(clock):
+    _fail(circuit_breaker.CIRCUIT_MIN_REQUESTS)
+    clock.now += circuit_breaker.CIRCUIT_EJECTION_SECONDS
+    assert circuit_breaker.allows(URL)
+    started = circuit_breaker.begin(URL)
+    circuit_breaker.record(URL, started, None)
+    assert circuit_breaker.status(URL)["state"] == HALF_OPEN
+    assert circuit_breaker.allows(URL)
+
+
+def test_ejections_are_capped_by_percentage(clock, monkeypatch):
+    monkeypatch.setattr(circuit_breaker, "CIRCUIT_MAX_EJECTION_PERCENT", 50)
+    _fail(circuit_breaker.CIRCUIT_MIN_REQUESTS)
+    for _ in range(circuit_breaker.CIRCUIT_MIN_REQUESTS):
+        circuit_breaker.record(PEER, circuit_breaker.begin(PEER), False)
+    assert circuit_breaker.status(URL)["state"] == OPEN
+    assert circuit_breaker.status(PEER)["state"] == CLOSED
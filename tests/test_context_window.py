@@ -0,0 +1,105 @@
+import asyncio
+import json
+
+import pytest
+from fastapi import Response
+
+from inference_engine_proxy_server import server
+from inference_engine_proxy_server.core import context_window, functions
+from inference_engine_proxy_server.core.constants import BACKENDS
+from inference_engine_proxy_server.core.request_body import RequestBody
+from inference_engine_proxy_server.core.token_estimator import TokenEstimate
+
+
+def _needs(tokens):
+    return TokenEstimate(tokens, 0, tokens)
+
+
+def _picks(tokens, count=50):
+    return {functions._select_backend(None, None, None, _needs(tokens)) for _ in range(count)}
+
+
+def test_requests_only_go_to_backends_they_fit_in(backends):
+    small, large = backends([0, 1], "least_requests", windows=[4096, 32768])
+    assert {backend.backend_url for backend in _picks(1000)} == {small}
+    assert {backend.backend_url for backend in _picks(10000)} == {large}
+    # Estimates are approximate: slightly over the window still fits
+    assert context_window.fits(small, _needs(4400))
+
+
+def test_pool_rejects_only_when_no_backend_fits(backends):
+    backends([0, 0], "least_requests", windows=[4096, 32768])
+    assert context_window.exceeds_pool(BACKENDS, _needs(10000)) is None
+    assert _picks(40000) == {None}
+    assert context_window.exceeds_pool(BACKENDS, _needs(40000)) == 32768
+    assert context_window.exceeds_pool(BACKENDS, TokenEstimate(40000, 0, None)) is None
+
+
+def test_unknown_window_always_fits(backends):
+    backends([0, 0], "least_requests", windows=[4096, None])
+    assert context_window.exceeds_pool(BACKENDS, _needs(40000)) is None
+    assert len(_picks(40000)) == 1
+
+
+def test_estimates_are_only_needed_when_windows_differ(backends):
+    backends([0, 0], "least_requests", windows=[4096, 4096])
+    assert not context_window.has_context_windows()
+    backends([0, 0], "least_requests", windows=[4096, 8192])
+    assert context_window.has_context_windows()
+    backends([0, 0], "least_requests", windows=[4096, None])
+    assert context_window.has_context_windows()
+    backends([0, 0], "least_requests")
+    assert not context_window.has_context_windows()
+
+
+@pytest.fixture
+def forward(monkeypatch, make_request):
+    """Runs server._forward on a chat request of `chars` characters; returns the response and the estimates made."""
+    monkeypatch.setattr(server, "HEDGING_ENABLED", False)
+    estimator = server.get_token_estimator()
+    estimates = []
+    original = estimator.estimate
+
+    async def estimate(*args):
+        estimates.append(await original(*args))
+        return estimates[-1]
+
+    monkeypatch.setattr(estimator, "estimate", estimate)
+
+    class _Backend:
+        backend_url = "http://select-0:8080"
+
+        async def forward_request(self, *args, **kwargs):
+            return Response(b"ok")
+
+    class _Queue:
+        async def admit(self, try_acquire, priority=0):
+            return _Backend()
+
+    monkeypatch.setattr(server, "get_admission_queue", lambda model: _Queue())
+
+    def run(chars):
+        payload = json.dumps({"messages": [{"role": "user", "content": "a" * chars}], "max_tokens": 10}).encode()
+        response = asyncio.run(server._forward("v1/chat/completions", make_request(payload),
+                                               RequestBody(payload), None))
+        return response, estimates
+
+    return run
+
+
+def test_request_fitting_nowhere_is_rejected(backends, forward):
+    backends([0, 0], "least_requests", windows=[100, 200])
+    response, estimates = forward(2000)
+    assert response.status_code == 400
+    error = json.loads(response.body)["error"]
+    assert error["code"] == "context_length_exceeded" and error["param"] == "messages"
+    assert "maximum context length is 200 tokens" in error["message"]
+
+    response, _ = forward(100)
+    assert response.body == b"ok"
+
+
+def test_requests_are_not_estimated_when_windows_are_equal(backends, forward):
+    backends([0, 0], "least_requests", windows=[100, 100])
+    response, estimates = forward(2000)
+    assert response.body == b"ok" and estimates == []
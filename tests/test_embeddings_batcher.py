@@ -0,0 +1,54 @@
+import json
+
+from fastapi import Response
+
+from inference_engine_proxy_server.core.embeddings_batcher import (
+    EmbeddingsBatcher, _apportion, _Batch, _split_usage, _Waiter,
+)
+
+
+def test_apportion_adds_up_by_largest_remainder():
+    assert _apportion(10, [1, 1, 1]) == [4, 3, 3]
+    assert _apportion(7, [5, 0, 2]) == [5, 0, 2]
+    assert _apportion(5, [0, 0]) == [3, 2]
+    assert sum(_apportion(1001, [3, 7, 11, 13])) == 1001
+
+
+def test_split_usage_splits_integer_counts_only():
+    parts = _split_usage({"prompt_tokens": 9, "total_tokens": 9, "model": "m"}, [1, 2])
+    assert parts == [{"prompt_tokens": 3, "total_tokens": 3, "model": "m"},
+                     {"prompt_tokens": 6, "total_tokens": 6, "model": "m"}]
+    assert _split_usage(None, [1, 2]) == [None, None]
+
+
+def _batch(counts):
+    batch = _Batch({"model": "m"}, None)
+    offset = 0
+    for count in counts:
+        batch.waiters.append(_Waiter(None, offset, count, chars=count))
+        batch.inputs.extend(f"text {offset + i}" for i in range(count))
+        offset += count
+    return batch
+
+
+def test_split_reindexes_each_requests_embeddings():
+    batch = _batch([1, 2])
+    # The engine may return the embeddings in any order
+    data = [{"object": "embedding", "index": i, "embedding": [float(i)]} for i in (2, 0, 1)]
+    merged = Response(json.dumps({"object": "list", "data": data, "model": "m",
+                                  "usage": {"prompt_tokens": 6, "total_tokens": 6}}).encode())
+    first, second = [json.loads(part.body) for part in EmbeddingsBatcher()._split(batch, merged)]
+
+    assert [item["embedding"] for item in first["data"]] == [[0.0]]
+    assert [(item["index"], item["embedding"]) for item in second["data"]] == [(0, [1.0]), (1, [2.0])]
+    assert first["usage"] == {"prompt_tokens": 2, "total_tokens": 2}
+    assert second["usage"] == {"prompt_tokens": 4, "total_tokens": 4}
+
+
+def test_split_rejects_inconsistent_responses():
+    batcher = EmbeddingsBatcher()
+    batch = _batch([1, 1])
+    duplicate = [{"index": 0, "embedding": []}, {"index": 0, "embedding": []}]
+    assert batcher._split(batch, Response(json.dumps({"data": duplicate}).encode())) is None
+    assert batcher._split(batch, Response(json.dumps({"data": duplicate[:1]}).encode())) is None
+    assert batcher._split(batch, Response(b"{}", status_code=500)) is None
@@ -0,0 +1,67 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+from fastapi import Response
+
+from inference_engine_proxy_server import server
+from inference_engine_proxy_server.backends.base import BackendUnavailableError
+from inference_engine_proxy_server.core.request_body import RequestBody
+
+
+class _Backend:
+    def __init__(self, backend_url, answer=None):
+        self.backend_url = backend_url
+        self.answer = answer
+        self.calls = []
+
+    async def forward_request(self, request, path, allow_failover=False, body=None, tokens=None):
+        self.calls.append(allow_failover)
+        if self.answer is None:
+            raise BackendUnavailableError(self.backend_url, "HTTP 503", Response(b"busy", status_code=503))
+        return self.answer
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    """Routes requests over the given backends in order; returns the exclude sets `choose_backend` saw."""
+    monkeypatch.setattr(server, "RETRY_MAX_ATTEMPTS", 3)
+    monkeypatch.setattr(server, "HEDGING_ENABLED", False)
+    monkeypatch.setattr(server, "has_context_windows", lambda: False)
+    monkeypatch.setattr(server, "get_strategy", lambda: SimpleNamespace(uses_tokens=False))
+    marked = []
+    monkeypatch.setattr(server, "mark_backend_unready", marked.append)
+    excludes = []
+
+    def populate(backends):
+        async def choose_backend(affinity_key, exclude=None, model=None, tokens=None, max_load=None):
+            excludes.append(set(exclude or ()))
+            return next((b for b in backends if b.backend_url not in (exclude or ())), None)
+
+        monkeypatch.setattr(server, "choose_backend", choose_backend)
+        return excludes, marked
+
+    return populate
+
+
+def _forward(make_request):
+    return asyncio.run(server._forward("v1/chat/completions", make_request(b"{}"), RequestBody(b"{}"), None))
+
+
+def test_failed_backends_are_excluded_across_retries(pool, make_request):
+    backends = [_Backend("http://a"), _Backend("http://b"), _Backend("http://c", Response(b"ok"))]
+    excludes, marked = pool(backends)
+    response = _forward(make_request)
+    assert response.body == b"ok"
+    assert excludes == [set(), {"http://a"}, {"http://a", "http://b"}]
+    assert marked == ["http://a", "http://b"]
+    # Only the last allowed attempt answers the client with whatever it gets
+    assert [b.calls for b in backends] == [[True], [True], [False]]
+
+
+def test_last_error_is_returned_when_no_backend_is_left(pool, make_request):
+    backends = [_Backend("http://a"), _Backend("http://b")]
+    excludes, _ = pool(backends)
+    response = _forward(make_request)
+    assert response.status_code == 503 and response.body == b"busy"
+    assert excludes[-1] == {"http://a", "http://b"}
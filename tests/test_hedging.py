@@ -0,0 +1,242 @@
+import asyncio
+
+import pytest
+from fastapi import Response
+from fastapi.responses import StreamingResponse
+
+from inference_engine_proxy_server.backends.base import BackendUnavailableError
+from inference_engine_proxy_server.core import hedging
+
+PATH = "v1/embeddings"
+DELAY = 0.02
+
+
+class _Body:
+    """Streamed response body that records whether it was closed."""
+
+    def __init__(self):
+        self.closed = False
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        raise StopAsyncIteration
+
+    async def aclose(self):
+        self.closed = True
+
+
+def _streaming(status_code=200):
+    body = _Body()
+    return StreamingResponse(body, status_code=status_code), body
+
+
+class _Backend:
+    def __init__(self, backend_url, answer):
+        self.backend_url = backend_url
+        self.answer = answer
+        self.calls = 0
+        self.cancelled = False
+
+    async def forward_request(self, request, path, allow_failover=False, body=None, tokens=None):
+        self.calls += 1
+        try:
+            return await self.answer()
+        except asyncio.CancelledError:
+            self.cancelled = True
+            raise
+
+
+def _after(seconds, response):
+    async def answer():
+        await asyncio.sleep(seconds)
+        if isinstance(response, BaseException):
+            raise response
+        return response
+    return answer
+
+
+async def _never():
+    await asyncio.Event().wait()
+
+
+@pytest.fixture
+def hedge(monkeypatch):
+    """Runs forward_hedged from `primary` with `backup` as the next-best backend; returns (response, choices)."""
+    monkeypatch.setattr(hedging, "_windows", {})
+    monkeypatch.setattr(hedging, "_budget", hedging.MAX_BUDGET)
+    monkeypatch.setattr(hedging, "HEDGING_MIN_SAMPLES", 5)
+    marked = []
+    monkeypatch.setattr(hedging, "mark_backend_unready", marked.append)
+
+    async def run(primary, backup, failed=None):
+        choices = []
+
+        async def choose(exclude):
+            choices.append(set(exclude))
+            return backup
+
+        response = await hedging.forward_hedged(primary, None, PATH, choose, failed if failed is not None else set())
+        return response, choices
+
+    run.marked = marked
+    return run
+
+
+def _prime(backend):
+    hedging._window(PATH, backend.backend_url).samples.extend([DELAY] * 5)
+
+
+def test_no_hedge_without_enough_samples(hedge):
+    async def main():
+        primary = _Backend("http://primary", _after(DELAY * 2, Response(b"primary")))
+        backup = _Backend("http://backup", _after(0, Response(b"backup")))
+        hedging._window(PATH, primary.backend_url).samples.extend([DELAY] * 4)
+        response, choices = await hedge(primary, backup)
+        assert response.body == b"primary" and choices == [] and backup.calls == 0
+
+    asyncio.run(main())
+
+
+def test_answer_within_the_delay_is_not_hedged(hedge):
+    async def main():
+        primary = _Backend("http://primary", _after(0, Response(b"primary")))
+        backup = _Backend("http://backup", _after(0, Response(b"backup")))
+        _prime(primary)
+        response, choices = await hedge(primary, backup)
+        assert response.body == b"primary" and choices == []
+
+    asyncio.run(main())
+
+
+def test_slow_primary_is_hedged_and_cancelled(hedge):
+    async def main():
+        primary = _Backend("http://primary", _never)
+        backup = _Backend("http://backup", _after(0, Response(b"backup")))
+        _prime(primary)
+        response, choices = await hedge(primary, backup, failed={"http://down"})
+        assert response.body == b"backup"
+        assert choices == [{"http://down", "http://primary"}]
+        await asyncio.sleep(0)
+        assert primary.cancelled
+        # The cancelled attempt still counts as slow
+        assert max(hedging._window(PATH, primary.backend_url).samples) >= DELAY
+
+    asyncio.run(main())
+
+
+def test_hedges_are_limited_by_the_budget(hedge, monkeypatch):
+    async def main():
+        monkeypatch.setattr(hedging, "_budget", 0.5)
+        primary = _Backend("http://primary", _after(DELAY * 2, Response(b"primary")))
+        backup = _Backend("http://backup", _after(0, Response(b"backup")))
+        _prime(primary)
+        response, choices = await hedge(primary, backup)
+        assert response.body == b"primary" and choices == []
+        assert hedging._budget == pytest.approx(0.5 + hedging.HEDGING_BUDGET_PERCENT / 100)
+
+    asyncio.run(main())
+
+
+def test_budget_is_refunded_when_no_backend_is_left(hedge, monkeypatch):
+    async def main():
+        monkeypatch.setattr(hedging, "_budget", 2.0)
+        primary = _Backend("http://primary", _after(DELAY * 2, Response(b"primary")))
+        _prime(primary)
+        response, choices = await hedge(primary, None)
+        assert response.body == b"primary" and len(choices) == 1
+        assert hedging._budget == pytest.approx(2.0 + hedging.HEDGING_BUDGET_PERCENT / 100)
+
+    asyncio.run(main())
+
+
+def test_loser_finishing_together_is_closed(hedge):
+    async def main():
+        gate = asyncio.Event()
+        primary_response, primary_body = _streaming()
+        backup_response, backup_body = _streaming()
+
+        def gated(response):
+            async def answer():
+                await gate.wait()
+                return response
+            return answer
+
+        primary = _Backend("http://primary", gated(primary_response))
+        backup = _Backend("http://backup", gated(backup_response))
+        _prime(primary)
+        running = asyncio.create_task(hedge(primary, backup))
+        await asyncio.sleep(DELAY * 2)
+        assert backup.calls == 1
+        gate.set()
+        response, _ = await running
+        assert response is primary_response
+        assert backup_body.closed and not primary_body.closed
+
+    asyncio.run(main())
+
+
+def test_replaced_server_error_is_closed(hedge):
+    async def main():
+        error_response, error_body = _streaming(502)
+        primary = _Backend("http://primary", _after(DELAY * 1.5, error_response))
+        backup = _Backend("http://backup", _after(DELAY, Response(b"backup")))
+        _prime(primary)
+        response, _ = await hedge(primary, backup)
+        assert response.body == b"backup"
+        assert error_body.closed
+
+    asyncio.run(main())
+
+
+def test_response_of_a_cancelled_attempt_is_closed(hedge):
+    async def main():
+        late_response, late_body = _streaming()
+
+        async def finishes_anyway():
+            try:
+                await asyncio.Event().wait()
+            except asyncio.CancelledError:
+                return late_response   # the upstream answer arrived as the attempt was cancelled
+
+        primary = _Backend("http://primary", finishes_anyway)
+        backup = _Backend("http://backup", _after(0, Response(b"backup")))
+        _prime(primary)
+        response, _ = await hedge(primary, backup)
+        assert response.body == b"backup"
+        for _ in range(3):
+            await asyncio.sleep(0)
+        assert late_body.closed
+
+    asyncio.run(main())
+
+
+def test_failed_over_hedge_is_excluded(hedge):
+    async def main():
+        error = BackendUnavailableError("http://backup", "HTTP 503", Response(status_code=503))
+        primary = _Backend("http://primary", _after(DELAY * 2, Response(b"primary")))
+        backup = _Backend("http://backup", _after(0, error))
+        _prime(primary)
+        failed = set()
+        response, _ = await hedge(primary, backup, failed=failed)
+        assert response.body == b"primary"
+        assert failed == {"http://backup"} and hedge.marked == ["http://backup"]
+
+    asyncio.run(main())
+
+
+def test_every_attempt_failing_raises_the_primarys_error(hedge):
+    async def main():
+        primary_error = BackendUnavailableError("http://primary", "HTTP 503", Response(status_code=503))
+        backup_error = BackendUnavailableError("http://backup", "HTTP 503", Response(status_code=503))
+        primary = _Backend("http://primary", _after(DELAY * 2, primary_error))
+        backup = _Backend("http://backup", _after(0, backup_error))
+        _prime(primary)
+        failed = set()
+        with pytest.raises(BackendUnavailableError) as raised:
+            await hedge(primary, backup, failed=failed)
+        # The caller adds the primary when it fails the request over
+        assert raised.value is primary_error and failed == {"http://backup"}
+
+    asyncio.run(main())
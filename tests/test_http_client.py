@@ -0,0 +1,73 @@
+import asyncio
+
+from inference_engine_proxy_server.core import http_client, telemetry
+
+
+async def _serve_keep_alive():
+    """A minimal HTTP/1.1 server answering every request on a connection with "ok"."""
+    async def handle(reader, writer):
+        try:
+            while await reader.readuntil(b"\r\n\r\n"):
+                writer.write(b"HTTP/1.1 200 OK\r\nContent-Length: 2\r\n\r\nok")
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    server = await asyncio.start_server(handle, "127.0.0.1", 0)
+    return server, f"http://127.0.0.1:{server.sockets[0].getsockname()[1]}"
+
+
+def _count(metric, backend_url, suffix):
+    return {key: value for key, value in telemetry.collect_samples(metric, buckets=False).items()
+            if backend_url in key and key.split("{")[0].endswith(suffix)}
+
+
+def test_pool_trace_tells_new_from_reused_connections():
+    async def main():
+        server, backend_url = await _serve_keep_alive()
+        try:
+            client = http_client.get_backend_client(backend_url)
+            assert http_client.get_backend_client(backend_url) is client   # one pool per backend
+            for _ in range(3):
+                response = await client.get(backend_url, extensions={"trace": http_client.pool_trace(backend_url)})
+                assert response.text == "ok"
+
+            connections = telemetry.collect_samples(telemetry.UPSTREAM_CONNECTIONS)
+            assert connections[f'proxy_upstream_connections_total{{backend="{backend_url}",connection="new"}}'] == 1
+            assert connections[f'proxy_upstream_connections_total{{backend="{backend_url}",connection="reused"}}'] == 2
+            assert list(_count(telemetry.UPSTREAM_POOL_WAIT_SECONDS, backend_url, "_count").values()) == [3]
+            assert list(_count(telemetry.UPSTREAM_CONNECT_SECONDS, backend_url, "_count").values()) == [1]
+        finally:
+            await http_client.close_backend_client(backend_url)
+            telemetry.forget_backend(backend_url)
+            server.close()
+            await server.wait_closed()
+        assert backend_url not in http_client._backend_clients
+
+    asyncio.run(main())
+
+
+def test_trace_ignores_events_after_the_request_went_out():
+    async def main():
+        backend_url = "http://trace-test:8080"
+        trace = http_client.pool_trace(backend_url)
+        await trace("http11.send_request_headers.started", {})
+        await trace("connection.connect_tcp.started", {})
+        await trace("http11.send_request_headers.started", {})
+        connections = telemetry.collect_samples(telemetry.UPSTREAM_CONNECTIONS)
+        assert connections[f'proxy_upstream_connections_total{{backend="{backend_url}",connection="reused"}}'] == 1
+        assert connections[f'proxy_upstream_connections_total{{backend="{backend_url}",connection="new"}}'] == 0
+        telemetry.forget_backend(backend_url)
+
+    asyncio.run(main())
+
+
+def test_pool_size_follows_configuration(monkeypatch):
+    monkeypatch.setattr(http_client, "MAX_ALLOWED_REQUEST_QUEUE", 4)
+    monkeypatch.setattr(http_client, "BACKEND_WEIGHTS", {"http://heavy:8080": 2.5})
+    monkeypatch.setattr(http_client, "BACKEND_MAX_CONNECTIONS", {"http://pinned:8080": 7})
+    assert http_client.max_connections("http://plain:8080") == 8
+    assert http_client.max_connections("http://heavy:8080") == 20
+    assert http_client.max_connections("http://pinned:8080") == 7
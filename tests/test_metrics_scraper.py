@@ -0,0 +1,61 @@
+from inference_engine_proxy_server.backends.llamacpp import LLAMACPP_METRICS, LLAMACPP_OPTIONAL_METRICS
+from inference_engine_proxy_server.backends.vllm import VLLM_METRICS
+from inference_engine_proxy_server.core.metrics_scraper import MetricsScanner, parse_metrics, parse_metrics_chunks
+
+VLLM = b"""# HELP vllm:num_requests_running Number of requests in model execution batches.
+# TYPE vllm:num_requests_running gauge
+vllm:num_requests_running{engine="0",model_name="m"} 3.0
+vllm:num_requests_running{engine="1",model_name="m"} 2.0
+vllm:num_requests_waiting{engine="0",model_name="m"} 1.0
+vllm:kv_cache_usage_perc{engine="0",model_name="m"} 0.25
+vllm:gpu_cache_usage_perc{engine="0",model_name="m"} 0.25
+vllm:prompt_tokens_total{engine="0",model_name="m"} 100.0
+vllm:generation_tokens_total{engine="0",model_name="m"} 50.0
+vllm:time_to_first_token_seconds_bucket{le="0.001",model_name="m"} 0.0
+"""
+
+LLAMACPP = b"""llamacpp:prompt_tokens_seconds 300
+llamacpp:predicted_tokens_seconds 30
+llamacpp:requests_processing 2
+llamacpp:requests_deferred 0
+llamacpp:n_tokens_max 4096
+llamacpp:unrelated 1
+"""
+
+
+def test_labelled_samples_are_summed_and_aliases_are_not():
+    snapshot = parse_metrics(VLLM, VLLM_METRICS)
+    assert snapshot.requests_processing == 5.0
+    assert snapshot.requests_deferred == 1.0
+    assert snapshot.kv_cache_usage == 0.25
+    assert snapshot.generation_tokens_total == 50.0
+
+
+def test_scanner_stops_after_the_last_wanted_metric():
+    scanner = MetricsScanner(VLLM_METRICS)
+    scanner.feed(VLLM)
+    assert scanner.done
+
+
+def test_missing_optional_metric_does_not_prevent_early_stop():
+    scanner = MetricsScanner(LLAMACPP_METRICS)
+    scanner.feed(LLAMACPP)
+    assert not scanner.done
+
+    scanner = MetricsScanner(LLAMACPP_METRICS, LLAMACPP_OPTIONAL_METRICS)
+    scanner.feed(LLAMACPP)
+    assert scanner.done
+    snapshot = scanner.snapshot()
+    assert snapshot.requests_processing == 2 and snapshot.kv_cache_usage is None
+
+
+def test_lines_split_across_chunks():
+    chunks = [VLLM[i:i + 7] for i in range(0, len(VLLM), 7)]
+    assert parse_metrics_chunks(chunks, VLLM_METRICS) == parse_metrics(VLLM, VLLM_METRICS)
+
+
+def test_label_values_with_spaces_and_trailing_line():
+    payload = b'vllm:num_requests_running{model_name="a b} c"} 4 1700000000\nvllm:num_requests_waiting 2'
+    snapshot = parse_metrics(payload, VLLM_METRICS)
+    assert snapshot.requests_processing == 4.0
+    assert snapshot.requests_deferred == 2.0
@@ -0,0 +1,93 @@
+import asyncio
+import json
+
+import pytest
+from fastapi import Response
+
+from inference_engine_proxy_server import server
+from inference_engine_proxy_server.core import models
+from inference_engine_proxy_server.core.models import extract_model
+from inference_engine_proxy_server.core.request_body import RequestBody
+
+
+def test_top_level_model_is_found_after_nested_ones():
+    body = json.dumps({
+        "messages": [{"role": "user", "content": "x", "model": "in-message"}],
+        "tools": [{"type": "function", "function": {"parameters": {"model": {"type": "string"}}}}],
+        "model": "top",
+    }).encode()
+    assert extract_model(body) == "top"
+
+
+def test_model_as_a_string_value_or_inside_strings_is_ignored():
+    body = b'{"messages": [{"content": "\\"model\\": \\"fake\\""}], "name": "model", "model" : "real"}'
+    assert extract_model(body) == "real"
+
+
+def test_escaped_model_name_is_decoded():
+    assert extract_model(b'{"model": "org\\/m\\u00e9\\"q"}') == 'org/mé"q'
+
+
+def test_non_string_or_missing_model():
+    assert extract_model(b'{"model": 3, "messages": []}') is None
+    assert extract_model(b'{"model": null}') is None
+    assert extract_model(b'{"messages": [{"model": "nested"}]}') is None
+    assert extract_model(b"") is None
+
+
+def test_model_is_read_from_a_spilled_body(make_request):
+    async def main():
+        padding = "x" * 4096
+        payload = json.dumps({"messages": [{"content": padding}], "model": "spilled"}).encode()
+        chunks = [payload[i:i + 1000] for i in range(0, len(payload), 1000)]
+        body = await RequestBody.read(make_request(chunks), max_memory=1024)
+        try:
+            assert not body.in_memory
+            assert extract_model(body.view()) == "spilled"
+        finally:
+            body.close()
+
+    asyncio.run(main())
+
+
+@pytest.fixture
+def model_index(monkeypatch):
+    monkeypatch.setattr(server, "MODEL_ROUTING_FALLBACK", False)
+    saved = dict(models._MODEL_INDEX)
+    forwarded = []
+
+    async def forward(full_path, request, body, model):
+        forwarded.append(model)
+        return Response(b"{}")
+
+    monkeypatch.setattr(server, "_forward", forward)
+
+    def populate(index):
+        models._MODEL_INDEX.clear()
+        models._MODEL_INDEX.update(index)
+        return forwarded
+
+    yield populate
+    models._MODEL_INDEX.clear()
+    models._MODEL_INDEX.update(saved)
+
+
+def _route(make_request, payload):
+    return asyncio.run(server._route("v1/chat/completions", make_request(payload), RequestBody(payload)))
+
+
+def test_unknown_model_is_forwarded_with_a_single_pool(model_index, make_request):
+    forwarded = model_index({"/models/llama.gguf": ["http://b1:8080", "http://b2:8080"]})
+    response = _route(make_request, b'{"model": "gpt-4", "messages": []}')
+    assert response.status_code == 200
+    assert forwarded == [None]
+
+
+def test_unknown_model_is_rejected_with_several_pools(model_index, make_request):
+    forwarded = model_index({"a": ["http://b1:8080"], "b": ["http://b2:8080"]})
+    response = _route(make_request, b'{"model": "gpt-4", "messages": []}')
+    assert response.status_code == 404
+    assert json.loads(response.body)["error"]["code"] == "model_not_found"
+
+    assert _route(make_request, b'{"model": "b", "messages": []}').status_code == 200
+    assert forwarded == ["b"]
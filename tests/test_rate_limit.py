@@ -0,0 +1,120 @@
+import asyncio
+
+import pytest
+from fastapi import Response
+from fastapi.responses import StreamingResponse
+
+from inference_engine_proxy_server.core import rate_limit
+from inference_engine_proxy_server.core.rate_limit import RateLimiter, RateLimitExceeded, completion_tokens
+
+
+@pytest.fixture
+def clock(fake_clock, monkeypatch):
+    monkeypatch.setattr(rate_limit, "time", fake_clock)
+    return fake_clock
+
+
+def _limiter(**limits):
+    settings = {"max_concurrent": 0, "requests_per_second": 0, "burst": 0, "tokens_per_minute": 0,
+                "multipliers": {}, "workers": 1}
+    settings.update(limits)
+    return RateLimiter(**settings)
+
+
+def test_request_bucket_allows_burst_then_refills(clock):
+    limiter = _limiter(requests_per_second=2, burst=3)
+    for _ in range(3):
+        limiter.release(limiter.acquire("a"))
+    with pytest.raises(RateLimitExceeded) as error:
+        limiter.acquire("a")
+    assert error.value.limit == "requests"
+    assert error.value.retry_after == pytest.approx(0.5)
+    limiter.acquire("b")   # other callers have their own bucket
+
+    clock.now += 0.5
+    limiter.acquire("a")
+    with pytest.raises(RateLimitExceeded):
+        limiter.acquire("a")
+
+
+def test_token_bucket_is_charged_after_the_response(clock):
+    limiter = _limiter(tokens_per_minute=600)
+    limiter.release(limiter.acquire("a"), tokens=900)
+    with pytest.raises(RateLimitExceeded) as error:
+        limiter.acquire("a")
+    assert error.value.limit == "tokens"
+    assert error.value.retry_after == pytest.approx(30)
+
+    clock.now += 31
+    limiter.acquire("a")
+
+
+def test_concurrency_limit_and_multiplier(clock):
+    limiter = _limiter(max_concurrent=1, multipliers={"big": 2})
+    tenant = limiter.acquire("a")
+    with pytest.raises(RateLimitExceeded):
+        limiter.acquire("a")
+    limiter.release(tenant)
+    limiter.acquire("a")
+    limiter.acquire("big")
+    limiter.acquire("big")
+
+
+def test_idle_callers_are_evicted(clock):
+    limiter = _limiter(requests_per_second=1, idle_seconds=10)
+    limiter.release(limiter.acquire("old"))
+    clock.now += 11
+    limiter.release(limiter.acquire("new"))
+    assert len(limiter) == 1
+
+
+def test_stream_closed_before_iterating_releases_the_caller(clock):
+    async def main():
+        limiter = _limiter(max_concurrent=1, tokens_per_minute=600)
+        tenant = limiter.acquire("a")
+
+        async def body():
+            yield b"data: {}\n\n"
+
+        stream = rate_limit._MeteredStream(limiter, tenant, body())
+        await stream.aclose()
+        assert tenant.active == 0
+        await stream.aclose()   # closing twice releases once
+        assert tenant.active == 0
+        limiter.acquire("a")
+
+    asyncio.run(main())
+
+
+def test_completion_tokens():
+    assert completion_tokens(b'{"usage": {"prompt_tokens": 3, "total_tokens": 10}}') == 7
+    assert completion_tokens(b'data: {"usage": {"prompt_tokens": 3, "completion_tokens": 4}}') == 4
+    assert completion_tokens(b'{"usage": {"prompt_tokens": 8, "total_tokens": 8}}') == 0   # embeddings
+    assert completion_tokens(b'{"usage": null}') is None
+    assert completion_tokens(b'{"choices": []}') is None
+
+
+def test_streamed_and_buffered_responses_are_charged_alike(clock):
+    async def main():
+        limiter = _limiter(tokens_per_minute=600)
+        events = [b'data: {"choices": [{"delta": {"content": "%d"}}]}\n\n' % i for i in range(5)]
+
+        async def stream(chunks):
+            for chunk in chunks:
+                yield chunk
+
+        buffered = limiter.acquire("buffered")
+        limiter.meter(buffered, Response(b'{"choices": [], "usage": {"prompt_tokens": 40, '
+                                         b'"completion_tokens": 5, "total_tokens": 45}}'))
+        for key, chunks in [("estimated", events + [b"data: [DONE]\n\n"]),
+                            ("reported", events + [b'data: {"choices": [], "usage": {"prompt_tokens": 40, '
+                                                   b'"completion_tokens": 5, "total_tokens": 45}}\n\n',
+                                                   b"data: [DONE]\n\n"])]:
+            response = limiter.meter(limiter.acquire(key), StreamingResponse(stream(chunks)))
+            async for _ in response.body_iterator:
+                pass
+
+        assert {key: tenant.tokens for key, tenant in limiter._tenants.items()} == {
+            "buffered": 595, "estimated": 595, "reported": 595}
+
+    asyncio.run(main())
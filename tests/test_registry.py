@@ -0,0 +1,154 @@
+import asyncio
+import json
+from collections import Counter
+
+import pytest
+from fastapi.testclient import TestClient
+
+from inference_engine_proxy_server import server
+from inference_engine_proxy_server.core import backend_state, functions, inflight, registry
+from inference_engine_proxy_server.core.constants import BACKEND_WEIGHTS, BACKENDS, _DRAINING_BACKENDS
+
+NEW = "http://registry-new:8080"
+
+
+@pytest.fixture
+def pool(backends, monkeypatch):
+    """Two ready, idle backends; weights, drain states and pending removals are restored afterwards."""
+    saved_weights, saved_draining = dict(BACKEND_WEIGHTS), set(_DRAINING_BACKENDS)
+    monkeypatch.setattr(registry, "RECLAIM_CHECK_SECONDS", 0.01)
+    yield backends([0, 0], "least_requests")
+    for task in registry._removing.values():
+        task.cancel()
+    registry._removing.clear()
+    BACKEND_WEIGHTS.clear()
+    BACKEND_WEIGHTS.update(saved_weights)
+    _DRAINING_BACKENDS.clear()
+    _DRAINING_BACKENDS.update(saved_draining)
+
+
+def _picks(count=100):
+    return Counter(getattr(functions._select_backend(None, None, None, None), "backend_url", None)
+                   for _ in range(count))
+
+
+def test_add_and_update_backend(pool):
+    assert registry.set_backend(NEW, weight=2)
+    assert BACKENDS[-1] == NEW and backend_state.get_state(NEW).active
+    assert not registry.set_backend(NEW, weight=3)
+    listed = {entry["url"]: entry for entry in registry.list_backends()}
+    assert listed[NEW]["weight"] == 3.0 and listed[NEW]["state"] == "active"
+    with pytest.raises(ValueError):
+        registry.set_backend("llm:8080")
+    with pytest.raises(ValueError):
+        registry.set_backend(NEW, weight=0)
+
+
+def test_draining_backend_gets_no_new_requests_but_finishes_its_own(pool):
+    draining, other = pool
+    inflight.acquire(draining)   # a request that was sent before the drain
+    try:
+        registry.set_backend(draining, draining=True)
+        assert set(_picks()) == {other}
+        assert {entry["url"]: entry["state"] for entry in registry.list_backends()}[draining] == "draining"
+        # The backend stays configured and polled; its request still counts until it is done
+        assert draining in BACKENDS and inflight.get_inflight(draining) == 1
+    finally:
+        inflight.release(draining)
+    assert inflight.get_inflight(draining) == 0
+
+    registry.set_backend(draining, draining=False)
+    assert set(_picks()) == {draining, other}
+
+
+def test_removed_backend_is_reclaimed_after_its_requests(pool):
+    async def main():
+        removed, other = pool
+        inflight.acquire(removed)
+        assert registry.remove_backend(removed)
+        assert not registry.remove_backend(removed)
+        assert set(_picks()) == {other}
+        assert {entry["url"]: entry["state"] for entry in registry.list_backends()}[removed] == "removing"
+
+        await asyncio.sleep(0.05)
+        assert backend_state.get_state(removed) is not None   # still in flight: not reclaimed yet
+        inflight.release(removed)
+        await asyncio.wait_for(registry._removing[removed], 1)
+        assert backend_state.get_state(removed) is None
+        assert removed not in {entry["url"] for entry in registry.list_backends()}
+
+    asyncio.run(main())
+
+
+def test_backend_re_added_before_reclaim_keeps_its_state(pool):
+    async def main():
+        removed, other = pool
+        inflight.acquire(removed)
+        state = backend_state.get_state(removed)
+        registry.remove_backend(removed)
+        reclaim = registry._removing[removed]
+        assert registry.set_backend(removed)
+        await asyncio.sleep(0)
+        assert reclaim.cancelled() and removed not in registry._removing
+        assert backend_state.get_state(removed) is state and state.active
+        inflight.release(removed)
+        assert set(_picks()) == {removed, other}
+
+    asyncio.run(main())
+
+
+def test_backends_file_replaces_the_list(pool, tmp_path):
+    async def main():
+        kept, dropped = pool
+        path = tmp_path / "backends.json"
+        path.write_text(json.dumps({"backends": [{"url": kept, "weight": 2}, {"url": NEW, "drain": True}]}))
+        assert registry.load_file(str(path))
+        assert BACKENDS == [kept, NEW]
+        assert BACKEND_WEIGHTS[kept] == 2.0 and registry.is_draining(NEW)
+        assert dropped in registry._removing
+
+        path.write_text("{not json")
+        assert not registry.load_file(str(path))
+        assert not registry.load_file(str(tmp_path / "missing.json"))
+        assert BACKENDS == [kept, NEW]
+
+    asyncio.run(main())
+
+
+def test_backends_file_is_reloaded_when_it_changes(pool, tmp_path, monkeypatch):
+    async def main():
+        monkeypatch.setattr(registry, "BACKENDS_FILE_POLL_SECONDS", 0.01)
+        path = tmp_path / "backends.json"
+        path.write_text(json.dumps(list(pool)))
+        watcher = asyncio.create_task(registry.watch_file(str(path)))
+        try:
+            await asyncio.sleep(0.03)
+            assert BACKENDS == list(pool)
+            path.write_text(json.dumps([pool[0], NEW]))
+            for _ in range(100):
+                if NEW in BACKENDS:
+                    break
+                await asyncio.sleep(0.01)
+            assert BACKENDS == [pool[0], NEW]
+        finally:
+            watcher.cancel()
+
+    asyncio.run(main())
+
+
+def test_admin_api(pool, monkeypatch):
+    monkeypatch.setattr(server, "ADMIN_API_KEY", "secret")
+    client = TestClient(server.app)   # not started: no lifespan, no polling
+    auth = {"Authorization": "Bearer secret"}
+
+    assert client.get("/admin/backends").status_code == 401
+    response = client.put("/admin/backends", json={"url": NEW, "weight": 2}, headers=auth)
+    assert response.status_code == 201 and response.json()["added"]
+    response = client.put("/admin/backends", json={"url": NEW, "drain": "yes"}, headers=auth)
+    assert response.status_code == 400
+    response = client.put("/admin/backends", json={"url": NEW, "drain": True}, headers=auth)
+    assert response.status_code == 200
+    assert {entry["url"]: entry["state"] for entry in client.get("/admin/backends", headers=auth).json()["backends"]
+            }[NEW] == "draining"
+    assert client.delete("/admin/backends", params={"url": NEW}, headers=auth).status_code == 200
+    assert client.delete("/admin/backends", params={"url": NEW}, headers=auth).status_code == 404
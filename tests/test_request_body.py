@@ -0,0 +1,93 @@
+import asyncio
+
+import httpx
+import pytest
+
+from inference_engine_proxy_server.backends import base
+from inference_engine_proxy_server.core import request_body
+from inference_engine_proxy_server.core.request_body import RequestBody, has_body, is_small_body
+
+PAYLOAD = bytes(range(256)) * 64   # 16 KiB
+
+
+def _chunks(data, size=1000):
+    return [data[i:i + size] for i in range(0, len(data), size)]
+
+
+async def _read(content):
+    if isinstance(content, bytes):
+        return content
+    return b"".join([chunk async for chunk in content])
+
+
+def test_small_body_stays_in_memory(make_request):
+    async def main():
+        body = await RequestBody.read(make_request(_chunks(PAYLOAD)), max_memory=len(PAYLOAD))
+        assert body.in_memory and body.data == PAYLOAD and body.size == len(PAYLOAD)
+        assert body.content() is body.data
+        body.close()
+
+    asyncio.run(main())
+
+
+def test_large_body_is_spilled_and_can_be_replayed(make_request):
+    async def main():
+        body = await RequestBody.read(make_request(_chunks(PAYLOAD)), max_memory=4096)
+        try:
+            assert not body.in_memory and body.data is None and body.size == len(PAYLOAD)
+            assert bytes(body.view()) == PAYLOAD
+            # Every call starts over, e.g. for the next backend after a failover
+            assert await _read(body.content()) == PAYLOAD
+            assert await _read(body.content()) == PAYLOAD
+        finally:
+            body.close()
+
+    asyncio.run(main())
+
+
+def test_close_removes_the_spill_file(make_request):
+    async def main():
+        body = await RequestBody.read(make_request(_chunks(PAYLOAD)), max_memory=4096)
+        spill = body._file
+        body.view()
+        body.close()
+        assert spill.closed and body._file is None and body._map is None
+        body.close()   # closing twice is harmless
+
+    asyncio.run(main())
+
+
+def test_spilled_body_is_sent_again_on_failover(make_request, stub_backends):
+    async def main():
+        received = []
+
+        async def handler(request):
+            received.append((request.url.host, await request.aread(), request.headers.get("content-length")))
+            return httpx.Response(503 if request.url.host == "first" else 200, content=b"{}")
+
+        stub_backends.route(handler)
+        body = await RequestBody.read(make_request(_chunks(PAYLOAD)), max_memory=4096)
+        try:
+            with pytest.raises(base.BackendUnavailableError):
+                await stub_backends.backend("http://first").forward_request(
+                    make_request(), "v1/completions", allow_failover=True, body=body)
+            response = await stub_backends.backend("http://second").forward_request(
+                make_request(), "v1/completions", body=body)
+        finally:
+            body.close()
+        assert response.status_code == 200
+        assert received == [("first", PAYLOAD, str(len(PAYLOAD))), ("second", PAYLOAD, str(len(PAYLOAD)))]
+
+    asyncio.run(main())
+
+
+def test_body_detection_from_headers(make_request, monkeypatch):
+    assert not has_body(make_request(headers={"content-length": "0"}))
+    assert has_body(make_request(headers={"transfer-encoding": "chunked"}))
+    assert has_body(make_request())   # a POST without either header, e.g. over HTTP/2
+    assert not has_body(make_request(method="GET"))
+
+    monkeypatch.setattr(request_body, "REQUEST_BODY_MAX_MEMORY_BYTES", 100)
+    assert is_small_body(make_request(headers={"content-length": "100"}))
+    assert not is_small_body(make_request(headers={"content-length": "101"}))
+    assert not is_small_body(make_request(headers={"transfer-encoding": "chunked"}))
@@ -0,0 +1,118 @@
+import asyncio
+
+from fastapi import Response
+from fastapi.responses import StreamingResponse
+
+from inference_engine_proxy_server.core.response_cache import CACHE_HEADER, ResponseCache
+
+DONE = b"data: [DONE]\n\n"
+
+
+def _streaming(chunks, gate=None):
+    async def body():
+        for chunk in chunks:
+            if gate is not None:
+                await gate.get()
+            yield chunk
+    return StreamingResponse(body())
+
+
+async def _drain(iterator):
+    return b"".join([chunk async for chunk in iterator])
+
+
+def test_follower_waits_on_leader_flight():
+    async def main():
+        cache = ResponseCache()
+        released = asyncio.Event()
+        calls = 0
+
+        async def forward():
+            nonlocal calls
+            calls += 1
+            await released.wait()
+            return Response(b'{"data": []}')
+
+        leader = asyncio.create_task(cache.fetch("k", forward))
+        await asyncio.sleep(0)
+        follower = asyncio.create_task(cache.fetch("k", forward))
+        await asyncio.sleep(0)
+        released.set()
+        first, second = await leader, await follower
+        assert calls == 1
+        assert second.body == first.body
+        assert second.headers[CACHE_HEADER] == "coalesced"
+        assert (await cache.fetch("k", forward)).headers[CACHE_HEADER] == "hit"
+
+    asyncio.run(main())
+
+
+def test_follower_reads_streamed_flight_and_entry_is_stored():
+    async def main():
+        cache = ResponseCache()
+        gate = asyncio.Queue()
+        chunks = [b"data: 1\n\n", b"data: 2\n\n", DONE]
+        leader = await cache.fetch("k", lambda: _async(_streaming(chunks, gate)))
+        follower = await cache.fetch("k", lambda: _async(_streaming(chunks)))
+        assert follower.headers[CACHE_HEADER] == "coalesced"
+
+        reading = asyncio.create_task(_drain(follower.body_iterator))
+        for _ in chunks:
+            gate.put_nowait(None)
+        assert await _drain(leader.body_iterator) == b"".join(chunks)
+        assert await reading == b"".join(chunks)
+        assert cache.get("k").body == b"".join(chunks)
+
+    asyncio.run(main())
+
+
+def test_leader_closed_before_iterating_ends_flight():
+    async def main():
+        cache = ResponseCache()
+        leader = await cache.fetch("k", lambda: _async(_streaming([b"data: 1\n\n", DONE])))
+        await leader.body_iterator.aclose()   # the client left before the first write
+        assert cache._flights == {}
+        assert cache.get("k") is None
+
+    asyncio.run(main())
+
+
+def test_follower_gives_up_on_silent_leader():
+    async def main():
+        cache = ResponseCache(follow_timeout=0.05)
+        never = asyncio.Event()
+
+        async def forward():
+            await never.wait()
+
+        leader = asyncio.create_task(cache.fetch("k", forward))
+        await asyncio.sleep(0)
+        calls = []
+
+        async def own():
+            calls.append(1)
+            return Response(b"own")
+
+        response = await cache.fetch("k", own)
+        assert response.body == b"own" and calls == [1]
+        leader.cancel()
+
+    asyncio.run(main())
+
+
+def test_oversized_stream_is_not_buffered_or_stored():
+    async def main():
+        cache = ResponseCache(max_entry_bytes=16)
+        chunks = [b"data: 0123456789\n\n"] * 3 + [DONE]
+        leader = await cache.fetch("k", lambda: _async(_streaming(chunks)))
+        flight = cache._flights["k"]
+        assert await _drain(leader.body_iterator) == b"".join(chunks)
+        assert not flight.cacheable
+        assert flight.chunks == []
+        assert cache.get("k") is None
+
+    asyncio.run(main())
+
+
+async def _async(value):
+    return value
@@ -0,0 +1,36 @@
+from collections import Counter
+
+from inference_engine_proxy_server.core import functions, strategies
+
+
+def _pick(count):
+    return Counter(functions._select_backend(None, None, None, None).backend_url for _ in range(count))
+
+
+def test_indexed_selection_spreads_over_equally_loaded_backends(backends):
+    urls = backends([1, 0, 2, 0, 0, 3], "least_requests")
+    picks = _pick(300)
+    assert set(picks) == {urls[1], urls[3], urls[4]}
+
+
+def test_indexed_selection_returns_single_minimum(backends):
+    urls = backends([1, 2, 0, 3], "least_requests")
+    assert set(_pick(50)) == {urls[2]}
+
+
+def test_p2c_samples_only_eligible_backends(backends):
+    urls = backends([0, None, 1, None, 2, 0, None, 1], "p2c")
+    picks = _pick(300)
+    assert not {urls[1], urls[3], urls[6]} & set(picks)
+    assert urls[4] not in picks   # the most loaded of any pair never wins
+
+
+def test_p2c_falls_back_to_scan_with_one_eligible_backend(backends):
+    urls = backends([None] * 20 + [1], "p2c")
+    assert set(_pick(20)) == {urls[-1]}
+
+
+def test_scanned_strategy_breaks_ties_at_random():
+    candidates = [("http://a", 0.0), ("http://b", 0.0), ("http://c", 1.0)]
+    picks = Counter(strategies.LeastRequestsStrategy().select(candidates) for _ in range(200))
+    assert set(picks) == {"http://a", "http://b"}
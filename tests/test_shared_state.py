@@ -0,0 +1,78 @@
+import asyncio
+
+import pytest
+
+pytest.importorskip("fcntl")
+
+from inference_engine_proxy_server.core import shared_state
+from inference_engine_proxy_server.core.shared_state import _SEQ, SharedState
+
+
+def _open(tmp_path, backends=("http://a",)):
+    return SharedState(str(tmp_path / "state"), list(backends), worker_rows=4, slots=4)
+
+
+def test_read_skips_record_left_odd_by_dead_writer(tmp_path):
+    state = _open(tmp_path)
+    state.publish_dynamic("http://a", {"timestamp": 1.0, "ready": True})
+    assert state._read_dynamic(0) is not None
+    offset = state._dynamic_offset
+    seq = _SEQ.unpack_from(state._mm, offset)[0]
+    _SEQ.pack_into(state._mm, offset, seq + 1)   # the writer died mid-write
+
+    assert state._read_dynamic(0) is None
+
+    # The next leader's write makes the record consistent again
+    state.publish_dynamic("http://a", {"timestamp": 2.0, "ready": True})
+    new_seq, values = state._read_dynamic(0)
+    assert new_seq % 2 == 0 and new_seq > seq
+    assert values[0] == 2.0
+
+
+def test_release_keeps_slot_while_another_worker_has_requests(tmp_path):
+    first = _open(tmp_path)
+    second = _open(tmp_path)
+    second.row = 1   # POSIX locks do not separate rows within one process
+    first.add_inflight("http://a", 1)
+    second.add_inflight("http://a", 2)
+
+    first.release("http://a")
+    assert first._slot_url(0) == "http://a"
+    assert second.total_inflight("http://a") == 2
+
+    second.add_inflight("http://a", -2)
+    second.release("http://a")
+    assert second._slot_url(0) == ""
+
+
+def test_release_drops_own_leftover_requests(tmp_path):
+    state = _open(tmp_path)
+    state.add_inflight("http://a", 3)
+    state.release("http://a")
+    assert state._slot_url(0) == ""
+
+
+def test_crashed_refresh_loop_is_restarted(tmp_path, monkeypatch):
+    state = _open(tmp_path)
+    monkeypatch.setattr(shared_state, "_state", state)
+    monkeypatch.setattr(shared_state, "SHARED_STATE_SYNC_INTERVAL_SECONDS", 0.01)
+    monkeypatch.setattr(shared_state, "LEADER_RETRY_SECONDS", 0.01)
+    runs = []
+
+    async def refresh_loop():
+        runs.append(1)
+        if len(runs) == 1:
+            raise RuntimeError("boom")
+        await asyncio.sleep(3600)
+
+    async def main():
+        task = asyncio.create_task(shared_state.run(refresh_loop))
+        for _ in range(200):
+            if len(runs) >= 2:
+                break
+            await asyncio.sleep(0.01)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+    asyncio.run(main())
+    assert len(runs) == 2
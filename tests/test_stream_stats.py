@@ -0,0 +1,50 @@
+import asyncio
+
+from inference_engine_proxy_server.core import stream_stats
+from inference_engine_proxy_server.core.stream_stats import BackendStreamStats, StreamRecorder
+from inference_engine_proxy_server.core.streaming import coalesce_chunks
+
+
+def _recorder():
+    return StreamRecorder(BackendStreamStats(), start=0.0)
+
+
+def test_events_are_counted_by_line():
+    recorder = _recorder()
+    recorder.feed(b'data: {"text": "data: data:"}\n\n', 1.0)
+    assert recorder.stats.ttft.total == 1
+    recorder.feed(b'data: {"a": 1}\n\ndata: {"a": 2}\n\n', 2.0)
+    assert recorder.stats.inter_token.total == 2
+    recorder.feed(b"data: [DONE]\n\n", 3.0)
+    assert recorder.stats.inter_token.total == 2
+    assert recorder.last_event == 2.0
+
+
+def test_line_split_across_chunks_counts_once_when_complete():
+    recorder = _recorder()
+    recorder.feed(b"da", 1.0)
+    recorder.feed(b'ta: {"a"', 1.5)
+    assert recorder.last_event is None
+    recorder.feed(b': 1}\n\nda', 2.0)
+    assert recorder.last_event == 2.0 and recorder.stats.ttft.total == 1
+    recorder.feed(b"ta: [DO", 2.5)
+    recorder.feed(b"NE]\n\n", 3.0)
+    assert recorder.last_event == 2.0
+
+
+def test_events_are_timed_before_coalescing():
+    async def main():
+        recorder = _recorder()
+
+        async def upstream():
+            for i in range(4):
+                yield b'data: {"i": %d}\n\n' % i
+                await asyncio.sleep(0.01)
+
+        merged = coalesce_chunks(stream_stats.timed(recorder, upstream()), 1 << 20, 0.2)
+        writes = [chunk async for chunk in merged]
+        assert len(writes) < 4
+        # Every upstream event was seen on its own, not once per merged write
+        assert recorder.stats.ttft.total + recorder.stats.inter_token.total == 4
+
+    asyncio.run(main())
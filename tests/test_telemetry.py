@@ -0,0 +1,64 @@
+import logging
+
+import pytest
+from fastapi.testclient import TestClient
+
+from inference_engine_proxy_server import server
+from inference_engine_proxy_server.core import telemetry
+
+BACKEND = "http://telemetry-test:8080"
+
+
+@pytest.fixture(autouse=True)
+def single_process(monkeypatch):
+    for name in ("PROMETHEUS_MULTIPROC_DIR", "prometheus_multiproc_dir"):
+        monkeypatch.delenv(name, raising=False)
+    yield
+    telemetry.forget_backend(BACKEND)
+
+
+def test_backend_series_are_exported_until_the_backend_is_forgotten():
+    metrics = telemetry.backend_metrics(BACKEND)
+    assert telemetry.backend_metrics(BACKEND) is metrics
+    metrics.count_request(200)
+    metrics.count_request(200)
+    metrics.count_request("error")
+    metrics.ttfb.observe(0.2)
+
+    text = telemetry.render().decode()
+    assert f'proxy_upstream_requests_total{{backend="{BACKEND}",status="200"}} 2.0' in text
+    assert f'proxy_upstream_requests_total{{backend="{BACKEND}",status="error"}} 1.0' in text
+    assert f'proxy_upstream_ttfb_seconds_count{{backend="{BACKEND}"}} 1.0' in text
+
+    telemetry.forget_backend(BACKEND)
+    assert BACKEND not in telemetry.render().decode()
+    telemetry.forget_backend(BACKEND)   # forgetting twice is harmless
+
+
+def test_metrics_endpoint():
+    telemetry.backend_metrics(BACKEND).count_request(503)
+    response = TestClient(server.app).get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    assert f'proxy_upstream_requests_total{{backend="{BACKEND}",status="503"}} 1.0' in response.text
+    assert "# TYPE proxy_admission_queue_depth gauge" in response.text
+
+
+def test_several_workers_without_multiprocess_dir_warn(caplog):
+    with caplog.at_level(logging.WARNING, logger="telemetry"):
+        telemetry.check_multiprocess(1)
+        assert not caplog.records
+        telemetry.check_multiprocess(2)
+    assert "PROMETHEUS_MULTIPROC_DIR is not set" in caplog.text
+
+
+def test_multiprocess_dir_must_exist(monkeypatch, tmp_path, caplog):
+    monkeypatch.setenv("PROMETHEUS_MULTIPROC_DIR", str(tmp_path / "missing"))
+    with pytest.raises(RuntimeError):
+        telemetry.check_multiprocess(2)
+
+    monkeypatch.setenv("PROMETHEUS_MULTIPROC_DIR", str(tmp_path))
+    with caplog.at_level(logging.WARNING, logger="telemetry"):
+        telemetry.check_multiprocess(2)
+    assert not caplog.records
+    assert telemetry.multiprocess_dir() == str(tmp_path)
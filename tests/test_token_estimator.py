@@ -0,0 +1,69 @@
+import asyncio
+import json
+
+from inference_engine_proxy_server.core.request_body import RequestBody
+from inference_engine_proxy_server.core.token_estimator import TOKENS_PER_MESSAGE, TokenEstimator, approximate_tokens
+
+
+def _estimator():
+    # Without load() the character heuristic is used, so the counts do not depend on tiktoken
+    return TokenEstimator(default_max_tokens=512)
+
+
+def test_approximate_tokens_counts_cjk_per_character():
+    assert approximate_tokens("a" * 400) == 101
+    assert approximate_tokens("字" * 10) == 11
+
+
+def test_chat_request_needs_its_prompt_and_max_tokens():
+    data = {"messages": [{"role": "system", "content": "a" * 400},
+                         {"role": "user", "content": [{"type": "text", "text": "b" * 40}, {"type": "image_url"}]}],
+            "max_tokens": 100}
+    estimate = _estimator().estimate_data("v1/chat/completions", data)
+    prompt = approximate_tokens("a" * 400) + approximate_tokens("b" * 40) + 2 * TOKENS_PER_MESSAGE
+    assert estimate == (prompt, 100, prompt + 100)
+
+
+def test_default_and_parallel_completions():
+    estimate = _estimator().estimate_data("v1/completions", {"prompt": "a" * 40, "n": 3})
+    # Without max_tokens only the prompt has to fit; the load estimate assumes the default length
+    assert estimate == (11, 3 * 512, 11)
+    estimate = _estimator().estimate_data("v1/completions", {"prompt": [1, 2, 3], "max_tokens": 5})
+    assert estimate == (3, 5, 8)
+
+
+def test_batches_and_embeddings_have_no_context_size():
+    estimate = _estimator().estimate_data("v1/completions", {"prompt": ["a" * 40, "b" * 40], "max_tokens": 5})
+    assert estimate.prompt_tokens == 22 and estimate.context_tokens is None
+    estimate = _estimator().estimate_data("v1/embeddings", {"input": "a" * 40})
+    assert estimate == (11, 0, None)
+
+
+def test_counts_are_cached():
+    estimator = _estimator()
+    assert estimator.count("hello world") == estimator.count("hello world")
+    assert len(estimator._cache) == 1
+
+
+def test_unparsed_bodies_are_estimated_by_size(make_request):
+    async def main():
+        estimator = _estimator()
+        payload = json.dumps({"messages": [{"role": "user", "content": "a" * 8000}]}).encode()
+        body = await RequestBody.read(make_request(payload), max_memory=1024)
+        try:
+            estimate = await estimator.estimate("v1/chat/completions", make_request(), body)
+        finally:
+            body.close()
+        assert estimate == (len(payload) // 4, 512, None)
+
+        request = make_request(headers={"content-length": "4000"})
+        assert await estimator.estimate("v1/chat/completions", request, None) == (1000, 512, None)
+        # The encoder is loaded at startup, not by requests
+        assert not estimator._loading
+
+    asyncio.run(main())
+
+
+def test_invalid_json_is_estimated_by_size():
+    estimate = _estimator().estimate_body("v1/chat/completions", b"not json" * 10)
+    assert estimate == (20, 512, None)